@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, TextIO
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import config
+
+
+_STOP = object()
+# Records written per stream write, at most
+_WRITE_BATCH = 512
+
+
+class AccessLogger:
+    """Structured access log written by a background thread.
+
+    Requests only decide whether to log and put a small dict on a bounded
+    queue; formatting the JSON line and writing it happen on the writer
+    thread, so a slow or blocked stream never stalls the event loop. When
+    the queue is full the record is dropped and counted instead. Lines go
+    to stderr unless ``path`` is set, leaving stdout to the application
+    (scripts/bench_suite.py prints its results there).
+
+    Successful requests are logged with probability ``sample_rate``; errors
+    (status >= 400 or an exception) and requests taking ``slow_ms`` or more
+    are always logged. Each line carries ``reason`` (``error``, ``slow`` or
+    ``sampled``) and the sample rate, so sampled counts can be scaled back.
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        sample_rate: Optional[float] = None,
+        slow_ms: Optional[float] = None,
+        queue_size: Optional[int] = None,
+        path: Optional[str] = None,
+        stream: Optional[TextIO] = None,
+    ) -> None:
+        self.enabled = enabled if enabled is not None else config.ACCESS_LOG_ENABLED
+        self.sample_rate = sample_rate if sample_rate is not None else config.ACCESS_LOG_SAMPLE_RATE
+        self.slow_ms = slow_ms if slow_ms is not None else config.ACCESS_LOG_SLOW_MS
+        self.path = path if path is not None else config.ACCESS_LOG_FILE
+        self.stream = stream
+        self._owns_stream = False
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size or config.ACCESS_LOG_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.write_errors = 0
+
+    def should_log(self, status: int, duration: float) -> Optional[str]:
+        """Why a request is logged, or None to skip it."""
+        if status >= 400:
+            return "error"
+        if duration * 1000 >= self.slow_ms:
+            return "slow"
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return "sampled"
+        self.skipped += 1
+        return None
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        """Queue ``record`` for the writer; never blocks."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        if self.stream is None:
+            self._owns_stream = bool(self.path)
+            self.stream = open(self.path, "a", encoding="utf-8") if self.path else sys.stderr
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Write out what is queued and stop the writer."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            # The writer is behind; it checks _stopping once the queue is empty
+            pass
+        self._thread.join(timeout)
+        # A writer still busy after ``timeout`` keeps its file open
+        finished = not self._thread.is_alive()
+        self._thread = None
+        if self._owns_stream and finished:
+            self.stream.close()
+            self.stream = None
+            self._owns_stream = False
+
+    def _run(self) -> None:
+        while True:
+            if self._stopping.is_set() and self._queue.empty():
+                return
+            batch = [self._queue.get()]
+            while len(batch) < _WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not _STOP]
+            if records:
+                self._write(records)
+            if len(records) < len(batch):
+                return
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        lines = []
+        for record in records:
+            record["ts"] = datetime.fromtimestamp(record["ts"], timezone.utc).isoformat(timespec="milliseconds")
+            lines.append(json.dumps(record, separators=(",", ":"), default=str))
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self.written += len(lines)
+        except Exception:
+            self.write_errors += len(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+        }
+
+
+class AccessLogMiddleware:
+    """Hands one record per finished HTTP request to ``logger``; see AccessLogger."""
+
+    def __init__(self, app: ASGIApp, logger: AccessLogger) -> None:
+        self.app = app
+        self.logger = logger
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        logger = self.logger
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not logger.enabled:
+            try:
+                await self.app(scope, receive, send)
+            except Exception as exc:
+                _log_unhandled(scope, exc)
+                raise
+            return
+        started_at = time.time()
+        started = time.perf_counter()
+        status = 500
+        error: Optional[str] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            error = traceback.format_exc()
+            _log_unhandled(scope, exc)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            reason = "error" if error is not None else logger.should_log(status, duration)
+            if reason is not None:
+                client = scope.get("client")
+                record = {
+                    "ts": started_at,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(scope.get("route"), "path", None),
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 3),
+                    "client": client[0] if client else None,
+                    "reason": reason,
+                    "sample_rate": logger.sample_rate,
+                }
+                if error is not None:
+                    record["error"] = error
+                logger.submit(record)
+
+
+def _log_unhandled(scope: Scope, exc: Exception) -> None:
+    # Tracebacks also go to the server's error log, sampled access log or not
+    logging.getLogger("uvicorn.error").exception("Unhandled error on %s %s: %s", scope["method"], scope["path"], exc)
+
+
+access_log = AccessLogger()
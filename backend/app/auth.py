@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Annotated, Optional
+from typing import Annotated, Any, Callable, Dict, Optional, TypeVar
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -9,11 +11,17 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from . import config
-from .db import users_collection
+from . import db as db_module
+from .authcache import claims_cache, user_cache
+from .metrics import mongo_timer
+from .profiling import span
+from .ws import USERS_TOPIC, manager
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+# What request handlers get as the current user; never the password hash
+CURRENT_USER_PROJECTION = {"username": 1, "email": 1, "disabled": 1}
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -24,6 +32,96 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+T = TypeVar("T")
+
+
+class HashPool:
+    """Runs bcrypt off the event loop on a few dedicated threads.
+
+    One bcrypt call takes 100-300 ms of CPU; inline in a handler it stalls
+    every request and socket on the worker. The bcrypt backend releases the
+    GIL, so threads are enough. At most ``workers`` calls run and
+    ``queue_limit`` wait; beyond that callers get a 503 straight away rather
+    than queueing behind a login storm.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_limit: Optional[int] = None) -> None:
+        self.workers = workers or config.AUTH_HASH_WORKERS
+        self.queue_limit = queue_limit if queue_limit is not None else config.AUTH_HASH_QUEUE_LIMIT
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests",
+                headers={"Retry-After": "1"},
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        future = self._executor.submit(fn, *args)
+        # The slot is held until the thread is done with it, not until the
+        # caller stops waiting: a disconnected client's bcrypt still runs
+        future.add_done_callback(lambda f: self._finished(loop, f))
+        # Queueing for a worker included, which is what the request waits for
+        with span("bcrypt", fn.__name__):
+            return await asyncio.wrap_future(future)
+
+    def _finished(self, loop: asyncio.AbstractEventLoop, future: "Future[Any]") -> None:
+        # Runs on the bcrypt thread (or the loop, for a call cancelled while queued)
+        try:
+            loop.call_soon_threadsafe(self._release, future)
+        except RuntimeError:
+            # Loop closed at shutdown; nothing is left to admit
+            pass
+
+    def _release(self, future: "Future[Any]") -> None:
+        self.in_flight -= 1
+        if future.cancelled():
+            self.cancelled += 1
+        elif future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
+
+
+hash_pool = HashPool()
+
+
+async def hash_password(password: str) -> str:
+    """get_password_hash on the hash pool; 503 when the pool is saturated."""
+    return await hash_pool.run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hash pool; 503 when the pool is saturated."""
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
+
+
 def create_access_token(subject: str, expires_delta: Optional[timedelta] = None) -> str:
     if not config.SECRET_KEY:
         raise RuntimeError("SECRET_KEY is not set. Define it in .env before starting the server.")
@@ -42,19 +140,41 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, config.SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
-        subject: str | None = payload.get("sub")
-        if subject is None:
+    # Steady state: both lookups hit, so no signature check and no DB read
+    subject = claims_cache.get(token)
+    if subject is None:
+        try:
+            payload = jwt.decode(token, config.SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
+            subject = payload.get("sub")
+            if subject is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    if users_collection is None:
-        raise HTTPException(status_code=503, detail="Database not initialized")
-    user = await users_collection.find_one({"_id": subject}) or await users_collection.find_one({"username": subject})
-    if not user:
-        raise credentials_exception
+        claims_cache.put(token, subject, payload.get("exp"))
+
+    user = user_cache.get(subject)
+    if user is None:
+        users_collection = db_module.users_collection
+        if users_collection is None:
+            raise HTTPException(status_code=503, detail="Database not initialized")
+        with mongo_timer(config.COLLECTION_USERS, "find_one"):
+            user = await users_collection.find_one({"_id": subject}, CURRENT_USER_PROJECTION) or await users_collection.find_one(
+                {"username": subject}, CURRENT_USER_PROJECTION
+            )
+        if not user:
+            raise credentials_exception
+        # Disabled users are cached too, so they keep getting a cheap 400
+        user_cache.put(subject, user)
     if user.get("disabled"):
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
+
+
+async def user_changed(user_id: Optional[str], username: Optional[str] = None) -> None:
+    """Call after writing to a user document (e.g. disabling it).
+
+    Drops the cached copy here and, through the backplane, on every other
+    worker, so the next request sees the change.
+    """
+    user_cache.invalidate((user_id, username))
+    await manager.broadcast({"type": "user.changed", "_id": user_id, "username": username}, topics=[USERS_TOPIC])
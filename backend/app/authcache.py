@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from . import config
+from .ws import USERS_TOPIC
+
+
+class ClaimsCache:
+    """Verified JWT subjects, kept until the token's own ``exp``.
+
+    Re-verifying the signature of a token seen before proves nothing new,
+    so a hit skips ``jwt.decode`` entirely. Tokens without ``exp`` are not
+    memoized.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None) -> None:
+        self.max_entries = max_entries or config.AUTH_CACHE_SIZE
+        # token -> (subject, exp)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[str]:
+        entry = self._entries.get(token)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, subject: str, exp: Any) -> None:
+        if not isinstance(exp, (int, float)):
+            return
+        self._entries[token] = (subject, float(exp))
+        self._entries.move_to_end(token)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class UserCache:
+    """Current-user documents by token subject, for ``ttl_seconds``.
+
+    Subjects are user ids (or usernames for older tokens), so
+    ``invalidate`` takes both. Writes to a user go through
+    ``auth.user_changed``, which reaches every worker's cache via the
+    WebSocket backplane; edits made straight in Mongo show up after the TTL.
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None) -> None:
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.AUTH_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or config.AUTH_CACHE_SIZE
+        # subject -> (stored_at, user document)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, subject: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(subject)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            if entry is not None:
+                del self._entries[subject]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(subject)
+        self.hits += 1
+        # Handlers get their own copy to modify
+        return dict(entry[1])
+
+    def put(self, subject: str, user: Dict[str, Any]) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        self._entries[subject] = (time.monotonic(), dict(user))
+        self._entries.move_to_end(subject)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, keys: Iterable[Optional[str]]) -> None:
+        self.invalidations += 1
+        for key in keys:
+            if key is not None:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def on_event(self, data: str, topics: Optional[Iterable[str]]) -> None:
+        """WebSocketManager listener for ``user.changed`` events from any worker."""
+        if topics is None:
+            # Sent to everyone, e.g. the resync after a lost backplane event
+            # that may have been a user change
+            self.clear()
+            return
+        if USERS_TOPIC not in topics:
+            return
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return
+        self.invalidate((event.get("_id"), event.get("username")))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+claims_cache = ClaimsCache()
+user_cache = UserCache()
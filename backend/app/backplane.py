@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from . import config
+
+
+# deliver(data, topics): hand an already serialised event to local sockets
+Deliver = Callable[[str, Optional[List[str]]], None]
+# on_loss(): events from another worker were lost and cannot be recovered
+OnLoss = Callable[[], None]
+
+
+class Backplane:
+    """Carries broadcasts between API worker processes.
+
+    ``publish`` must reach every worker, including the caller's, by invoking
+    the ``deliver`` callback registered in ``start``. A transport that can
+    lose events calls ``on_loss`` on the receiving worker once it notices,
+    so that it can drop whatever those events would have invalidated.
+    """
+
+    async def start(self, deliver: Deliver, on_loss: Optional[OnLoss] = None) -> None:
+        raise NotImplementedError
+
+    async def publish(self, data: str, topics: Optional[List[str]]) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class LocalBackplane(Backplane):
+    """Single process: publish is a direct local delivery."""
+
+    def __init__(self) -> None:
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver, on_loss: Optional[OnLoss] = None) -> None:
+        self._deliver = deliver
+
+    async def publish(self, data: str, topics: Optional[List[str]]) -> None:
+        if self._deliver is not None:
+            self._deliver(data, topics)
+
+
+class _Receiver(asyncio.DatagramProtocol):
+    def __init__(self, on_datagram: Callable[[bytes], None]) -> None:
+        self.on_datagram = on_datagram
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.on_datagram(data)
+
+
+class UnixSocketBackplane(Backplane):
+    """Hub-less fan-out over Unix datagram sockets in a shared directory.
+
+    Every worker binds ``<dir>/<id>.sock`` and publishes by sending one
+    datagram to each peer socket it finds there. Files left behind by dead
+    workers are removed the first time a send to them is refused. Sends are
+    non-blocking: a peer whose receive buffer is full misses that event, the
+    same trade-off as the per-connection queues.
+
+    Losses are detected rather than prevented. Every datagram carries the
+    sender's node id and a per-sender seq; a receiver that sees a seq jump
+    calls ``on_loss``. The last events before a quiet spell would go
+    unnoticed that way, so a sender that failed to reach a peer keeps
+    sending it a bare ``{node, seq}`` ping every ``RETRY_SECONDS`` until
+    one gets through. This matters most for the internal topics (read
+    cache and user invalidations), where a lost event would otherwise
+    leave a worker serving stale data until its TTL.
+    """
+
+    PEER_REFRESH_SECONDS = 1.0
+    RETRY_SECONDS = 0.05
+    # How long stop() keeps pinging peers that are still behind
+    STOP_GRACE_SECONDS = 1.0
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = Path(directory or config.WS_BACKPLANE_DIR)
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.path = self.directory / f"{self.node_id}.sock"
+        self._deliver: Optional[Deliver] = None
+        self._on_loss: Optional[OnLoss] = None
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._sender: Optional[socket.socket] = None
+        self._peers: List[str] = []
+        self._peers_at = 0.0
+        self._seq = 0
+        # Last seq seen from each sender
+        self._last_seen: Dict[str, int] = {}
+        # Peers that missed a datagram and have not been told yet
+        self._behind: Set[str] = set()
+        self._retry_task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.received = 0
+        self.send_failures = 0
+        self.losses = 0
+
+    async def start(self, deliver: Deliver, on_loss: Optional[OnLoss] = None) -> None:
+        self._deliver = deliver
+        self._on_loss = on_loss
+        self.directory.mkdir(parents=True, exist_ok=True)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(str(self.path))
+        receiver.setblocking(False)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Receiver(self._on_datagram), sock=receiver
+        )
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+    async def stop(self) -> None:
+        if self._retry_task is not None:
+            # Short-lived publishers (ingest_payloads) exit right after their last event
+            try:
+                await asyncio.wait_for(self._retry_task, self.STOP_GRACE_SECONDS)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._retry_task = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._sender is not None:
+            self._sender.close()
+            self._sender = None
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _on_datagram(self, raw: bytes) -> None:
+        try:
+            envelope = json.loads(raw)
+        except Exception:
+            return
+        node, seq = envelope.get("node"), envelope.get("seq")
+        if node is not None and seq is not None:
+            # Seqs start at 1, so a worker that joined late sees one spurious loss
+            last = self._last_seen.get(node, 0)
+            # A data datagram should be the next seq; a ping repeats the latest
+            if seq > (last + 1 if "data" in envelope else last):
+                self.losses += 1
+                if self._on_loss is not None:
+                    self._on_loss()
+            if seq > last:
+                self._last_seen[node] = seq
+        if "data" not in envelope:
+            return
+        self.received += 1
+        if self._deliver is not None:
+            self._deliver(envelope["data"], envelope.get("topics"))
+
+    def _peer_paths(self) -> List[str]:
+        now = time.monotonic()
+        if now - self._peers_at > self.PEER_REFRESH_SECONDS:
+            own = str(self.path)
+            self._peers = [str(p) for p in self.directory.glob("*.sock") if str(p) != own]
+            self._peers_at = now
+        return self._peers
+
+    async def publish(self, data: str, topics: Optional[List[str]]) -> None:
+        if self._deliver is not None:
+            self._deliver(data, topics)
+        if self._sender is None:
+            return
+        self._seq += 1
+        datagram = json.dumps({"node": self.node_id, "seq": self._seq, "data": data, "topics": topics}).encode("utf-8")
+        self._send(datagram, self._peer_paths())
+        self.published += 1
+
+    def _send(self, datagram: bytes, peers: List[str]) -> None:
+        stale: List[str] = []
+        for peer in peers:
+            try:
+                self._sender.sendto(datagram, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                stale.append(peer)
+            except OSError:
+                # Receiver buffer full (EAGAIN) or datagram too large
+                self.send_failures += 1
+                self._behind.add(peer)
+            else:
+                self._behind.discard(peer)
+        for peer in stale:
+            try:
+                os.unlink(peer)
+            except OSError:
+                pass
+        if stale:
+            self._peers_at = 0.0
+        self._behind.difference_update(stale)
+        if self._behind and self._retry_task is None:
+            self._retry_task = asyncio.ensure_future(self._retry())
+
+    async def _retry(self) -> None:
+        """Ping peers that missed a datagram until they learn of the gap."""
+        try:
+            while self._behind and self._sender is not None:
+                await asyncio.sleep(self.RETRY_SECONDS)
+                ping = json.dumps({"node": self.node_id, "seq": self._seq}).encode("utf-8")
+                self._send(ping, sorted(self._behind))
+        finally:
+            if self._retry_task is asyncio.current_task():
+                self._retry_task = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "node": self.node_id,
+            "peers": len(self._peers),
+            "published": self.published,
+            "received": self.received,
+            "send_failures": self.send_failures,
+            "peers_behind": len(self._behind),
+            "losses": self.losses,
+        }
+
+
+BACKPLANES = {
+    "local": LocalBackplane,
+    "unix": UnixSocketBackplane,
+}
+
+
+def create_backplane(kind: Optional[str] = None) -> Backplane:
+    kind = kind or config.WS_BACKPLANE
+    try:
+        return BACKPLANES[kind]()
+    except KeyError:
+        raise ValueError(f"Unknown WS_BACKPLANE: {kind}") from None
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from . import config
+
+
+# Change kinds recorded by every write path
+MESSAGE_INSERTED = "message.inserted"
+MESSAGE_STATUS = "message.status"
+CONVERSATION_UPDATED = "conversation.updated"
+
+Change = Tuple[str, Optional[str], Dict[str, Any]]
+# Hook receiving the changes of a write, e.g. to publish them to live clients
+OnChanges = Callable[[List[Change]], Awaitable[None]]
+
+_COUNTER_ID = "changes"
+
+
+class ChangeLog:
+    """Append-only log of writes, addressed by a monotonically increasing seq.
+
+    Each entry is ``{_id: seq, kind, waId, data, at}``. Sequence numbers come
+    from a counter document, allocated in blocks so that one write can log
+    several related changes with a single extra round trip.
+    """
+
+    def __init__(self, changes, counters) -> None:
+        self.changes = changes
+        self.counters = counters
+
+    async def append(self, *entries: Change) -> int:
+        entries = tuple(e for e in entries if e[2] is not None)
+        if not entries:
+            return await self.current()
+        counter = await self.counters.find_one_and_update(
+            {"_id": _COUNTER_ID},
+            {"$inc": {"seq": len(entries)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        last = int(counter["seq"])
+        first = last - len(entries) + 1
+        now = datetime.now(timezone.utc)
+        await self.changes.insert_many(
+            [
+                {"_id": first + i, "kind": kind, "waId": wa_id, "data": data, "at": now}
+                for i, (kind, wa_id, data) in enumerate(entries)
+            ],
+            ordered=True,
+        )
+        return last
+
+    async def current(self) -> int:
+        counter = await self.counters.find_one({"_id": _COUNTER_ID}, {"seq": 1})
+        return int(counter["seq"]) if counter else 0
+
+    async def oldest(self) -> Optional[int]:
+        doc = await self.changes.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+        return int(doc["_id"]) if doc else None
+
+    async def since(self, token: int, limit: int, grace_seconds: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Entries after ``token``, oldest first, up to the first gap.
+
+        A seq is allocated before its entry is inserted, so with concurrent
+        writers seq N+1 can become visible before N. Reading past the hole
+        would move the client's token beyond N for good. A gap is only
+        skipped once the entry after it is ``grace_seconds`` old, by which
+        time the missing entry belongs to a write that failed.
+        """
+        grace = timedelta(seconds=config.CHANGELOG_GAP_GRACE_SECONDS if grace_seconds is None else grace_seconds)
+        cursor = self.changes.find({"_id": {"$gt": token}}).sort("_id", 1).limit(limit)
+        rows = await cursor.to_list(length=limit)
+        now = datetime.now(timezone.utc)
+        expected = token + 1
+        for i, row in enumerate(rows):
+            if row["_id"] != expected:
+                at = row.get("at")
+                if at is not None and at.tzinfo is None:
+                    # Motor returns naive UTC datetimes by default
+                    at = at.replace(tzinfo=timezone.utc)
+                if at is None or now - at < grace:
+                    rows = rows[:i]
+                    break
+            expected = row["_id"] + 1
+        for row in rows:
+            row.pop("at", None)
+        return rows
+
+
+async def ensure_indexes(changes) -> None:
+    # Old entries expire; clients further behind than this get reset=True
+    await changes.create_index("at", expireAfterSeconds=config.CHANGELOG_RETENTION_SECONDS)
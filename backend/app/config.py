@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import tempfile
 from typing import List
 
 from dotenv import load_dotenv
@@ -24,8 +25,134 @@ CORS_ORIGINS: List[str] = parse_cors(CORS_ORIGINS_RAW)
 DATABASE_NAME: str = "whatsapp"
 COLLECTION_MESSAGES: str = "processed_messages"
 COLLECTION_USERS: str = "users"
+COLLECTION_CONVERSATIONS: str = "conversations"
+COLLECTION_CHANGES: str = "changes"
+COLLECTION_COUNTERS: str = "counters"
+COLLECTION_PENDING_STATUSES: str = "pending_statuses"
+COLLECTION_INGEST_CHECKPOINTS: str = "ingest_checkpoints"
+COLLECTION_WEBHOOK_SPOOL: str = "webhook_spool"
+# Leases that let one worker at a time rebuild summaries or drain the spool
+COLLECTION_LEASES: str = "leases"
+# Serve GET /conversations from a covering index instead of the summary
+# documents. Costs a wider index on every summary write, and message texts
+# must fit the server's index key size limit.
+CONVERSATIONS_COVERED_INDEX: bool = os.getenv("CONVERSATIONS_COVERED_INDEX", "false").lower() in ("1", "true", "yes")
+# How long /sync can replay changes before a client must do a full reload
+CHANGELOG_RETENTION_SECONDS: int = int(os.getenv("CHANGELOG_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# A hole in the change log (seq allocated, entry not written yet) holds /sync
+# back for this long before it is assumed to be a failed write and skipped
+CHANGELOG_GAP_GRACE_SECONDS: float = float(os.getenv("CHANGELOG_GAP_GRACE_SECONDS", "5"))
 
 # JWT / Auth settings
 SECRET_KEY: str | None = get_env_optional("SECRET_KEY")
 JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+
+# WebSocket fan-out: per-connection send queue size and what to do when it is full
+# ("drop": discard the oldest queued event, "coalesce": replace the backlog with
+# a single resync event, "disconnect": close the slow socket)
+WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+
+# Cross-worker broadcast transport: "local" (single process) or "unix" (every
+# uvicorn worker on this host, via datagram sockets in WS_BACKPLANE_DIR)
+WS_BACKPLANE: str = os.getenv("WS_BACKPLANE", "local")
+WS_BACKPLANE_DIR: str = os.getenv(
+    "WS_BACKPLANE_DIR", os.path.join(tempfile.gettempdir(), "whatsapp-ws-backplane")
+)
+
+# Statuses that arrive before their message wait this long for it; beyond
+# PENDING_STATUS_MEMORY_LIMIT entries they spill to COLLECTION_PENDING_STATUSES
+PENDING_STATUS_TTL_SECONDS: int = int(os.getenv("PENDING_STATUS_TTL_SECONDS", str(24 * 3600)))
+PENDING_STATUS_MEMORY_LIMIT: int = int(os.getenv("PENDING_STATUS_MEMORY_LIMIT", "10000"))
+
+# POST /webhook micro-batcher: a batch is written once it holds
+# WEBHOOK_BATCH_SIZE records or its oldest record is WEBHOOK_BATCH_DELAY_MS old.
+# Beyond WEBHOOK_QUEUE_LIMIT unwritten records the endpoint answers 503.
+WEBHOOK_BATCH_SIZE: int = int(os.getenv("WEBHOOK_BATCH_SIZE", "500"))
+WEBHOOK_BATCH_DELAY_MS: int = int(os.getenv("WEBHOOK_BATCH_DELAY_MS", "50"))
+WEBHOOK_QUEUE_LIMIT: int = int(os.getenv("WEBHOOK_QUEUE_LIMIT", "20000"))
+# A failed batch write is retried after WEBHOOK_RETRY_BASE_MS, doubling up to
+# WEBHOOK_RETRY_MAX_MS; meanwhile the endpoint answers 503. Failed records
+# that no longer fit the queue wait in COLLECTION_WEBHOOK_SPOOL.
+WEBHOOK_RETRY_BASE_MS: int = int(os.getenv("WEBHOOK_RETRY_BASE_MS", "100"))
+WEBHOOK_RETRY_MAX_MS: int = int(os.getenv("WEBHOOK_RETRY_MAX_MS", "5000"))
+# POST /webhook only accepts bodies signed like the provider signs them:
+# X-Hub-Signature-256 is "sha256=" + HMAC-SHA256(WEBHOOK_APP_SECRET, raw body).
+# Without a secret the endpoint answers 404. GET /webhook echoes hub.challenge
+# when hub.verify_token equals WEBHOOK_VERIFY_TOKEN (subscription handshake).
+# Bodies over WEBHOOK_MAX_BODY_BYTES are refused with 413 before parsing.
+WEBHOOK_APP_SECRET: str = os.getenv("WEBHOOK_APP_SECRET", "")
+WEBHOOK_VERIFY_TOKEN: str = os.getenv("WEBHOOK_VERIFY_TOKEN", "")
+WEBHOOK_MAX_BODY_BYTES: int = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024)))
+
+# Duplicate suppression for webhook retries and replayed archives: the last
+# DEDUP_CACHE_SIZE record keys are remembered for DEDUP_TTL_SECONDS. A
+# DEDUP_BLOOM_CAPACITY > 0 keeps older keys in a Bloom filter as well, at a
+# false-positive (wrongly skipped record) rate of DEDUP_BLOOM_ERROR_RATE.
+DEDUP_CACHE_SIZE: int = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+DEDUP_TTL_SECONDS: int = int(os.getenv("DEDUP_TTL_SECONDS", str(24 * 3600)))
+DEDUP_BLOOM_CAPACITY: int = int(os.getenv("DEDUP_BLOOM_CAPACITY", "0"))
+DEDUP_BLOOM_ERROR_RATE: float = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.000001"))
+
+# GET /conversations and /messages: identical concurrent requests share one
+# query, and results are reused for READ_CACHE_TTL_SECONDS unless a write to
+# that conversation (or the list) is broadcast first. 0 keeps only the sharing.
+# For as long, If-None-Match matching the result's ETag is answered 304 without
+# a query; the TTL also bounds how long a write whose broadcast was lost (or
+# never sent, like offline ingestion without a backplane) can go unseen.
+READ_CACHE_TTL_SECONDS: float = float(os.getenv("READ_CACHE_TTL_SECONDS", "2"))
+READ_CACHE_SIZE: int = int(os.getenv("READ_CACHE_SIZE", "1024"))
+
+# GET /events (server-sent events) and GET /events/poll (long-poll): the last
+# EVENTS_HISTORY_SIZE broadcasts are kept per worker so reconnecting clients
+# can catch up; idle streams get a comment line every EVENTS_HEARTBEAT_SECONDS.
+EVENTS_HISTORY_SIZE: int = int(os.getenv("EVENTS_HISTORY_SIZE", "1024"))
+EVENTS_HEARTBEAT_SECONDS: float = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_POLL_MAX_SECONDS: float = float(os.getenv("EVENTS_POLL_MAX_SECONDS", "30"))
+
+# get_current_user caches user documents for AUTH_CACHE_TTL_SECONDS (changes
+# made through auth.user_changed apply at once) and verified token claims
+# until they expire; both caches hold at most AUTH_CACHE_SIZE entries.
+AUTH_CACHE_TTL_SECONDS: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+# bcrypt (register/login) runs on AUTH_HASH_WORKERS threads; with that many
+# running and AUTH_HASH_QUEUE_LIMIT more waiting, further calls get a 503
+AUTH_HASH_WORKERS: int = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_QUEUE_LIMIT: int = int(os.getenv("AUTH_HASH_QUEUE_LIMIT", "16"))
+
+# GET /metrics: per-route request counts and latency histograms, database
+# call timings, WebSocket and ingestion figures in the Prometheus text format
+METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# GET /metrics, /debug/profile and the /*/stats endpoints expose internals, so
+# they answer 404 unless OPS_TOKEN is set, and then only to requests carrying
+# "Authorization: Bearer <OPS_TOKEN>" (Prometheus: authorization.credentials)
+OPS_TOKEN: str = os.getenv("OPS_TOKEN", "")
+
+# Opt-in profiling for slow requests (off by default). PROFILE_SAMPLE_RATE of
+# requests are traced; those taking PROFILE_SLOW_MS or more are reported with
+# their database, validation and serialization spans. An event-loop lag
+# monitor wakes every PROFILE_LAG_INTERVAL_MS and reports wake-ups at least
+# PROFILE_LAG_THRESHOLD_MS late. The last PROFILE_BUFFER_SIZE reports are
+# served by GET /debug/profile and, if PROFILE_OUTPUT names a file, appended
+# to it as JSON lines.
+PROFILE_ENABLED: bool = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+PROFILE_SLOW_MS: float = float(os.getenv("PROFILE_SLOW_MS", "200"))
+PROFILE_LAG_INTERVAL_MS: float = float(os.getenv("PROFILE_LAG_INTERVAL_MS", "100"))
+PROFILE_LAG_THRESHOLD_MS: float = float(os.getenv("PROFILE_LAG_THRESHOLD_MS", "50"))
+PROFILE_BUFFER_SIZE: int = int(os.getenv("PROFILE_BUFFER_SIZE", "256"))
+PROFILE_OUTPUT: str = os.getenv("PROFILE_OUTPUT", "")
+
+# Access log: one JSON line per logged request, written by a background
+# thread from a queue of ACCESS_LOG_QUEUE_SIZE records (beyond that, records
+# are dropped rather than delaying requests). Successful requests are logged
+# with probability ACCESS_LOG_SAMPLE_RATE; errors and requests taking
+# ACCESS_LOG_SLOW_MS or more always are. ACCESS_LOG_FILE defaults to stderr.
+ACCESS_LOG_ENABLED: bool = os.getenv("ACCESS_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+ACCESS_LOG_SAMPLE_RATE: float = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.01"))
+ACCESS_LOG_SLOW_MS: float = float(os.getenv("ACCESS_LOG_SLOW_MS", "500"))
+ACCESS_LOG_QUEUE_SIZE: int = int(os.getenv("ACCESS_LOG_QUEUE_SIZE", "10000"))
+ACCESS_LOG_FILE: str = os.getenv("ACCESS_LOG_FILE", "")
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import config
+from .changes import ChangeLog
+from .utils import status_promotion_expr
+
+
+# Fields of a conversation summary document that map onto ConversationOut
+SUMMARY_FIELDS = (
+    "waId",
+    "name",
+    "lastMessageText",
+    "lastMessageAt",
+    "lastMessageDirection",
+    "lastMessageStatus",
+)
+SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in SUMMARY_FIELDS}}
+
+# Sort key plus every projected field, so GET /conversations can be answered
+# from this index alone (see CONVERSATIONS_COVERED_INDEX)
+COVERED_INDEX_NAME = "conversation_list_covered"
+COVERED_INDEX_KEYS = [("lastMessageAt", -1)] + [(f, 1) for f in SUMMARY_FIELDS if f != "lastMessageAt"]
+
+# Every summary write changes at least one of these, so refresh_summary can
+# tell whether a write landed while it recomputed the summary
+_GUARD_FIELDS = ("_id", "messageCount", "lastMessageId", "lastMessageStatus")
+
+
+def _is_newer_expr(ts: int, message_id: str) -> Dict[str, Any]:
+    # Same ordering as GET /messages: (timestamps.whatsapp, _id). A missing
+    # lastMessageAt sorts below any number, so a fresh summary always accepts.
+    return {
+        "$or": [
+            {"$lt": ["$lastMessageAt", ts]},
+            {
+                "$and": [
+                    {"$eq": ["$lastMessageAt", ts]},
+                    {"$lt": ["$lastMessageId", message_id]},
+                ]
+            },
+        ]
+    }
+
+
+def summary_update_for_message(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Pipeline update that folds one newly inserted message into its summary."""
+    ts = int((doc.get("timestamps") or {}).get("whatsapp") or 0)
+    direction = doc.get("direction")
+    last_fields = {
+        "lastMessageId": doc["_id"],
+        "lastMessageText": doc.get("text"),
+        "lastMessageAt": ts,
+        "lastMessageDirection": direction,
+        "lastMessageStatus": doc.get("status"),
+    }
+    first_stage: Dict[str, Any] = {
+        "waId": {"$literal": doc["waId"]},
+        "_newer": _is_newer_expr(ts, doc["_id"]),
+        "messageCount": {"$add": [{"$ifNull": ["$messageCount", 0]}, 1]},
+        "inboundCount": {
+            "$add": [{"$ifNull": ["$inboundCount", 0]}, 1 if direction == "inbound" else 0]
+        },
+        "outboundCount": {
+            "$add": [{"$ifNull": ["$outboundCount", 0]}, 1 if direction == "outbound" else 0]
+        },
+    }
+    if doc.get("name"):
+        # Keep any non-empty name seen in the conversation ($max ignores nulls)
+        first_stage["name"] = {"$max": ["$name", {"$literal": doc["name"]}]}
+    else:
+        first_stage["name"] = {"$ifNull": ["$name", None]}
+    return [
+        {"$set": first_stage},
+        {
+            "$set": {
+                field: {"$cond": ["$_newer", {"$literal": value}, f"${field}"]}
+                for field, value in last_fields.items()
+            }
+        },
+        {"$unset": "_newer"},
+    ]
+
+
+async def record_message(conversations, doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Update the conversation summary after ``doc`` was inserted.
+
+    Returns the summary as it is after the update (ConversationOut fields).
+    """
+    if conversations is None or not isinstance(doc.get("waId"), str):
+        return None
+    return await conversations.find_one_and_update(
+        {"_id": doc["waId"]},
+        summary_update_for_message(doc),
+        projection=SUMMARY_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def record_status(
+    conversations, wa_id: Optional[str], message_id: str, status: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """Mirror a status promotion onto the summary if it hit the last message.
+
+    Returns the updated summary, or None when the summary did not change.
+    """
+    if conversations is None or not isinstance(wa_id, str):
+        return None
+    # Promote rather than overwrite so concurrent updates cannot regress it
+    return await conversations.find_one_and_update(
+        {"_id": wa_id, "lastMessageId": message_id},
+        [{"$set": {"lastMessageStatus": status_promotion_expr("lastMessageStatus", status)}}],
+        projection=SUMMARY_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def summary_stages() -> List[Dict[str, Any]]:
+    """Aggregation from a conversation's messages to its summary document."""
+    return [
+        # Carry only what the summary needs through the sort and group
+        {
+            "$project": {
+                "waId": 1,
+                "name": 1,
+                "text": 1,
+                "direction": 1,
+                "status": 1,
+                "ts": "$timestamps.whatsapp",
+            }
+        },
+        {"$sort": {"ts": 1, "_id": 1}},
+        {
+            "$group": {
+                "_id": "$waId",
+                "lastMessageId": {"$last": "$_id"},
+                "lastMessageText": {"$last": "$text"},
+                "lastMessageAt": {"$last": "$ts"},
+                "lastMessageDirection": {"$last": "$direction"},
+                "lastMessageStatus": {"$last": "$status"},
+                "name": {"$max": "$name"},
+                "messageCount": {"$sum": 1},
+                "inboundCount": {"$sum": {"$cond": [{"$eq": ["$direction", "inbound"]}, 1, 0]}},
+                "outboundCount": {"$sum": {"$cond": [{"$eq": ["$direction", "outbound"]}, 1, 0]}},
+            }
+        },
+        {
+            "$project": {
+                "_id": 1,
+                "waId": "$_id",
+                "name": {"$cond": [{"$gt": ["$name", ""]}, "$name", None]},
+                "lastMessageId": 1,
+                "lastMessageText": 1,
+                "lastMessageAt": 1,
+                "lastMessageDirection": 1,
+                "lastMessageStatus": 1,
+                "messageCount": 1,
+                "inboundCount": 1,
+                "outboundCount": 1,
+            }
+        },
+    ]
+
+
+def rebuild_pipeline(target: str) -> List[Dict[str, Any]]:
+    return [{"$match": {"waId": {"$type": "string"}}}, *summary_stages(), {"$out": target}]
+
+
+async def ensure_indexes(conversations) -> None:
+    await conversations.create_index([("lastMessageAt", -1)])
+    if config.CONVERSATIONS_COVERED_INDEX:
+        await conversations.create_index(COVERED_INDEX_KEYS, name=COVERED_INDEX_NAME)
+
+
+def list_cursor(conversations):
+    """Cursor for GET /conversations: summaries newest first, projected."""
+    cursor = conversations.find({}, SUMMARY_PROJECTION).sort("lastMessageAt", -1)
+    if config.CONVERSATIONS_COVERED_INDEX:
+        # Both indexes provide the sort; only this one avoids fetching documents
+        cursor = cursor.hint(COVERED_INDEX_NAME)
+    return cursor
+
+
+async def summaries_behind(messages, conversations) -> bool:
+    """Whether some messages are missing from the summaries' ``messageCount``.
+
+    Every write keeps the summaries current, so this only happens on the
+    first start after upgrading or after messages were written around the
+    app. The exact count (messages with a waId, as the rebuild counts them)
+    runs only when the collection's metadata count already disagrees.
+    """
+    total = await messages.estimated_document_count()
+    if total == 0:
+        return False
+    counted = 0
+    async for row in conversations.aggregate([{"$group": {"_id": None, "n": {"$sum": "$messageCount"}}}]):
+        counted = row["n"]
+    if total <= counted:
+        return False
+    return await messages.count_documents({"waId": {"$type": "string"}}) > counted
+
+
+async def rebuild_conversations(messages, conversations, changelog: Optional[ChangeLog] = None) -> int:
+    """Recompute every conversation summary from ``processed_messages``.
+
+    Summary writes that land while the aggregation runs go to the collection
+    ``$out`` is about to replace. With ``changelog`` they are not lost: every
+    conversation changed after the rebuild started is recomputed once writers
+    that were in flight have logged their change (CHANGELOG_GAP_GRACE_SECONDS).
+    """
+    since = await changelog.current() if changelog is not None else 0
+    # $out swaps the target collection atomically and keeps its indexes
+    async for _ in messages.aggregate(rebuild_pipeline(conversations.name), allowDiskUse=True):
+        pass
+    await ensure_indexes(conversations)
+    if changelog is not None:
+        await asyncio.sleep(config.CHANGELOG_GAP_GRACE_SECONDS)
+        wa_ids = await changelog.changes.distinct("waId", {"_id": {"$gt": since}})
+        for wa_id in wa_ids:
+            if isinstance(wa_id, str):
+                await refresh_summary(messages, conversations, wa_id)
+    return await conversations.count_documents({})
+
+
+async def refresh_summary(messages, conversations, wa_id: str) -> None:
+    """Recompute one conversation's summary without losing concurrent updates.
+
+    The summary is replaced only if it still looks as it did before its
+    messages were read; a record_message or record_status in between changes
+    it, and the recomputation starts over with that write included.
+    """
+    while True:
+        before = await conversations.find_one({"_id": wa_id}, dict.fromkeys(_GUARD_FIELDS, 1))
+        rows = await messages.aggregate([{"$match": {"waId": wa_id}}, *summary_stages()]).to_list(length=1)
+        if not rows:
+            return
+        try:
+            if before is None:
+                await conversations.insert_one(rows[0])
+                return
+            guard = {field: before.get(field) for field in _GUARD_FIELDS}
+            result = await conversations.replace_one(guard, rows[0])
+        except DuplicateKeyError:
+            # Created by a concurrent record_message; read it again
+            continue
+        if result.matched_count:
+            return
@@ -1,32 +1,114 @@
 from __future__ import annotations
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo.errors import OperationFailure
 
-from .config import MONGODB_URI, DATABASE_NAME, COLLECTION_MESSAGES, COLLECTION_USERS
+from .config import (
+    MONGODB_URI,
+    DATABASE_NAME,
+    COLLECTION_MESSAGES,
+    COLLECTION_USERS,
+    COLLECTION_CONVERSATIONS,
+    COLLECTION_CHANGES,
+    COLLECTION_COUNTERS,
+    COLLECTION_PENDING_STATUSES,
+    COLLECTION_WEBHOOK_SPOOL,
+    COLLECTION_LEASES,
+)
+from .changes import ChangeLog, ensure_indexes as ensure_change_indexes
+from .conversations import (
+    ensure_indexes as ensure_conversation_indexes,
+    rebuild_conversations,
+    summaries_behind,
+)
+from .leases import Lease
+from .pending import PendingStatusBuffer
 
 
+# Superseded by the keyset pagination index; dropped on startup
+_LEGACY_MESSAGES_INDEX = [("waId", 1), ("timestamps.whatsapp", -1)]
+_INDEX_NOT_FOUND = 27
+# Long enough for a rebuild of a large history; a crashed rebuilder blocks no longer
+_REBUILD_LEASE_SECONDS = 600
+
 mongo_client: AsyncIOMotorClient | None = None
 messages_collection: AsyncIOMotorCollection | None = None
 users_collection: AsyncIOMotorCollection | None = None
+conversations_collection: AsyncIOMotorCollection | None = None
+changelog: ChangeLog | None = None
+pending_statuses: PendingStatusBuffer | None = None
+# Acknowledged webhook records whose write failed and did not fit the queue
+webhook_spool: AsyncIOMotorCollection | None = None
+# Lease documents (see leases.Lease), shared by every worker
+leases_collection: AsyncIOMotorCollection | None = None
 
 
 async def connect_to_mongo() -> None:
-    global mongo_client, messages_collection, users_collection
     if not MONGODB_URI:
         raise RuntimeError("MONGODB_URI is not set. Define it in .env before starting the server.")
-    mongo_client = AsyncIOMotorClient(MONGODB_URI)
-    db = mongo_client[DATABASE_NAME]
+    client = AsyncIOMotorClient(MONGODB_URI)
+    await init_database(client, client[DATABASE_NAME])
+
+
+async def init_database(client, db) -> None:
+    """Bind the module's collections to ``db`` and make sure its indexes exist.
+
+    Split from connect_to_mongo so that benchmarks can run the API on an
+    in-memory stand-in (scripts/memmongo.py).
+    """
+    global mongo_client, messages_collection, users_collection, conversations_collection, changelog, pending_statuses
+    global webhook_spool, leases_collection
+    mongo_client = client
     messages_collection = db[COLLECTION_MESSAGES]
     users_collection = db[COLLECTION_USERS]
+    conversations_collection = db[COLLECTION_CONVERSATIONS]
+    changelog = ChangeLog(db[COLLECTION_CHANGES], db[COLLECTION_COUNTERS])
+    # Written through: acknowledged webhook statuses must survive a worker crash
+    pending_statuses = PendingStatusBuffer(db[COLLECTION_PENDING_STATUSES], durable=True)
+    webhook_spool = db[COLLECTION_WEBHOOK_SPOOL]
+    leases_collection = db[COLLECTION_LEASES]
     # Indexes
-    await messages_collection.create_index([("waId", 1), ("timestamps.whatsapp", -1)])
+    # _id is the keyset tiebreaker for GET /messages pagination
+    await messages_collection.create_index([("waId", 1), ("timestamps.whatsapp", -1), ("_id", -1)])
+    # Its prefix (waId, timestamps.whatsapp), created by older versions, only costs writes
+    try:
+        await messages_collection.drop_index(_LEGACY_MESSAGES_INDEX)
+    except OperationFailure as exc:
+        if exc.code != _INDEX_NOT_FOUND:
+            raise
     # Users: unique username & optional email
     await users_collection.create_index("username", unique=True)
     await users_collection.create_index("email", unique=True, sparse=True)
+    # Conversations: newest-first list
+    await ensure_conversation_indexes(conversations_collection)
+    # Change log: TTL on entry time, _id is the sync token
+    await ensure_change_indexes(changelog.changes)
+    # Webhook statuses waiting for their message, shared with ingest_payloads
+    await pending_statuses.load()
+    # First start after upgrading (or messages written around the app): build
+    # summaries from history. Otherwise they are current and this is a count.
+    if await summaries_behind(messages_collection, conversations_collection):
+        await _rebuild_once(Lease(leases_collection, "conversations.rebuild", _REBUILD_LEASE_SECONDS))
+
+
+async def _rebuild_once(lease: Lease) -> None:
+    # Every worker starts at once; one rebuilds while the others serve the
+    # summaries as they are, rather than racing several $out stages
+    if not await lease.acquire():
+        return
+    try:
+        # Another worker may have finished a rebuild since we looked
+        if await summaries_behind(messages_collection, conversations_collection):
+            await rebuild_conversations(messages_collection, conversations_collection, changelog)
+    finally:
+        await lease.release()
 
 
 async def close_mongo_connection() -> None:
     global mongo_client
+    if pending_statuses is not None:
+        # Keep still-unmatched statuses for the next start
+        await pending_statuses.persist()
     if mongo_client is not None:
         mongo_client.close()
         mongo_client = None
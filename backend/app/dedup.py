@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from . import config
+
+
+def record_key(kind: str, record: Dict[str, Any]) -> Optional[str]:
+    """Identity of an ingested record: message id, or id + status + timestamp."""
+    if kind == "message":
+        message_id = record.get("_id")
+        return f"m:{message_id}" if message_id else None
+    target = record.get("id") or record.get("meta_msg_id")
+    if not target:
+        return None
+    return f"s:{target}:{record.get('status')}:{record.get('timestamp')}"
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = max(1, capacity)
+        self.bits = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupCache:
+    """Bounded "seen before" set for webhook retries and replayed archives.
+
+    The most recent ``max_entries`` keys are held exactly, for
+    ``ttl_seconds`` each, in LRU order. With ``bloom_capacity`` set, keys
+    pushed out of that window by size move into a Bloom filter (two
+    rotating generations of that capacity), so duplicates older than the
+    window are still caught on long runs; the price is that a genuinely new
+    record is dropped with probability about ``bloom_error_rate``.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+        bloom_capacity: Optional[int] = None,
+        bloom_error_rate: Optional[float] = None,
+    ) -> None:
+        self.max_entries = max_entries or config.DEDUP_CACHE_SIZE
+        self.ttl_seconds = ttl_seconds or config.DEDUP_TTL_SECONDS
+        self.bloom_capacity = bloom_capacity if bloom_capacity is not None else config.DEDUP_BLOOM_CAPACITY
+        self.bloom_error_rate = bloom_error_rate or config.DEDUP_BLOOM_ERROR_RATE
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._bloom: Optional[BloomFilter] = None
+        self._bloom_previous: Optional[BloomFilter] = None
+        if self.bloom_capacity > 0:
+            self._bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        self.hits = 0
+        self.misses = 0
+        self.bloom_hits = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def seen(self, key: Optional[str]) -> bool:
+        """True if ``key`` was recorded before; otherwise record it and return False."""
+        if key is None:
+            return False
+        now = time.time()
+        added_at = self._entries.get(key)
+        if added_at is not None:
+            if now - added_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            del self._entries[key]
+            self.expired += 1
+        elif self._in_bloom(key):
+            self.hits += 1
+            self.bloom_hits += 1
+            return True
+
+        self.misses += 1
+        self._entries[key] = now
+        if len(self._entries) > self.max_entries:
+            old_key, old_at = self._entries.popitem(last=False)
+            self.evicted += 1
+            if now - old_at <= self.ttl_seconds:
+                self._add_to_bloom(old_key)
+        return False
+
+    def forget(self, keys: Iterable[Optional[str]]) -> None:
+        """Drop ``keys`` again, e.g. because the write they belonged to failed."""
+        for key in keys:
+            if key is not None:
+                self._entries.pop(key, None)
+
+    def _in_bloom(self, key: str) -> bool:
+        if self._bloom is None:
+            return False
+        return key in self._bloom or (self._bloom_previous is not None and key in self._bloom_previous)
+
+    def _add_to_bloom(self, key: str) -> None:
+        if self._bloom is None:
+            return
+        if self._bloom.count >= self.bloom_capacity:
+            # Rotate rather than let the false-positive rate climb
+            self._bloom_previous = self._bloom
+            self._bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        self._bloom.add(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bloom_hits": self.bloom_hits,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "bloom_bytes": (
+                len(self._bloom._array) + (len(self._bloom_previous._array) if self._bloom_previous else 0)
+                if self._bloom is not None
+                else 0
+            ),
+        }
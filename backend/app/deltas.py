@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .changes import CONVERSATION_UPDATED, MESSAGE_INSERTED, MESSAGE_STATUS, Change
+from .serialization import conversation_row, message_row
+from .ws import EVENT_VERSION, manager, topics_for
+
+
+def delta_event(change: Change) -> Optional[Dict[str, Any]]:
+    """Live event for one change, carrying what a client needs to patch its state.
+
+    ``{"v": 2, "type": <change kind>, "waId": ..., "data": ...}`` where data
+    is a MessageOut row for ``message.inserted``, ``{_id, status,
+    timestamps}`` for ``message.status`` and a ConversationOut row for
+    ``conversation.updated`` (the same shapes GET /sync returns). None for
+    changes without data, e.g. a status that left the summary alone.
+    """
+    kind, wa_id, data = change
+    if data is None:
+        return None
+    if kind == MESSAGE_INSERTED:
+        data = message_row(data)
+    elif kind == CONVERSATION_UPDATED:
+        data = conversation_row(data)
+    elif kind != MESSAGE_STATUS:
+        return None
+    return {"v": EVENT_VERSION, "type": kind, "waId": wa_id, "data": data}
+
+
+def delta_frames(changes: Iterable[Change]) -> Iterator[Tuple[str, List[str]]]:
+    """``(serialised event, topics)`` per change, for publishing on a backplane."""
+    for change in changes:
+        event = delta_event(change)
+        if event is not None:
+            yield json.dumps(event), topics_for(change[1])
+
+
+async def publish_changes(changes: Iterable[Change]) -> None:
+    """Broadcast ``changes`` in order, each on the topics of its waId."""
+    for change in changes:
+        event = delta_event(change)
+        if event is not None:
+            await manager.broadcast(event, topics=topics_for(change[1]))
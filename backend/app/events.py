@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from collections import deque
+from typing import AsyncIterator, Deque, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from . import config
+from .ws import RESYNC_FRAME
+
+
+# (seq, serialised event, topics it was published on; None means every topic)
+Entry = Tuple[int, str, Optional[FrozenSet[str]]]
+
+
+def _wants(subscribed: FrozenSet[str], topics: Optional[FrozenSet[str]]) -> bool:
+    # Like sockets, a client with no topics receives nothing
+    return bool(subscribed) and (topics is None or not subscribed.isdisjoint(topics))
+
+
+class Subscriber:
+    """One SSE stream or pending long-poll: a bounded backlog plus a wakeup."""
+
+    def __init__(self, topics: Iterable[str], queue_size: int) -> None:
+        self.topics = frozenset(topics)
+        self.queue_size = queue_size
+        self.backlog: Deque[Entry] = deque()
+        self.ready = asyncio.Event()
+        self.coalesced = 0
+
+    def push(self, entry: Entry) -> None:
+        if len(self.backlog) >= self.queue_size:
+            # Same answer as the WebSocket "coalesce" policy: catch up via /sync
+            self.coalesced += len(self.backlog)
+            self.backlog.clear()
+            entry = (entry[0], RESYNC_FRAME, None)
+        self.backlog.append(entry)
+        self.ready.set()
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[Entry]:
+        """Everything queued, waiting up to ``timeout`` for the first entry."""
+        if not self.backlog:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.ready.clear()
+        batch = list(self.backlog)
+        self.backlog.clear()
+        return batch
+
+
+class EventStream:
+    """This worker's feed of broadcast events for SSE and long-poll clients.
+
+    Registered as a WebSocketManager listener, so it sees exactly what the
+    sockets see, including other workers' events via the backplane. Events
+    are numbered per process and the last ``history`` of them are kept, so a
+    client presenting its last cursor (``<node>:<seq>``) gets what it missed
+    between two polls or across an SSE reconnect. A cursor from another
+    worker or older than the history cannot be replayed; the client is told
+    to resync through /sync instead.
+    """
+
+    def __init__(self, history: Optional[int] = None, queue_size: Optional[int] = None) -> None:
+        self.node = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size or config.WS_SEND_QUEUE_SIZE
+        self._history: Deque[Entry] = deque(maxlen=history or config.EVENTS_HISTORY_SIZE)
+        self._subscribers: Set[Subscriber] = set()
+        self._seq = 0
+        self.published = 0
+        self.replayed = 0
+        self.resets = 0
+
+    @property
+    def cursor(self) -> str:
+        return self.cursor_for(self._seq)
+
+    def cursor_for(self, seq: int) -> str:
+        return f"{self.node}:{seq}"
+
+    def on_event(self, data: str, topics: Optional[Iterable[str]]) -> None:
+        self._seq += 1
+        entry: Entry = (self._seq, data, frozenset(topics) if topics is not None else None)
+        self._history.append(entry)
+        self.published += 1
+        for subscriber in self._subscribers:
+            if _wants(subscriber.topics, entry[2]):
+                subscriber.push(entry)
+
+    def replay(self, cursor: str, topics: Iterable[str]) -> Optional[List[Entry]]:
+        """Entries after ``cursor`` on ``topics``, or None if that gap cannot be filled."""
+        node, _, raw_seq = cursor.rpartition(":")
+        try:
+            seq = int(raw_seq)
+        except ValueError:
+            return None
+        if node != self.node or seq > self._seq:
+            return None
+        if seq < self._seq and (not self._history or self._history[0][0] > seq + 1):
+            return None
+        subscribed = frozenset(topics)
+        entries = [entry for entry in self._history if entry[0] > seq and _wants(subscribed, entry[2])]
+        self.replayed += len(entries)
+        return entries
+
+    def subscribe(self, topics: Iterable[str]) -> Subscriber:
+        subscriber = Subscriber(topics, self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def resync_entry(self) -> Entry:
+        self.resets += 1
+        return (self._seq, RESYNC_FRAME, None)
+
+    def stats(self) -> dict:
+        return {
+            "node": self.node,
+            "subscribers": len(self._subscribers),
+            "cursor": self.cursor,
+            "history": len(self._history),
+            "published": self.published,
+            "replayed": self.replayed,
+            "resets": self.resets,
+            "coalesced": sum(s.coalesced for s in self._subscribers),
+        }
+
+
+def sse_frame(entry: Entry, cursor: str) -> bytes:
+    return f"id: {cursor}\ndata: {entry[1]}\n\n".encode("utf-8")
+
+
+async def sse_frames(
+    stream: EventStream,
+    topics: Iterable[str],
+    last_event_id: Optional[str] = None,
+    heartbeat: Optional[float] = None,
+) -> AsyncIterator[bytes]:
+    """Server-sent events for ``topics`` until the client goes away.
+
+    ``last_event_id`` (the browser's Last-Event-ID on reconnect) replays
+    what was missed, or starts with a resync event when it cannot.
+    """
+    heartbeat = heartbeat or config.EVENTS_HEARTBEAT_SECONDS
+    topics = list(topics)
+    # Subscribe and take the replay in one step, so nothing lands in both
+    subscriber = stream.subscribe(topics)
+    # Reconnect delay for EventSource, in milliseconds
+    head = [b"retry: 3000\n\n"]
+    if last_event_id:
+        missed = stream.replay(last_event_id, topics)
+        for entry in missed if missed is not None else [stream.resync_entry()]:
+            head.append(sse_frame(entry, stream.cursor_for(entry[0])))
+    else:
+        head.append(f"id: {stream.cursor}\n\n".encode("utf-8"))
+    try:
+        yield b"".join(head)
+        while True:
+            batch = await subscriber.next_batch(heartbeat)
+            if not batch:
+                # Keeps proxies from closing an idle stream
+                yield b": ping\n\n"
+                continue
+            yield b"".join(sse_frame(entry, stream.cursor_for(entry[0])) for entry in batch)
+    finally:
+        stream.unsubscribe(subscriber)
+
+
+async def long_poll(
+    stream: EventStream, topics: Iterable[str], cursor: Optional[str], timeout: float
+) -> Tuple[str, bool, List[Entry]]:
+    """``(cursor, reset, entries)``: what happened after ``cursor``, waiting up to ``timeout``.
+
+    Without a cursor the wait starts now. ``reset`` means events were lost
+    (unknown cursor or a coalesced backlog) and the client should resync.
+    An unknown cursor still waits like a fresh poll: with several workers
+    behind a load balancer most cursors are another worker's, and
+    answering those at once would have clients poll in a tight loop.
+    """
+    topics = list(topics)
+    lost = False
+    if cursor is not None:
+        missed = stream.replay(cursor, topics)
+        if missed is None:
+            stream.resets += 1
+            lost = True
+        elif missed:
+            return stream.cursor, False, missed
+    subscriber = stream.subscribe(topics)
+    try:
+        entries = await subscriber.next_batch(timeout)
+    finally:
+        stream.unsubscribe(subscriber)
+    if not entries:
+        return stream.cursor, lost, []
+    reset = lost or any(entry[1] == RESYNC_FRAME for entry in entries)
+    return stream.cursor_for(entries[-1][0]), reset, entries
+
+
+event_stream = EventStream()
@@ -0,0 +1,396 @@
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from .changes import CONVERSATION_UPDATED, MESSAGE_INSERTED, Change, ChangeLog, OnChanges
+from .conversations import SUMMARY_PROJECTION, record_message, summary_update_for_message
+from .config import COLLECTION_CHANGES, COLLECTION_CONVERSATIONS, COLLECTION_MESSAGES
+from .dedup import DedupCache, record_key
+from .metrics import ingest_documents, ingest_flush_latency, mongo_timer, timed
+from .pending import PendingStatusBuffer
+from .statuses import apply_status_batch, status_changes, status_target
+
+
+# Called with the change-log entries of every flush that produced any
+OnFlush = OnChanges
+
+
+@dataclass
+class IngestStats:
+    files_read: int = 0
+    lines_read: int = 0
+    parse_errors: int = 0
+    messages_upserted: int = 0
+    statuses_applied: int = 0
+    status_skipped_missing_message: int = 0
+    # Statuses that arrived before their message, and how many of those
+    # were applied once the message showed up
+    statuses_buffered: int = 0
+    statuses_recovered: int = 0
+    # Records recognised as replays by the dedup cache and never written
+    duplicates_skipped: int = 0
+    elapsed_seconds: float = 0.0
+    pending: Dict[str, Any] = field(default_factory=dict)
+    dedup: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def docs_per_second(self) -> float:
+        docs = self.messages_upserted + self.statuses_applied
+        return docs / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["elapsed_seconds"] = round(self.elapsed_seconds, 3)
+        data["docs_per_second"] = round(self.docs_per_second, 1)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IngestStats":
+        """Inverse of ``as_dict``, e.g. to continue counting from a checkpoint."""
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
+
+
+def find_value_block(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        entry = payload["metaData"]["entry"][0]
+        change = entry["changes"][0]
+        return change["value"]
+    except Exception:
+        return None
+
+
+def is_message_payload(value: Dict[str, Any]) -> bool:
+    return "messages" in value and isinstance(value.get("messages"), list)
+
+
+def is_status_payload(value: Dict[str, Any]) -> bool:
+    return "statuses" in value and isinstance(value.get("statuses"), list)
+
+
+def extract_message_doc(value: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        msg = value["messages"][0]
+        metadata = value.get("metadata", {})
+        contacts = value.get("contacts", [])
+        contact = contacts[0] if contacts else {}
+        business_phone = metadata.get("display_phone_number")
+
+        msg_id = msg.get("id")
+        msg_from = msg.get("from")
+        msg_type = msg.get("type")
+        text = (msg.get("text") or {}).get("body")
+        wa_id = None
+        direction = None
+
+        if business_phone and msg_from == business_phone:
+            # outbound
+            direction = "outbound"
+            wa_id = contact.get("wa_id") or None
+        else:
+            # inbound
+            direction = "inbound"
+            wa_id = msg_from
+
+        timestamps = {
+            "whatsapp": int(msg.get("timestamp", 0) or 0),
+            "sent": None,
+            "delivered": None,
+            "read": None,
+        }
+
+        status = "sent" if direction == "outbound" else "read"
+        if direction == "inbound":
+            timestamps["read"] = timestamps["whatsapp"]
+
+        doc = {
+            "_id": msg_id,
+            "waId": wa_id,
+            "name": (contact.get("profile") or {}).get("name"),
+            "direction": direction,
+            "text": text,
+            "type": msg_type,
+            "status": status,
+            "timestamps": timestamps,
+            "businessPhone": business_phone,
+            "phoneNumberId": metadata.get("phone_number_id"),
+            "conversationId": None,
+            "gsId": None,
+            "metaMsgId": None,
+        }
+        return doc
+    except Exception:
+        return None
+
+
+def extract_status_updates(value: Dict[str, Any]) -> List[Dict[str, Any]]:
+    updates: List[Dict[str, Any]] = []
+    for st in value.get("statuses", []) or []:
+        try:
+            updates.append(
+                {
+                    "id": st.get("id"),
+                    "meta_msg_id": st.get("meta_msg_id"),
+                    "status": st.get("status"),
+                    "timestamp": int(st.get("timestamp", 0) or 0),
+                    "conversationId": (st.get("conversation") or {}).get("id"),
+                    "gsId": st.get("gs_id"),
+                    "recipient_id": st.get("recipient_id"),
+                }
+            )
+        except Exception:
+            continue
+    return updates
+
+
+Record = Tuple[str, Dict[str, Any]]
+
+
+def extract_records(payload: Any) -> List[Record]:
+    """("message", doc) and ("status", update) records found in one payload."""
+    if not isinstance(payload, dict):
+        return []
+    value = find_value_block(payload)
+    if not value:
+        return []
+    records: List[Record] = []
+    if is_message_payload(value):
+        doc = extract_message_doc(value)
+        if doc:
+            records.append(("message", doc))
+    if is_status_payload(value):
+        records.extend(("status", upd) for upd in extract_status_updates(value))
+    return records
+
+
+async def upsert_message(
+    collection,
+    doc: Dict[str, Any],
+    conversations=None,
+    changelog: Optional[ChangeLog] = None,
+    pending: Optional[PendingStatusBuffer] = None,
+    on_changes: Optional[OnFlush] = None,
+) -> bool:
+    if not doc or not doc.get("_id"):
+        return False
+    with mongo_timer(COLLECTION_MESSAGES, "update_one"):
+        result = await collection.update_one(
+            {"_id": doc["_id"]},
+            {
+                "$setOnInsert": doc,
+            },
+            upsert=True,
+        )
+    ingest_documents.inc("message")
+    # Only a real insert changes the conversation summary; replays are no-ops
+    if result.upserted_id is None:
+        return True
+    summary = await record_message(conversations, doc)
+    changes: List[Change] = [(MESSAGE_INSERTED, doc.get("waId"), doc)]
+    # Statuses that arrived before this message are applied now, in one batch
+    early = await pending.take([doc["_id"], doc.get("metaMsgId")]) if pending is not None else []
+    if early:
+        applied, _ = await apply_status_batch(collection, early, conversations)
+        changes.extend(status_changes(applied))
+        if conversations is not None:
+            summary = await conversations.find_one({"_id": doc.get("waId")}, SUMMARY_PROJECTION)
+    changes.append((CONVERSATION_UPDATED, doc.get("waId"), summary))
+    if changelog is not None:
+        await changelog.append(*changes)
+    if on_changes is not None:
+        await on_changes(changes)
+    return True
+
+
+class BulkIngestor:
+    """Buffers messages and statuses and writes them with unordered bulk_write.
+
+    Each flush writes the buffered message upserts first and only then the
+    status updates, so a status always sees a message that came before it in
+    the input, even within the same batch. Status updates are server-side
+    pipeline promotions (see app.statuses), safe next to other workers.
+    Statuses whose message is still missing go to ``pending`` and are
+    applied in the flush that inserts the message. ``on_flush`` receives the
+    changes of each flush, e.g. to publish them to WebSocket clients.
+
+    With ``dedup`` set, records already seen are dropped in ``add_*`` before
+    any database call; the keys of a batch whose write fails are forgotten
+    again so that a retry is not mistaken for a duplicate.
+    """
+
+    def __init__(
+        self,
+        collection,
+        conversations=None,
+        changelog: Optional[ChangeLog] = None,
+        batch_size: int = 500,
+        stats: Optional[IngestStats] = None,
+        pending: Optional[PendingStatusBuffer] = None,
+        on_flush: Optional[OnFlush] = None,
+        dedup: Optional[DedupCache] = None,
+    ) -> None:
+        self.collection = collection
+        self.conversations = conversations
+        self.changelog = changelog
+        self.batch_size = max(1, batch_size)
+        self.stats = stats or IngestStats()
+        self.pending = pending
+        self.on_flush = on_flush
+        self.dedup = dedup
+        self._messages: Dict[str, Dict[str, Any]] = {}
+        self._statuses: List[Dict[str, Any]] = []
+        self._keys: List[str] = []
+
+    def buffered(self) -> int:
+        return len(self._messages) + len(self._statuses)
+
+    def _duplicate(self, kind: str, record: Dict[str, Any]) -> bool:
+        if self.dedup is None:
+            return False
+        key = record_key(kind, record)
+        if self.dedup.seen(key):
+            self.stats.duplicates_skipped += 1
+            return True
+        if key is not None:
+            self._keys.append(key)
+        return False
+
+    async def add_message(self, doc: Optional[Dict[str, Any]]) -> None:
+        if not doc or not doc.get("_id") or self._duplicate("message", doc):
+            return
+        # $setOnInsert semantics: the first copy of an id wins
+        self._messages.setdefault(doc["_id"], doc)
+        if self.buffered() >= self.batch_size:
+            await self.flush()
+
+    async def add_status(self, update: Dict[str, Any]) -> None:
+        if not status_target(update) or self._duplicate("status", update):
+            return
+        self._statuses.append(update)
+        if self.buffered() >= self.batch_size:
+            await self.flush()
+
+    async def apply_pending(self, keys: List[Optional[str]]) -> List[Change]:
+        """Apply statuses waiting in ``pending`` for the messages ``keys``.
+
+        Used for messages that exist by now without this ingestor having
+        inserted them, e.g. ones written by another ingestion process.
+        """
+        if self.pending is None:
+            return []
+        return await self._write([], await self.pending.take(keys))
+
+    async def flush(self) -> List[Change]:
+        messages = list(self._messages.values())
+        statuses = self._statuses
+        keys = self._keys
+        self._messages = {}
+        self._statuses = []
+        self._keys = []
+        try:
+            return await self._write(messages, statuses)
+        except Exception:
+            if self.dedup is not None:
+                self.dedup.forget(keys)
+            raise
+
+    async def _write(self, messages: List[Dict[str, Any]], statuses: List[Dict[str, Any]]) -> List[Change]:
+        if not messages and not statuses:
+            return []
+        with timed(ingest_flush_latency):
+            return await self._write_batch(messages, statuses)
+
+    async def _write_batch(self, messages: List[Dict[str, Any]], statuses: List[Dict[str, Any]]) -> List[Change]:
+        changes: List[Change] = []
+        touched_wa_ids: set = set()
+
+        if messages:
+            with mongo_timer(COLLECTION_MESSAGES, "bulk_write"):
+                result = await self.collection.bulk_write(
+                    [UpdateOne({"_id": d["_id"]}, {"$setOnInsert": d}, upsert=True) for d in messages],
+                    ordered=False,
+                )
+            self.stats.messages_upserted += len(messages)
+            ingest_documents.inc("message", amount=len(messages))
+            inserted = [messages[i] for i in sorted(result.upserted_ids)]
+            summary_ops = [
+                UpdateOne({"_id": d["waId"]}, summary_update_for_message(d), upsert=True)
+                for d in inserted
+                if isinstance(d.get("waId"), str)
+            ]
+            # Summary updates commute, so unordered application is safe
+            if summary_ops and self.conversations is not None:
+                with mongo_timer(COLLECTION_CONVERSATIONS, "bulk_write"):
+                    await self.conversations.bulk_write(summary_ops, ordered=False)
+            for d in inserted:
+                changes.append((MESSAGE_INSERTED, d.get("waId"), d))
+                touched_wa_ids.add(d.get("waId"))
+            if self.pending is not None and inserted:
+                keys = [k for d in inserted for k in (d["_id"], d.get("metaMsgId"))]
+                # Early statuses are older than anything buffered in this batch
+                statuses = await self.pending.take(keys) + statuses
+
+        if statuses:
+            with mongo_timer(COLLECTION_MESSAGES, "apply_status_batch"):
+                applied, missing = await apply_status_batch(self.collection, statuses, self.conversations)
+            self.stats.statuses_applied += len(statuses) - len(missing)
+            ingest_documents.inc("status", amount=len(statuses) - len(missing))
+            if self.pending is not None:
+                await self.pending.add_many(missing)
+                self.stats.statuses_buffered += len(missing)
+                if missing and self.pending.durable:
+                    applied.update(await self._apply_raced(missing))
+            else:
+                self.stats.status_skipped_missing_message += len(missing)
+            changes.extend(status_changes(applied))
+            touched_wa_ids.update(doc.get("waId") for doc in applied.values())
+
+        if not changes:
+            return changes
+        if self.changelog is not None or self.on_flush is not None:
+            # Live clients patch their conversation list from these too
+            summaries = await self._summaries(touched_wa_ids)
+            changes.extend(
+                (CONVERSATION_UPDATED, wa_id, summary) for wa_id, summary in summaries.items()
+            )
+        if self.changelog is not None:
+            with mongo_timer(COLLECTION_CHANGES, "append"):
+                await self.changelog.append(*changes)
+        if self.on_flush is not None:
+            await self.on_flush(changes)
+        return changes
+
+    async def _apply_raced(self, parked: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Apply parked statuses whose message was inserted meanwhile.
+
+        A writer that inserted the message between our status write and the
+        park already ran its ``take`` and found nothing; whoever parks last
+        sees the message here and takes the status back.
+        """
+        targets = list({status_target(u) for u in parked})
+        with mongo_timer(COLLECTION_MESSAGES, "find"):
+            arrived = [d["_id"] async for d in self.collection.find({"_id": {"$in": targets}}, {"_id": 1})]
+        if not arrived:
+            return {}
+        taken = await self.pending.take(arrived)
+        if not taken:
+            return {}
+        with mongo_timer(COLLECTION_MESSAGES, "apply_status_batch"):
+            applied, missing = await apply_status_batch(self.collection, taken, self.conversations)
+        self.stats.statuses_applied += len(taken) - len(missing)
+        ingest_documents.inc("status", amount=len(taken) - len(missing))
+        await self.pending.add_many(missing)
+        return applied
+
+    async def _summaries(self, wa_ids: set) -> Dict[str, Dict[str, Any]]:
+        wa_ids = {w for w in wa_ids if isinstance(w, str)}
+        if not wa_ids or self.conversations is None:
+            return {}
+        found: Dict[str, Dict[str, Any]] = {}
+        with mongo_timer(COLLECTION_CONVERSATIONS, "find"):
+            async for doc in self.conversations.find({"_id": {"$in": list(wa_ids)}}, SUMMARY_PROJECTION):
+                found[doc["waId"]] = doc
+        return found
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def node_id() -> str:
+    """Identifies this worker process among the others sharing the database."""
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """Exclusive, expiring claim on ``name``, shared by every worker.
+
+    The lease is one ``{_id: name, owner, expires}`` document in
+    ``collection``. ``acquire`` takes it when it is free or expired and
+    renews it when this owner already holds it; a holder that dies without
+    ``release`` blocks the others for ``ttl_seconds`` at most. Work that can
+    outlast the TTL must renew it by calling ``acquire`` again.
+    """
+
+    def __init__(self, collection, name: str, ttl_seconds: float, owner: Optional[str] = None) -> None:
+        self.collection = collection
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.owner = owner or node_id()
+
+    async def acquire(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "expires": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The document exists and matched neither condition: held elsewhere
+            return False
+        return True
+
+    async def release(self) -> None:
+        await self.collection.delete_one({"_id": self.name, "owner": self.owner})
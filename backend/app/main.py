@@ -1,13 +1,26 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, Request, WebSocket
+import hmac
+from typing import Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-import logging
 
+from . import config
+from . import db as db_module
+from .accesslog import AccessLogMiddleware, access_log
 from .config import CORS_ORIGINS
 from .db import connect_to_mongo, close_mongo_connection
 from .routes import router as api_router
 from .routes_auth import router as auth_router
+from .backplane import create_backplane
+from .events import event_stream
+from .auth import hash_pool
+from .authcache import claims_cache, user_cache
+from .metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from .profiling import ProfilingMiddleware, profiler
+from .readcache import read_cache
+from .webhook import batcher
 from .ws import manager
 
 app = FastAPI(title="WhatsApp Web Clone API")
@@ -19,16 +32,63 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+# Outermost of ours, so its timing covers the other middleware
+app.add_middleware(AccessLogMiddleware, logger=access_log)
+
+# Read at scrape time from counters the objects keep anyway
+registry.sampled("gauge", "ws_connections", "Open WebSocket connections on this worker", manager.connection_count)
+registry.sampled(
+    "counter",
+    "ws_frames_total",
+    "WebSocket frames sent, dropped or replaced by a resync for slow consumers",
+    lambda: {("sent",): manager.sent, ("dropped",): manager.dropped, ("coalesced",): manager.coalesced},
+    ("outcome",),
+)
+registry.sampled(
+    "counter",
+    "access_log_records_total",
+    "Access log records written, skipped by sampling or dropped on a full queue",
+    lambda: {("written",): access_log.written, ("skipped",): access_log.skipped, ("dropped",): access_log.dropped},
+    ("outcome",),
+)
+registry.sampled(
+    "gauge", "webhook_buffered_records", "Webhook records accepted but not yet written", lambda: batcher.stats()["buffered"]
+)
 
 
 @app.on_event("startup")
 async def _startup() -> None:
+    access_log.start()
+    # Broadcasts announce writes, so they double as cache invalidations
+    manager.add_listener(read_cache.on_event)
+    manager.add_listener(event_stream.on_event)
+    manager.add_listener(user_cache.on_event)
+    await manager.start(create_backplane())
     await connect_to_mongo()
+    read_cache.invalidate()
+    user_cache.clear()
+    await batcher.start(
+        db_module.messages_collection,
+        db_module.conversations_collection,
+        db_module.changelog,
+        db_module.pending_statuses,
+        spool=db_module.webhook_spool,
+        leases=db_module.leases_collection,
+    )
+    await profiler.start()
 
 
 @app.on_event("shutdown")
 async def _shutdown() -> None:
+    # Write out acknowledged webhook payloads before the connection goes away
+    await batcher.stop()
+    await profiler.stop()
     await close_mongo_connection()
+    await manager.stop()
+    hash_pool.shutdown()
+    access_log.stop()
 
 
 @app.get("/health")
@@ -42,19 +102,61 @@ async def root() -> dict[str, str]:
     return {"service": "whatsapp-web-clone-api", "status": "ok"}
 
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    # Use standard error logger to avoid uvicorn AccessFormatter expectations
-    logger = logging.getLogger("uvicorn.error")
-    path = request.url.path
-    method = request.method
-    try:
-        response = await call_next(request)
-        logger.info("%s %s -> %s", method, path, getattr(response, "status_code", ""))
-        return response
-    except Exception as exc:
-        logger.exception("Unhandled error on %s %s: %s", method, path, exc)
-        raise
+async def _ops_only(authorization: Optional[str] = Header(None)) -> None:
+    """Gate for operational endpoints: hidden without OPS_TOKEN, then bearer-protected."""
+    token = config.OPS_TOKEN
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(credentials.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid ops token", headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.get("/ws/stats", dependencies=[Depends(_ops_only)])
+async def ws_stats() -> dict:
+    # Fan-out health: queue depth, drops and slow-consumer handling
+    return manager.stats()
+
+
+@app.get("/webhook/stats", dependencies=[Depends(_ops_only)])
+async def webhook_stats() -> dict:
+    # Micro-batcher health: queue depth, batch sizes and write throughput
+    return batcher.stats()
+
+
+@app.get("/cache/stats", dependencies=[Depends(_ops_only)])
+async def cache_stats() -> dict:
+    # Read cache effectiveness: hits, misses and coalesced concurrent reads
+    return read_cache.stats()
+
+
+@app.get("/auth/stats", dependencies=[Depends(_ops_only)])
+async def auth_stats() -> dict:
+    # Token and user cache hit rates; misses are signature checks and DB reads
+    return {"claims": claims_cache.stats(), "users": user_cache.stats(), "hash_pool": hash_pool.stats()}
+
+
+@app.get("/events/stats", dependencies=[Depends(_ops_only)])
+async def events_stats() -> dict:
+    # SSE and long-poll subscribers, replay history and resyncs
+    return event_stream.stats()
+
+
+@app.get("/metrics", dependencies=[Depends(_ops_only)])
+async def metrics() -> Response:
+    # Prometheus scrape target; per worker, like every other stats endpoint
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/profile", dependencies=[Depends(_ops_only)])
+async def debug_profile(limit: int = 100) -> dict:
+    # Slow sampled requests and event-loop stalls, newest last; PROFILE_ENABLED only
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    reports = list(profiler.reports)
+    return {"stats": profiler.stats(), "reports": reports[-limit:] if limit > 0 else []}
 
 
 app.include_router(api_router)
@@ -66,8 +168,9 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            # Keep alive; we don't process client messages for now
-            await websocket.receive_text()
+            # Clients (un)subscribe to topics; see WebSocketManager.handle_client_message
+            text = await websocket.receive_text()
+            await manager.handle_client_message(websocket, text)
     except Exception:
         pass
     finally:
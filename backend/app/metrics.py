@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import config
+from .profiling import current_trace, record_span
+
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def lines(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def lines(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Observations bucketed by upper bound, with their count and sum.
+
+    Each observation is one ``bisect`` and two additions; buckets are only
+    made cumulative when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def lines(self) -> Iterable[str]:
+        names = self.labels + ("le",)
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}"
+            label_text = _format_labels(self.labels, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(total)}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Sampled(_Metric):
+    """Gauge or counter read from ``fn`` at scrape time, costing nothing in between.
+
+    ``fn`` returns a number, or ``{label values: number}`` when ``labels``
+    are given. Suits values other objects already keep, like the WebSocket
+    manager's connection count.
+    """
+
+    def __init__(
+        self, kind: str, name: str, documentation: str, fn: Callable[[], Any], labels: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def lines(self) -> Iterable[str]:
+        value = self.fn()
+        values = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, number in values:
+            if number is not None:
+                yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(number)}"
+
+
+class Registry:
+    """In-process metrics, rendered in the Prometheus text format by GET /metrics.
+
+    Every worker process has its own registry; Prometheus scrapes each one
+    (or sums them) the same way it would separate hosts.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def sampled(
+        self, kind: str, name: str, documentation: str, fn: Callable[[], Any], labels: Sequence[str] = ()
+    ) -> Sampled:
+        return self.register(Sampled(kind, name, documentation, fn, labels))
+
+    def render(self) -> str:
+        out: List[str] = []
+        for metric in self._metrics.values():
+            out.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(metric.lines())
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status")
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte", ("method", "route")
+)
+mongo_latency = registry.histogram(
+    "mongo_operation_duration_seconds", "Database calls by collection and operation", ("collection", "operation"), DB_BUCKETS
+)
+mongo_errors = registry.counter(
+    "mongo_operation_errors_total", "Database calls that raised", ("collection", "operation")
+)
+ws_broadcast_latency = registry.histogram(
+    "ws_broadcast_duration_seconds",
+    "Time to publish one event: serialise, backplane send or local queueing",
+    buckets=DB_BUCKETS,
+)
+ingest_documents = registry.counter(
+    "ingest_documents_total", "Messages upserted and statuses applied by webhook batches and ingestion", ("kind",)
+)
+ingest_flush_latency = registry.histogram(
+    "ingest_flush_duration_seconds", "Time to write one ingestion batch, including summaries and the change log"
+)
+
+
+class timed:
+    """``with timed(histogram, *labels):`` observes the block's duration.
+
+    Measures wall time, so awaits inside the block count; that is what a
+    caller waiting on the database experiences.
+    """
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, *labels: str) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "timed":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class mongo_timer(timed):
+    """``with mongo_timer(collection, operation):`` around a database call.
+
+    ``operation`` is the driver method, or the helper (``append``,
+    ``since``) for calls that wrap a few of them. Failed calls are timed
+    too and also counted in ``mongo_operation_errors_total``. In a request
+    sampled by the profiler the call is also a ``db`` span.
+    """
+
+    __slots__ = ("trace",)
+
+    def __init__(self, collection: str, operation: str) -> None:
+        super().__init__(mongo_latency, collection, operation)
+
+    def __enter__(self) -> "mongo_timer":
+        self.trace = current_trace()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self.started
+        self.histogram.observe(duration, *self.labels)
+        if self.trace is not None:
+            record_span(self.trace, "db", ".".join(self.labels), self.started, duration)
+        if exc_type is not None:
+            mongo_errors.inc(*self.labels)
+
+
+class MetricsMiddleware:
+    """Counts and times HTTP requests by method, route template and status.
+
+    Plain ASGI rather than ``@app.middleware`` so that it adds no task or
+    response wrapping. The route is the matched path template
+    (``/messages``, not the query) to keep label cardinality bounded;
+    unmatched paths share ``unmatched``. Streaming responses are timed
+    until their last byte.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = _route_of(scope)
+            http_requests.inc(scope["method"], route, str(status))
+            http_latency.observe(time.perf_counter() - started, scope["method"], route)
+
+
+def _route_of(scope: Scope) -> str:
+    # The router records the matched route in the (shared) scope
+    route = scope.get("route")
+    path: Optional[str] = getattr(route, "path", None)
+    return path or "unmatched"
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from pydantic import BaseModel, Field
 from typing_extensions import Annotated
 from pydantic import StringConstraints
@@ -36,6 +36,13 @@ class MessageOut(BaseModel):
         populate_by_name = True
 
 
+class MessagePage(BaseModel):
+    items: List[MessageOut]
+    # Opaque cursor to continue in the same direction (older for `before`)
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+
 class MessageCreate(BaseModel):
     waId: Annotated[str, StringConstraints(strip_whitespace=True, min_length=5, max_length=20)]
     text: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=2000)]
@@ -49,6 +56,21 @@ class ConversationOut(BaseModel):
     lastMessageDirection: Optional[Direction] = None
     lastMessageStatus: Status = None
 
+
+class ChangeOut(BaseModel):
+    seq: int
+    kind: str
+    waId: Optional[str] = None
+    data: Dict[str, Any]
+
+
+class SyncOut(BaseModel):
+    # Pass back as ?since= on the next call
+    token: int
+    # True when the client is too far behind (or new) and must reload fully
+    reset: bool = False
+    has_more: bool = False
+    changes: List[ChangeOut] = []
     
 
 # ===== Users / Auth =====
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from . import config
+
+
+# While the overflow collection has entries, how often to check whether the
+# TTL index has emptied it, so that takes can skip the lookup again
+_OVERFLOW_RECHECK_SECONDS = 60.0
+
+class _Entry:
+    __slots__ = ("added_at", "keys", "update")
+
+    def __init__(self, added_at: float, keys: List[str], update: Dict[str, Any]) -> None:
+        self.added_at = added_at
+        self.keys = keys
+        self.update = update
+
+
+def _keys(update: Dict[str, Any]) -> List[str]:
+    keys: List[str] = []
+    for key in (update.get("id"), update.get("meta_msg_id")):
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class PendingStatusBuffer:
+    """Holds status updates whose message has not been ingested yet.
+
+    Entries live in memory, keyed by both the status ``id`` and its
+    ``meta_msg_id``, and expire after ``ttl_seconds``. Past ``memory_limit``
+    the oldest entries spill to the ``overflow`` collection (TTL-indexed on
+    ``at``, indexed on ``keys``), which also keeps them across runs.
+    ``take`` removes and returns everything waiting for a message.
+
+    With ``durable`` every entry goes straight to the overflow collection
+    and ``take`` always looks there. The API server uses that: statuses the
+    webhook has acknowledged must survive a worker crash, and with several
+    workers the message may well arrive at a different one.
+    """
+
+    def __init__(
+        self,
+        overflow=None,
+        memory_limit: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+        durable: bool = False,
+    ) -> None:
+        self.overflow = overflow
+        self.durable = durable and overflow is not None
+        self.memory_limit = memory_limit or config.PENDING_STATUS_MEMORY_LIMIT
+        self.ttl_seconds = ttl_seconds or config.PENDING_STATUS_TTL_SECONDS
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._by_key: Dict[str, Set[int]] = {}
+        self._seq = 0
+        # Skip overflow lookups until something may actually be there
+        self._overflow_active = self.durable
+        self._overflow_checked_at = 0.0
+        self.added = 0
+        self.hits = 0
+        self.expired = 0
+        self.spilled = 0
+        self.evicted = 0
+        self._wait_total = 0.0
+
+    async def load(self) -> None:
+        if self.overflow is None:
+            return
+        await self.overflow.create_index("at", expireAfterSeconds=self.ttl_seconds)
+        await self.overflow.create_index("keys")
+        await self._check_overflow(time.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def add(self, update: Dict[str, Any]) -> None:
+        await self.add_many([update])
+
+    async def add_many(self, updates: Iterable[Dict[str, Any]]) -> None:
+        now = time.time()
+        entries = []
+        for update in updates:
+            keys = _keys(update)
+            if keys:
+                entries.append(_Entry(now, keys, update))
+        if not entries:
+            return
+        self.added += len(entries)
+        if self.durable:
+            await self._insert(entries)
+            return
+        self._expire(now)
+        for entry in entries:
+            self._seq += 1
+            self._entries[self._seq] = entry
+            for key in entry.keys:
+                self._by_key.setdefault(key, set()).add(self._seq)
+        if len(self._entries) > self.memory_limit:
+            await self._spill(len(self._entries) - self.memory_limit)
+
+    async def take(self, keys: Iterable[Optional[str]]) -> List[Dict[str, Any]]:
+        """Remove and return pending updates for any of ``keys``, oldest first."""
+        keys = [k for k in keys if k]
+        if not keys:
+            return []
+        now = time.time()
+        taken: List[Dict[str, Any]] = []
+
+        if self._overflow_active and self.overflow is not None:
+            rows = (
+                await self.overflow.find({"keys": {"$in": keys}}, {"update": 1, "at": 1})
+                .sort("at", 1)
+                .to_list(length=None)
+            )
+            if rows:
+                await self.overflow.delete_many({"_id": {"$in": [r["_id"] for r in rows]}})
+                for row in rows:
+                    self._record_hit(now - row["at"].replace(tzinfo=timezone.utc).timestamp())
+                    taken.append(row["update"])
+            if rows or now - self._overflow_checked_at >= _OVERFLOW_RECHECK_SECONDS:
+                # Drained by this take or by the TTL index: stop querying it
+                await self._check_overflow(now)
+
+        seqs: Set[int] = set()
+        for key in keys:
+            seqs.update(self._by_key.get(key, ()))
+        for seq in sorted(seqs):
+            entry = self._pop(seq)
+            if entry is not None and now - entry.added_at <= self.ttl_seconds:
+                self._record_hit(now - entry.added_at)
+                taken.append(entry.update)
+        return taken
+
+    async def _check_overflow(self, now: float) -> None:
+        self._overflow_checked_at = now
+        if not self.durable:
+            self._overflow_active = await self.overflow.find_one({}, {"_id": 1}) is not None
+
+    async def persist(self) -> None:
+        """Move everything still in memory to the overflow collection."""
+        await self._spill(len(self._entries))
+
+    def _record_hit(self, waited: float) -> None:
+        self.hits += 1
+        self._wait_total += max(0.0, waited)
+
+    def _pop(self, seq: int) -> Optional[_Entry]:
+        entry = self._entries.pop(seq, None)
+        if entry is None:
+            return None
+        for key in entry.keys:
+            seqs = self._by_key.get(key)
+            if seqs is not None:
+                seqs.discard(seq)
+                if not seqs:
+                    del self._by_key[key]
+        return entry
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            seq, entry = next(iter(self._entries.items()))
+            if now - entry.added_at <= self.ttl_seconds:
+                break
+            self._pop(seq)
+            self.expired += 1
+
+    async def _spill(self, count: int) -> None:
+        if count <= 0:
+            return
+        oldest = [self._pop(seq) for seq in list(self._entries)[:count]]
+        if self.overflow is None:
+            self.evicted += len(oldest)
+            return
+        await self._insert(oldest)
+        self.spilled += len(oldest)
+
+    async def _insert(self, entries: List[_Entry]) -> None:
+        await self.overflow.insert_many(
+            [
+                {
+                    "keys": e.keys,
+                    "update": e.update,
+                    "at": datetime.fromtimestamp(e.added_at, timezone.utc),
+                }
+                for e in entries
+            ]
+        )
+        self._overflow_active = True
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        oldest = next(iter(self._entries.values()), None)
+        return {
+            "durable": self.durable,
+            "buffered": len(self._entries),
+            "added": self.added,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.added, 4) if self.added else 0.0,
+            "expired": self.expired,
+            "spilled": self.spilled,
+            "evicted": self.evicted,
+            "oldest_age_seconds": round(now - oldest.added_at, 3) if oldest else 0.0,
+            "avg_wait_seconds": round(self._wait_total / self.hits, 3) if self.hits else 0.0,
+        }
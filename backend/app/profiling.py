@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import config
+
+
+class Trace:
+    """Spans of one sampled request, in the order they finished."""
+
+    __slots__ = ("started", "spans")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        # (kind, detail, start offset, duration), in seconds
+        self.spans: List[tuple] = []
+
+
+# The trace of the request being handled, if it was sampled. Tasks started
+# while handling it (e.g. a read cache load) inherit it.
+_current: ContextVar[Optional[Trace]] = ContextVar("profiling_trace", default=None)
+
+
+class span:
+    """``with span(kind, detail):`` records the block in the current request's trace.
+
+    ``kind`` groups spans in the totals (``db``, ``validation``,
+    ``serialization``, ``bcrypt``). Outside a sampled request this is one
+    context variable lookup.
+    """
+
+    __slots__ = ("kind", "detail", "trace", "started")
+
+    def __init__(self, kind: str, detail: str = "") -> None:
+        self.kind = kind
+        self.detail = detail
+
+    def __enter__(self) -> "span":
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.trace is not None:
+            record_span(self.trace, self.kind, self.detail, self.started, time.perf_counter() - self.started)
+
+
+def record_span(trace: Optional[Trace], kind: str, detail: str, started: float, duration: float) -> None:
+    if trace is not None:
+        trace.spans.append((kind, detail, started - trace.started, duration))
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class Profiler:
+    """Opt-in request tracing and event-loop lag monitoring (PROFILE_* settings).
+
+    A ``sample_rate`` share of requests get a Trace; those taking at least
+    ``slow_ms`` are kept with their spans and per-kind totals. ``other`` is
+    the time no span covers: request parsing and validation inside FastAPI,
+    handler code and time spent waiting for the event loop. The lag monitor
+    sleeps ``lag_interval_ms`` at a time and records how late it wakes up;
+    a late wake-up means something held the loop (bcrypt inline, a large
+    ``json.dumps``). Reports go to a ring buffer served by GET /debug/profile
+    and, with ``output`` set, are appended to that file as JSON lines by
+    the monitor task, off the event loop.
+
+    Disabled, the middleware costs one attribute check per request and
+    ``span`` one context variable lookup.
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        sample_rate: Optional[float] = None,
+        slow_ms: Optional[float] = None,
+        lag_interval_ms: Optional[float] = None,
+        lag_threshold_ms: Optional[float] = None,
+        buffer_size: Optional[int] = None,
+        output: Optional[str] = None,
+    ) -> None:
+        self.enabled = enabled if enabled is not None else config.PROFILE_ENABLED
+        self.sample_rate = sample_rate if sample_rate is not None else config.PROFILE_SAMPLE_RATE
+        self.slow_ms = slow_ms if slow_ms is not None else config.PROFILE_SLOW_MS
+        self.lag_interval_ms = lag_interval_ms or config.PROFILE_LAG_INTERVAL_MS
+        self.lag_threshold_ms = lag_threshold_ms if lag_threshold_ms is not None else config.PROFILE_LAG_THRESHOLD_MS
+        self.output = output if output is not None else config.PROFILE_OUTPUT
+        self.reports: Deque[Dict[str, Any]] = deque(maxlen=buffer_size or config.PROFILE_BUFFER_SIZE)
+        self._unwritten: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self.sampled = 0
+        self.slow = 0
+        self.lag_samples = 0
+        self.lag_events = 0
+        self.max_lag_ms = 0.0
+
+    def begin(self) -> Optional[Trace]:
+        """A Trace for this request if it is sampled."""
+        if random.random() >= self.sample_rate:
+            return None
+        self.sampled += 1
+        return Trace()
+
+    def finish(self, trace: Trace, method: str, route: str, status: int) -> None:
+        duration = time.perf_counter() - trace.started
+        if duration * 1000 < self.slow_ms:
+            return
+        self.slow += 1
+        totals: Dict[str, float] = {}
+        for kind, _, _, seconds in trace.spans:
+            totals[kind] = totals.get(kind, 0.0) + seconds
+        # Spans can overlap (concurrent loads), so clamp rather than go negative
+        totals["other"] = max(0.0, duration - sum(totals.values()))
+        self._report(
+            {
+                "type": "request",
+                "at": time.time(),
+                "method": method,
+                "route": route,
+                "status": status,
+                "duration_ms": round(duration * 1000, 3),
+                "totals_ms": {kind: round(seconds * 1000, 3) for kind, seconds in totals.items()},
+                "spans": [
+                    {
+                        "kind": kind,
+                        "detail": detail,
+                        "start_ms": round(offset * 1000, 3),
+                        "duration_ms": round(seconds * 1000, 3),
+                    }
+                    for kind, detail, offset, seconds in trace.spans
+                ],
+            }
+        )
+
+    def _report(self, report: Dict[str, Any]) -> None:
+        self.reports.append(report)
+        if self.output:
+            self._unwritten.append(json.dumps(report))
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._write_out()
+
+    async def _monitor(self) -> None:
+        interval = self.lag_interval_ms / 1000
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            self.lag_samples += 1
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= self.lag_threshold_ms:
+                self.lag_events += 1
+                self._report({"type": "loop_lag", "at": time.time(), "lag_ms": round(lag_ms, 3)})
+            await self._write_out()
+
+    async def _write_out(self) -> None:
+        if not self._unwritten or not self.output:
+            return
+        lines, self._unwritten = self._unwritten, []
+        await asyncio.to_thread(self._append, self.output, lines)
+
+    @staticmethod
+    def _append(path: str, lines: List[str]) -> None:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "sampled": self.sampled,
+            "slow": self.slow,
+            "lag_interval_ms": self.lag_interval_ms,
+            "lag_threshold_ms": self.lag_threshold_ms,
+            "lag_samples": self.lag_samples,
+            "lag_events": self.lag_events,
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "output": self.output or None,
+        }
+
+
+class ProfilingMiddleware:
+    """Samples HTTP requests into Traces for ``profiler``; see Profiler."""
+
+    def __init__(self, app: ASGIApp, profiler: Profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profiler = self.profiler
+        trace = profiler.begin() if profiler.enabled and scope["type"] == "http" else None
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+        token = _current.set(trace)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            # Route template, as in the metrics
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            profiler.finish(trace, scope["method"], route, status)
+
+
+profiler = Profiler()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from . import config
+
+
+# Produces the serialised response body
+Loader = Callable[[], Awaitable[bytes]]
+
+
+def etag_for(body: bytes) -> str:
+    """Strong validator derived from the body, so every worker agrees on it."""
+    # sha1 is hardware-accelerated and collision-resistant enough for a validator
+    return '"' + hashlib.sha1(body, usedforsecurity=False).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 9110 weak comparison of ``etag`` against an If-None-Match header."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+class ReadCache:
+    """Single-flight loader plus a short-TTL response cache for hot reads.
+
+    Concurrent ``get`` calls for the same key share one in-flight load, and
+    its body is kept for ``ttl_seconds`` (LRU-bounded to ``max_entries``).
+    For as long, ``revalidate`` can answer a conditional request with the
+    body's ETag without a query. The ETag lives no longer than the body on
+    purpose: it is only as fresh as the last invalidation this worker
+    received, and an invalidation can be lost (a dropped backplane
+    datagram, a write nobody broadcast), so trusting it is bounded by the
+    same short TTL.
+    Keys carry invalidation tags named like the WebSocket topics
+    (``"conversations"``, ``"wa:<waId>"``); ``invalidate`` drops cached
+    results and detaches in-flight loads under those tags. A detached load
+    still answers the callers already waiting on it but is not cached, and
+    later callers start a fresh one, so a read that raced a write is never
+    served again after the write is announced.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.READ_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or config.READ_CACHE_SIZE
+        # key -> (stored_at, etag, body)
+        self._entries: "OrderedDict[Hashable, Tuple[float, str, bytes]]" = OrderedDict()
+        self._flights: Dict[Hashable, "asyncio.Task[Tuple[str, bytes]]"] = {}
+        # Tags of every key that has an entry or a flight, and the reverse index
+        self._key_tags: Dict[Hashable, Tuple[str, ...]] = {}
+        self._tags: Dict[str, Set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.not_modified = 0
+        self.invalidations = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def revalidate(self, key: Hashable, if_none_match: Optional[str]) -> Optional[str]:
+        """The ETag for ``key`` if the client's copy is known to be current."""
+        if not if_none_match:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl_seconds:
+            self._discard(key)
+            return None
+        if not etag_matches(if_none_match, entry[1]):
+            return None
+        self._entries.move_to_end(key)
+        self.not_modified += 1
+        return entry[1]
+
+    async def get(self, key: Hashable, tags: Iterable[str], loader: Loader) -> Tuple[str, bytes]:
+        """``(etag, body)`` for ``key``, cached or from the shared ``loader()`` call."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self._entries.pop(key)
+
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            # Retrieve failures nobody is left to await (every caller cancelled)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._flights[key] = task
+            self._index(key, tuple(tags))
+        # One caller going away (client disconnect) must not cancel the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Loader) -> Tuple[str, bytes]:
+        try:
+            body = await loader()
+        except BaseException:
+            if self._flights.get(key) is asyncio.current_task():
+                del self._flights[key]
+                self._release(key)
+            raise
+        # Not current any more if an invalidation detached this load
+        current = self._flights.get(key) is asyncio.current_task()
+        if current:
+            del self._flights[key]
+        etag = etag_for(body)
+        if current and self.ttl_seconds > 0:
+            self._entries[key] = (time.monotonic(), etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._release(old_key)
+                self.evicted += 1
+        elif current:
+            self._release(key)
+        return etag, body
+
+    def _index(self, key: Hashable, tags: Tuple[str, ...]) -> None:
+        self._key_tags[key] = tags
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+    def _discard(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+        self._release(key)
+
+    def _release(self, key: Hashable) -> None:
+        if key in self._entries or key in self._flights:
+            return
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags: Optional[Iterable[str]] = None) -> None:
+        """Forget everything cached or loading under ``tags`` (everything for None)."""
+        self.invalidations += 1
+        if tags is None:
+            keys: Set[Hashable] = set(self._key_tags)
+        else:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tags.get(tag, ()))
+        for key in keys:
+            self._entries.pop(key, None)
+            self._flights.pop(key, None)
+            self._release(key)
+
+    def on_event(self, data: str, topics: Optional[Iterable[str]]) -> None:
+        """WebSocketManager listener: every broadcast announces a write to ``topics``."""
+        self.invalidate(topics)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "in_flight": len(self._flights),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            # Share of requests that did not run their own query
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            # Conditional requests answered from a known ETag, without a query
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+            "evicted": self.evicted,
+        }
+
+
+read_cache = ReadCache()
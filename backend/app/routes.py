@@ -1,14 +1,30 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
 import time
 import uuid
-from typing import List
+from typing import Hashable, List, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException, Query
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
+from . import config
 from . import db as db_module
-from .models import ConversationOut, MessageCreate, MessageOut
-from .ws import manager
+from .changes import CONVERSATION_UPDATED, MESSAGE_INSERTED
+from .conversations import list_cursor, record_message
+from .deltas import publish_changes
+from .events import event_stream, long_poll, sse_frames
+from .ingest import extract_records
+from .metrics import mongo_timer
+from .models import ChangeOut, ConversationOut, MessageCreate, MessageOut, MessagePage, SyncOut
+from .profiling import span
+from .readcache import Loader, etag_matches, read_cache
+from .serialization import MESSAGE_PROJECTION, conversation_list, json_bytes_response, json_response, message_page
+from .utils import decode_cursor, encode_cursor
+from .webhook import batcher
+from .ws import CONVERSATIONS_TOPIC, MAX_TOPICS_PER_CONNECTION, is_client_topic, wa_topic
 
 router = APIRouter()
 
@@ -20,49 +36,151 @@ def _get_collection():
     return collection
 
 
+def _get_conversations_collection():
+    collection = db_module.conversations_collection
+    if collection is None:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+    return collection
+
+
+async def _cached_json(key: Hashable, tags: Tuple[str, ...], load: Loader, if_none_match: Optional[str]) -> Response:
+    """Serve ``key`` through the read cache, answering 304 when the client is current.
+
+    ``Cache-Control: no-cache`` makes browsers store the body and revalidate
+    it with If-None-Match on every poll, so an unchanged resource costs a
+    bodiless 304 and, while its ETag is known, no query.
+    """
+    etag = read_cache.revalidate(key, if_none_match)
+    if etag is None:
+        etag, body = await read_cache.get(key, tags, load)
+        if not etag_matches(if_none_match, etag):
+            return json_bytes_response(body, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
 @router.get("/conversations", response_model=List[ConversationOut])
-async def list_conversations() -> List[ConversationOut]:
-    collection = _get_collection()
+async def list_conversations(if_none_match: Optional[str] = Header(None)) -> Response:
+    conversations = _get_conversations_collection()
 
-    pipeline = [
-        {"$match": {"waId": {"$type": "string"}}},
-        {"$sort": {"timestamps.whatsapp": 1, "_id": 1}},
-        {
-            "$group": {
-                "_id": "$waId",
-                "last": {"$last": "$$ROOT"},
-                # Keep any non-empty name seen in the conversation
-                "name": {"$max": {"$ifNull": ["$name", ""]}},
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "waId": "$_id",
-                "name": {"$cond": [{"$eq": ["$name", ""]}, None, "$name"]},
-                "lastMessageText": "$last.text",
-                "lastMessageAt": "$last.timestamps.whatsapp",
-                "lastMessageDirection": "$last.direction",
-                "lastMessageStatus": "$last.status",
-            }
-        },
-        {"$sort": {"lastMessageAt": -1}},
-    ]
+    async def load() -> bytes:
+        # Summaries are maintained on every write, so this is an indexed read
+        # whose cost grows with the number of conversations, not messages.
+        with mongo_timer(config.COLLECTION_CONVERSATIONS, "find"):
+            rows = [row async for row in list_cursor(conversations)]
+        # Rows are written by our own code, so skip per-row model validation
+        with span("serialization", "conversation_list"):
+            return orjson.dumps(conversation_list(rows))
+
+    # Every polling tab asks for the same list; see ReadCache
+    return await _cached_json(("conversations",), (CONVERSATIONS_TOPIC,), load, if_none_match)
 
-    items: List[ConversationOut] = []
-    async for row in collection.aggregate(pipeline):
-        items.append(ConversationOut(**row))
-    return items
 
+@router.get("/messages", response_model=MessagePage)
+async def list_messages(
+    wa_id: str = Query(..., alias="wa_id"),
+    before: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """Keyset-paginated thread, always returned oldest-first within a page.
 
-@router.get("/messages", response_model=List[MessageOut])
-async def list_messages(wa_id: str = Query(..., alias="wa_id")) -> List[MessageOut]:
+    Without a cursor the newest page is returned. ``before`` walks towards
+    older messages and ``after`` towards newer ones; ``next_cursor`` continues
+    in the same direction. For ``after`` it is always set so clients can keep
+    polling from the newest message they have.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
     collection = _get_collection()
-    cursor = collection.find({"waId": wa_id}).sort(
-        [("timestamps.whatsapp", 1), ("_id", 1)]
-    )
-    docs = await cursor.to_list(length=None)
-    return [MessageOut(**doc) for doc in docs]
+
+    query: dict = {"waId": wa_id}
+    cursor_value = after or before
+    if cursor_value:
+        try:
+            ts, message_id = decode_cursor(cursor_value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        op = "$gt" if after else "$lt"
+        query["$or"] = [
+            {"timestamps.whatsapp": {op: ts}},
+            {"timestamps.whatsapp": ts, "_id": {op: message_id}},
+        ]
+
+    async def load() -> bytes:
+        order = 1 if after else -1
+        cursor = (
+            collection.find(query, MESSAGE_PROJECTION)
+            .sort([("timestamps.whatsapp", order), ("_id", order)])
+            .limit(limit + 1)
+        )
+        with mongo_timer(config.COLLECTION_MESSAGES, "find"):
+            docs = await cursor.to_list(length=limit + 1)
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+
+        next_cursor: Optional[str] = None
+        if docs and (has_more or after):
+            edge = docs[-1]
+            next_cursor = encode_cursor(edge["timestamps"]["whatsapp"], edge["_id"])
+        elif after:
+            next_cursor = after
+        if not after:
+            docs.reverse()
+        with span("serialization", "message_page"):
+            return orjson.dumps(message_page(docs, next_cursor, has_more))
+
+    key = ("messages", wa_id, before, after, limit)
+    return await _cached_json(key, (wa_topic(wa_id),), load, if_none_match)
+
+
+async def _current_token(changelog) -> int:
+    with mongo_timer(config.COLLECTION_COUNTERS, "current"):
+        return await changelog.current()
+
+
+@router.get("/sync", response_model=SyncOut)
+async def sync(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+) -> SyncOut:
+    """Changes recorded after ``since``, oldest first.
+
+    Without ``since`` (or when the log no longer reaches back that far) the
+    response carries ``reset=True`` and the current token: load
+    /conversations and /messages once, then poll from that token. The
+    token never moves past a seq whose entry is still being written, so a
+    page can end early with ``has_more=False``; the next poll picks it up.
+    """
+    changelog = db_module.changelog
+    if changelog is None:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+
+    if since is None:
+        return SyncOut(token=await _current_token(changelog), reset=True)
+    with mongo_timer(config.COLLECTION_CHANGES, "oldest"):
+        oldest = await changelog.oldest()
+    if oldest is not None and oldest > since + 1:
+        return SyncOut(token=await _current_token(changelog), reset=True)
+
+    with mongo_timer(config.COLLECTION_CHANGES, "since"):
+        rows = await changelog.since(since, limit + 1)
+    if not rows:
+        current = await _current_token(changelog)
+        if current < since:
+            # Token from a different (or wiped) database
+            return SyncOut(token=current, reset=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    with span("validation", "SyncOut"):
+        return SyncOut(
+            token=rows[-1]["_id"] if rows else since,
+            has_more=has_more,
+            changes=[
+                ChangeOut(seq=row["_id"], kind=row["kind"], waId=row.get("waId"), data=row["data"])
+                for row in rows
+            ],
+        )
 
 
 @router.post("/messages", response_model=MessageOut, status_code=201)
@@ -94,9 +212,145 @@ async def create_message(payload: MessageCreate) -> MessageOut:
     }
 
     try:
-        await collection.insert_one(doc)
+        with mongo_timer(config.COLLECTION_MESSAGES, "insert_one"):
+            await collection.insert_one(doc)
     except Exception as exc:
         raise HTTPException(status_code=500, detail="Failed to create message") from exc
-    # Broadcast to WS subscribers
-    await manager.broadcast({"type": "insert", "message": doc})
-    return MessageOut(**doc)
+    with mongo_timer(config.COLLECTION_CONVERSATIONS, "find_one_and_update"):
+        summary = await record_message(db_module.conversations_collection, doc)
+    changes = [(MESSAGE_INSERTED, doc["waId"], doc), (CONVERSATION_UPDATED, doc["waId"], summary)]
+    if db_module.changelog is not None:
+        with mongo_timer(config.COLLECTION_CHANGES, "append"):
+            await db_module.changelog.append(*changes)
+    # Push the deltas to WS subscribers; this also invalidates the read
+    # cache of every worker for this waId and the conversation list
+    await publish_changes(changes)
+    with span("validation", "MessageOut"):
+        return MessageOut(**doc)
+
+
+def _webhook_secret() -> bytes:
+    secret = config.WEBHOOK_APP_SECRET
+    if not secret:
+        # Unsigned payloads are never accepted, so without a secret there is no endpoint
+        raise HTTPException(status_code=404, detail="Not Found")
+    return secret.encode()
+
+
+async def _read_body(request: Request, limit: int) -> bytes:
+    """The request body, refused with 413 as soon as it exceeds ``limit``."""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    # Content-Length can be absent (chunked) or wrong, so count what arrives
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail="Payload too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _check_signature(secret: bytes, body: bytes, header: Optional[str]) -> None:
+    scheme, _, signature = (header or "").partition("=")
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    if scheme != "sha256" or not hmac.compare_digest(signature.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+
+@router.get("/webhook", response_class=PlainTextResponse)
+async def verify_webhook(
+    mode: Optional[str] = Query(None, alias="hub.mode"),
+    verify_token: Optional[str] = Query(None, alias="hub.verify_token"),
+    challenge: str = Query("", alias="hub.challenge"),
+) -> str:
+    """Subscription handshake: echo ``hub.challenge`` to prove we own the URL."""
+    expected = config.WEBHOOK_VERIFY_TOKEN
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if mode != "subscribe" or not hmac.compare_digest((verify_token or "").encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Verification failed")
+    return challenge
+
+
+@router.post("/webhook", status_code=202)
+async def receive_webhook(request: Request, x_hub_signature_256: Optional[str] = Header(None)) -> dict:
+    """Accept a provider payload (or a JSON array of them) and queue it for
+    the next batched write.
+
+    The body must carry the provider's ``X-Hub-Signature-256``. The response
+    only means the payload was verified, parsed and queued; the write and the
+    WebSocket events follow within WEBHOOK_BATCH_DELAY_MS. A 503 asks the
+    provider to retry later while the write queue is full, and is answered
+    before the body is read.
+    """
+    secret = _webhook_secret()
+    if not batcher.accepting():
+        batcher.rejected += 1
+        raise HTTPException(status_code=503, detail="Webhook queue full", headers={"Retry-After": "1"})
+    body = await _read_body(request, config.WEBHOOK_MAX_BODY_BYTES)
+    _check_signature(secret, body, x_hub_signature_256)
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if isinstance(payload, list):
+        records = [record for item in payload for record in extract_records(item)]
+    else:
+        records = extract_records(payload)
+    if not batcher.submit(records):
+        raise HTTPException(status_code=503, detail="Webhook queue full", headers={"Retry-After": "1"})
+    return {
+        "status": "accepted",
+        "messages": sum(1 for kind, _ in records if kind == "message"),
+        "statuses": sum(1 for kind, _ in records if kind == "status"),
+    }
+
+
+def _event_topics(topics: List[str]) -> List[str]:
+    topics = [t for t in topics if is_client_topic(t)]
+    if not topics:
+        raise HTTPException(status_code=400, detail="Pass at least one topic")
+    if len(topics) > MAX_TOPICS_PER_CONNECTION:
+        raise HTTPException(status_code=400, detail="Too many topics")
+    return topics
+
+
+@router.get("/events")
+async def stream_events(
+    topics: List[str] = Query(..., description='"conversations" or "wa:<waId>", repeatable'),
+    last_event_id: Optional[str] = Header(None),
+) -> StreamingResponse:
+    """Server-sent events carrying the same events as the WebSocket.
+
+    For clients that cannot hold a socket: one idle connection replaces
+    periodic polling. EventSource resends ``Last-Event-ID`` on reconnect and
+    gets what it missed, or a ``resync`` event when that is no longer known.
+    """
+    return StreamingResponse(
+        sse_frames(event_stream, _event_topics(topics), last_event_id),
+        media_type="text/event-stream",
+        # Stop reverse proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/events/poll")
+async def poll_events(
+    topics: List[str] = Query(..., description='"conversations" or "wa:<waId>", repeatable'),
+    cursor: Optional[str] = Query(None),
+    timeout: float = Query(25, ge=0, le=config.EVENTS_POLL_MAX_SECONDS),
+) -> Response:
+    """Long-poll: wait until an event on ``topics`` arrives after ``cursor``.
+
+    Returns ``{cursor, reset, events}`` as soon as there is something to
+    report, or with no events once ``timeout`` seconds pass. Poll again with
+    the returned cursor; ``reset`` means events were missed (different
+    worker, or too far behind) and the client should catch up via /sync.
+    """
+    next_cursor, reset, entries = await long_poll(event_stream, _event_topics(topics), cursor, timeout)
+    # Events are already serialised; embed them as they are
+    events = [orjson.Fragment(entry[1]) for entry in entries]
+    return json_response({"cursor": next_cursor, "reset": reset, "events": events})
@@ -7,8 +7,10 @@ from typing import Any
 from fastapi import APIRouter, Body, Depends, HTTPException, status
 from pydantic import BaseModel
 
-from .auth import create_access_token, get_current_user, get_password_hash, verify_password
-from .db import users_collection
+from .auth import check_password, create_access_token, get_current_user, hash_password
+from . import config
+from . import db as db_module
+from .metrics import mongo_timer
 from .models import UserCreate, UserOut
 
 
@@ -26,29 +28,34 @@ class TokenResponse(BaseModel):
 
 
 def _get_users_collection():
-    if users_collection is None:
+    collection = db_module.users_collection
+    if collection is None:
         raise HTTPException(status_code=503, detail="Database not initialized")
-    return users_collection
+    return collection
 
 
 @router.post("/register", response_model=UserOut, status_code=201)
 async def register(payload: UserCreate) -> UserOut:
     col = _get_users_collection()
     # Check duplicates
-    existing = await col.find_one({"username": payload.username})
+    with mongo_timer(config.COLLECTION_USERS, "find_one"):
+        existing = await col.find_one({"username": payload.username}, {"_id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="Username already exists")
 
+    # bcrypt runs on the hash pool, never on the event loop
+    hashed_password = await hash_password(payload.password)
     user_doc = {
         "_id": str(uuid.uuid4()),
         "username": payload.username,
         "email": payload.email,
-        "hashed_password": get_password_hash(payload.password),
+        "hashed_password": hashed_password,
         "created_at": int(time.time()),
         "disabled": False,
     }
     try:
-        await col.insert_one(user_doc)
+        with mongo_timer(config.COLLECTION_USERS, "insert_one"):
+            await col.insert_one(user_doc)
     except Exception as exc:
         # For unique email collisions, etc.
         raise HTTPException(status_code=400, detail="Registration failed") from exc
@@ -58,8 +65,9 @@ async def register(payload: UserCreate) -> UserOut:
 @router.post("/login", response_model=TokenResponse)
 async def login(payload: LoginRequest = Body(...)) -> TokenResponse:
     col = _get_users_collection()
-    user = await col.find_one({"username": payload.username})
-    if not user or not verify_password(payload.password, user.get("hashed_password", "")):
+    with mongo_timer(config.COLLECTION_USERS, "find_one"):
+        user = await col.find_one({"username": payload.username}, {"hashed_password": 1})
+    if not user or not await check_password(payload.password, user.get("hashed_password", "")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+import orjson
+from fastapi import Response
+
+from .models import ConversationOut, MessageOut, Timestamps
+
+
+# Output keys in response_model order, derived from the models so the fast
+# path cannot drift from the documented contract
+MESSAGE_KEYS = tuple(f.alias or name for name, f in MessageOut.model_fields.items())
+TIMESTAMP_KEYS = tuple(Timestamps.model_fields)
+CONVERSATION_KEYS = tuple(ConversationOut.model_fields)
+
+# Only what MessageOut renders is read from Mongo
+MESSAGE_PROJECTION = {key: 1 for key in MESSAGE_KEYS}
+
+
+def message_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """``MessageOut(**doc).model_dump(by_alias=True)`` without the validation."""
+    row = {key: doc.get(key) for key in MESSAGE_KEYS}
+    timestamps = doc.get("timestamps") or {}
+    row["timestamps"] = {key: timestamps.get(key) for key in TIMESTAMP_KEYS}
+    return row
+
+
+def conversation_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: doc.get(key) for key in CONVERSATION_KEYS}
+
+
+def message_page(docs: Iterable[Dict[str, Any]], next_cursor: Optional[str], has_more: bool) -> Dict[str, Any]:
+    return {"items": [message_row(doc) for doc in docs], "next_cursor": next_cursor, "has_more": has_more}
+
+
+def conversation_list(docs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [conversation_row(doc) for doc in docs]
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """Serialise trusted, already-shaped content straight to bytes.
+
+    Returning a Response bypasses FastAPI's response_model validation; the
+    decorator's response_model still documents the shape in OpenAPI.
+    """
+    return json_bytes_response(orjson.dumps(content), status_code)
+
+
+def json_bytes_response(
+    body: bytes, status_code: int = 200, headers: Optional[Mapping[str, str]] = None
+) -> Response:
+    """Response for a body serialised earlier, e.g. one held by the read cache."""
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
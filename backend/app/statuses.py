@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from .changes import CONVERSATION_UPDATED, MESSAGE_STATUS, Change, ChangeLog, OnChanges
+from .conversations import record_status
+from .utils import promote_status, status_promotion_expr
+
+
+TIMESTAMP_FIELDS = ("sent", "delivered", "read")
+
+
+def status_target(update: Dict[str, Any]) -> Optional[str]:
+    """Message _id a status update applies to."""
+    return update.get("id") or update.get("meta_msg_id")
+
+
+def status_update_pipeline(update: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One atomic pipeline update equivalent to ``merge_status`` + ``$set``.
+
+    Promotion follows STATUS_ORDER and only the timestamp for the reported
+    status is touched, so concurrent updates to the same message cannot
+    overwrite each other's fields.
+    """
+    new_status = update.get("status")
+    fields: Dict[str, Any] = {"status": status_promotion_expr("status", new_status)}
+    if new_status in TIMESTAMP_FIELDS:
+        fields[f"timestamps.{new_status}"] = {"$literal": update.get("timestamp")}
+    for field, key in (("conversationId", "conversationId"), ("gsId", "gsId"), ("metaMsgId", "meta_msg_id")):
+        if update.get(key):
+            fields[field] = {"$literal": update[key]}
+    return [{"$set": fields}]
+
+
+def merge_status(doc: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Python mirror of ``status_update_pipeline``: fields of ``doc`` after ``update``."""
+    new_status = promote_status(doc.get("status"), update.get("status"))
+    timestamps = dict(doc.get("timestamps") or {})
+
+    ts_field = update.get("status")
+    if ts_field in TIMESTAMP_FIELDS:
+        timestamps[ts_field] = update.get("timestamp")
+
+    return {
+        "status": new_status,
+        "timestamps": timestamps,
+        "conversationId": update.get("conversationId") or doc.get("conversationId"),
+        "gsId": update.get("gsId") or doc.get("gsId"),
+        "metaMsgId": update.get("meta_msg_id") or doc.get("metaMsgId"),
+    }
+
+
+async def apply_status(
+    collection,
+    update: Dict[str, Any],
+    conversations=None,
+    changelog: Optional[ChangeLog] = None,
+    on_changes: Optional[OnChanges] = None,
+) -> Optional[bool]:
+    """Apply one status update in a single round trip to ``processed_messages``.
+
+    Returns None for updates without a target id, False when the message
+    does not exist (yet) and True once applied. ``on_changes`` receives the
+    resulting changes, like BulkIngestor's ``on_flush``.
+    """
+    message_id = status_target(update)
+    if not message_id:
+        return None
+
+    # The pre-image is the exact document the server updated, so replaying
+    # merge_status on it yields the post-image without a second read
+    before = await collection.find_one_and_update(
+        {"_id": message_id},
+        status_update_pipeline(update),
+        projection={"waId": 1, "status": 1, "timestamps": 1, "conversationId": 1, "gsId": 1, "metaMsgId": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return False  # skip if message not present
+
+    fields = merge_status(before, update)
+    wa_id = before.get("waId")
+    summary = None
+    if fields["status"] != before.get("status"):
+        summary = await record_status(conversations, wa_id, message_id, fields["status"])
+    changes: List[Change] = [
+        (MESSAGE_STATUS, wa_id, {"_id": message_id, "status": fields["status"], "timestamps": fields["timestamps"]}),
+        (CONVERSATION_UPDATED, wa_id, summary),
+    ]
+    if changelog is not None:
+        await changelog.append(*changes)
+    if on_changes is not None:
+        await on_changes(changes)
+    return True
+
+
+async def apply_status_batch(
+    collection, updates: List[Dict[str, Any]], conversations=None
+) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """Apply many status updates with one bulk write plus one read-back.
+
+    Returns the post-image (waId, status, timestamps) of every message that
+    was updated, keyed by id, and the updates whose message does not exist.
+    """
+    updates = [u for u in updates if status_target(u)]
+    if not updates:
+        return {}, []
+    targets = [status_target(u) for u in updates]
+    # Ordered so several updates to one message apply in input order;
+    # each op is an atomic server-side promotion, nothing is read first
+    await collection.bulk_write(
+        [UpdateOne({"_id": mid}, status_update_pipeline(u)) for mid, u in zip(targets, updates)],
+        ordered=True,
+    )
+    current: Dict[str, Dict[str, Any]] = {}
+    async for doc in collection.find({"_id": {"$in": list(set(targets))}}, {"waId": 1, "status": 1, "timestamps": 1}):
+        current[doc["_id"]] = doc
+    missing = [u for mid, u in zip(targets, updates) if mid not in current]
+
+    summary_ops = [
+        UpdateOne(
+            {"_id": doc["waId"], "lastMessageId": mid},
+            [{"$set": {"lastMessageStatus": status_promotion_expr("lastMessageStatus", doc.get("status"))}}],
+        )
+        for mid, doc in current.items()
+        if isinstance(doc.get("waId"), str)
+    ]
+    if summary_ops and conversations is not None:
+        await conversations.bulk_write(summary_ops, ordered=False)
+    return current, missing
+
+
+def status_changes(applied: Dict[str, Dict[str, Any]]) -> List[Change]:
+    """Change-log entries for the post-images returned by ``apply_status_batch``."""
+    return [
+        (MESSAGE_STATUS, doc.get("waId"), {"_id": mid, "status": doc.get("status"), "timestamps": doc.get("timestamps")})
+        for mid, doc in applied.items()
+    ]
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Optional
+import base64
+from typing import Any, Dict, Optional, Tuple
 
 
 STATUS_ORDER = {"sent": 1, "delivered": 2, "read": 3}
@@ -14,3 +15,49 @@ def promote_status(current: Optional[str], new: Optional[str]) -> Optional[str]:
     if STATUS_ORDER.get(new, 0) > STATUS_ORDER.get(current, 0):
         return new
     return current
+
+
+def _rank_expr(field: str) -> Dict[str, Any]:
+    return {
+        "$switch": {
+            "branches": [
+                {"case": {"$eq": [f"${field}", name]}, "then": rank}
+                for name, rank in STATUS_ORDER.items()
+            ],
+            "default": 0,
+        }
+    }
+
+
+def status_promotion_expr(field: str, new: Optional[str]) -> Any:
+    """Server-side ``promote_status(<field>, new)``."""
+    if new is None:
+        return f"${field}"
+    return {
+        "$cond": [
+            {
+                "$or": [
+                    {"$eq": [{"$ifNull": [f"${field}", None]}, None]},
+                    {"$gt": [STATUS_ORDER.get(new, 0), _rank_expr(field)]},
+                ]
+            },
+            {"$literal": new},
+            f"${field}",
+        ]
+    }
+
+
+def encode_cursor(ts: int, message_id: str) -> str:
+    """Opaque keyset cursor for the (timestamps.whatsapp, _id) ordering."""
+    raw = f"{int(ts)}:{message_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        ts, message_id = raw.split(":", 1)
+        return int(ts), message_id
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
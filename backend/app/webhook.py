@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from . import config
+from .changes import ChangeLog
+from .deltas import publish_changes
+from .dedup import DedupCache
+from .ingest import BulkIngestor, IngestStats, Record
+from .leases import Lease, node_id
+from .pending import PendingStatusBuffer
+
+logger = logging.getLogger("uvicorn.error")
+
+# Renewed before every spooled batch, so only a dead drainer lets it lapse
+_SPOOL_LEASE_SECONDS = 30
+
+
+class WebhookBatcher:
+    """In-process micro-batcher behind ``POST /webhook``.
+
+    ``submit`` only appends extracted records to a buffer, so a request is
+    acknowledged without waiting for Mongo. One flusher task writes the
+    buffer through BulkIngestor once it holds ``batch_size`` records or its
+    oldest record has waited ``max_delay_ms``, then publishes the flushed
+    changes to WebSocket subscribers. Records keep their arrival order, so a
+    status still lands after the message it refers to. Provider retries are
+    acknowledged as usual but dropped by ``dedup`` before the write.
+
+    Acknowledged records are never given up: a batch whose write fails goes
+    back to the front of the buffer and is retried with exponential
+    backoff. If it no longer fits there, it is moved to the ``spool``
+    collection and written from there later, before newer records. While
+    writes are failing or records this worker spooled are still there,
+    ``submit`` refuses new work, so the provider gets a 503 and retries later.
+
+    Every worker shares the spool. With ``leases`` only the worker holding
+    the spool lease drains it, oldest rows first, whichever worker spooled them;
+    the others wait for their own rows to be written. Without it (a single
+    process) the batcher drains the spool itself.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        max_delay_ms: Optional[int] = None,
+        queue_limit: Optional[int] = None,
+        dedup: Optional[DedupCache] = None,
+    ) -> None:
+        self.batch_size = batch_size or config.WEBHOOK_BATCH_SIZE
+        self.max_delay = (max_delay_ms if max_delay_ms is not None else config.WEBHOOK_BATCH_DELAY_MS) / 1000
+        self.queue_limit = queue_limit or config.WEBHOOK_QUEUE_LIMIT
+        self.ingest_stats = IngestStats()
+        self.dedup = dedup or DedupCache()
+        self._records: List[Record] = []
+        self._first_at = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stop_requested: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ingestor: Optional[BulkIngestor] = None
+        self._stopping = False
+        self.spool = None
+        self.node = node_id()
+        self._spool_lease: Optional[Lease] = None
+        # Records this worker spooled that are not written yet; > 0 refuses new work
+        self._spooled = 0
+        # Rows left by other or earlier workers, drained without refusing work
+        self._spool_backlog = False
+        self._failing = False
+        self._retry_delay = config.WEBHOOK_RETRY_BASE_MS / 1000
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.errors = 0
+        self.spilled = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(
+        self,
+        collection,
+        conversations=None,
+        changelog: Optional[ChangeLog] = None,
+        pending: Optional[PendingStatusBuffer] = None,
+        spool=None,
+        leases=None,
+    ) -> None:
+        if collection is None or self.running:
+            return
+        self.spool = spool
+        self._spool_lease = Lease(leases, "webhook.spool", _SPOOL_LEASE_SECONDS, self.node) if leases is not None else None
+        if spool is not None:
+            await spool.create_index("node")
+            # Left over from a previous run that could not write them
+            self._spool_backlog = await spool.find_one({}, {"_id": 1}) is not None
+        # The buffer is flushed explicitly, never by BulkIngestor's own size check
+        self._ingestor = BulkIngestor(
+            collection,
+            conversations,
+            changelog,
+            batch_size=self.queue_limit + 1,
+            stats=self.ingest_stats,
+            pending=pending,
+            on_flush=publish_changes,
+            dedup=self.dedup,
+        )
+        self._wakeup = asyncio.Event()
+        self._stop_requested = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write whatever is still buffered and stop the flusher."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._stop_requested.set()
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self._spool_lease is not None:
+            try:
+                await self._spool_lease.release()
+            except Exception:
+                logger.exception("Could not release the webhook spool lease")
+
+    def accepting(self, count: int = 1) -> bool:
+        """Whether ``count`` more records would be queued right now; lets the
+        endpoint refuse a request before it reads and parses the body."""
+        return (
+            self.running
+            and not self._failing
+            and self._spooled == 0
+            and len(self._records) + count <= self.queue_limit
+        )
+
+    def submit(self, records: List[Record]) -> bool:
+        """Queue ``records`` for the next flush; False when the buffer is full
+        or earlier records are still waiting for a failed write to succeed."""
+        if not self.accepting(len(records)):
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        if not records:
+            return True
+        if not self._records:
+            self._first_at = time.monotonic()
+        self._records.extend(records)
+        if len(self._records) >= self.batch_size or len(self._records) == len(records):
+            # Wake the flusher for a full batch, or to arm the deadline
+            self._wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            if (self._spooled > 0 or self._spool_backlog) and not self._stopping:
+                # Spooled records are older than anything buffered
+                if not await self._drain_spool():
+                    await self._backoff()
+                continue
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._records:
+                if self._stopping:
+                    return
+                continue
+            remaining = self._first_at + self.max_delay - time.monotonic()
+            if remaining > 0 and len(self._records) < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            batch = self._records[: self.batch_size]
+            del self._records[: len(batch)]
+            if self._records or self._stopping:
+                # Leftovers are already due; flush them straight away
+                self._wakeup.set()
+            if await self._flush(batch):
+                continue
+            if self._stopping:
+                # No time left for retries; keep everything for the next start
+                await self._requeue(batch)
+                if not await self._spill(self._records):
+                    logger.error("Dropping %d webhook records at shutdown", len(self._records))
+                self._records = []
+                return
+            await self._requeue(batch)
+            await self._backoff()
+
+    async def _flush(self, batch: List[Record]) -> bool:
+        """Write ``batch``; False (after logging) if the write failed."""
+        started = time.perf_counter()
+        try:
+            for kind, record in batch:
+                if kind == "message":
+                    await self._ingestor.add_message(record)
+                else:
+                    await self._ingestor.add_status(record)
+            await self._ingestor.flush()
+            ok = True
+        except Exception:
+            # The provider already has its 202; the batch is retried instead
+            self.errors += 1
+            self._failing = True
+            logger.exception("Webhook batch of %d records failed; will retry", len(batch))
+            ok = False
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.last_flush_ms = elapsed * 1000
+        self.ingest_stats.elapsed_seconds += elapsed
+        if ok:
+            self._failing = False
+            self._retry_delay = config.WEBHOOK_RETRY_BASE_MS / 1000
+        return ok
+
+    async def _requeue(self, batch: List[Record]) -> None:
+        """Put a failed batch back in front of the buffer, or in the spool."""
+        if len(self._records) + len(batch) > self.queue_limit and await self._spill(batch):
+            return
+        # Without room or a spool, hold the records over the limit rather
+        # than lose them; submit refuses new ones meanwhile
+        self._records[:0] = batch
+        self._first_at = time.monotonic() - self.max_delay
+        self._wakeup.set()
+
+    async def _spill(self, records: List[Record]) -> bool:
+        if self.spool is None or not records:
+            return not records
+        now = datetime.now(timezone.utc)
+        try:
+            # ObjectIds sort in insertion order, which keeps the spool FIFO
+            await self.spool.insert_many(
+                [
+                    {"_id": ObjectId(), "kind": kind, "record": record, "at": now, "node": self.node}
+                    for kind, record in records
+                ]
+            )
+        except Exception:
+            logger.exception("Could not spool %d webhook records", len(records))
+            return False
+        self._spooled += len(records)
+        self.spilled += len(records)
+        return True
+
+    async def _drain_spool(self) -> bool:
+        """Write the oldest spooled batch; False if that failed or, for a
+        worker without the lease, while its own rows are still waiting."""
+        try:
+            if self._spool_lease is not None and not await self._spool_lease.acquire():
+                # The holder writes our rows too; check whether it got to them
+                self._spool_backlog = False
+                self._spooled = await self.spool.count_documents({"node": self.node})
+                return self._spooled == 0
+            rows = await self.spool.find({}).sort("_id", 1).limit(self.batch_size).to_list(length=self.batch_size)
+        except Exception:
+            logger.exception("Could not read the webhook spool")
+            return False
+        if rows and not await self._flush([(row["kind"], row["record"]) for row in rows]):
+            return False
+        try:
+            if rows:
+                await self.spool.delete_many({"_id": {"$in": [row["_id"] for row in rows]}})
+        except Exception:
+            # Written already; a second write of them is a deduplicated no-op
+            logger.exception("Could not clear %d spooled webhook records", len(rows))
+            return False
+        if len(rows) < self.batch_size:
+            # Drained: nothing of ours or anyone else's is left
+            self._spooled = 0
+            self._spool_backlog = False
+            if self._spool_lease is not None:
+                try:
+                    await self._spool_lease.release()
+                except Exception:
+                    # It lapses on its own after _SPOOL_LEASE_SECONDS
+                    logger.exception("Could not release the webhook spool lease")
+        else:
+            self._spooled = max(0, self._spooled - sum(1 for row in rows if row.get("node") == self.node))
+        return True
+
+    async def _backoff(self) -> None:
+        delay = self._retry_delay
+        self._retry_delay = min(delay * 2, config.WEBHOOK_RETRY_MAX_MS / 1000)
+        try:
+            # stop() cuts the wait short
+            await asyncio.wait_for(self._stop_requested.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "buffered": len(self._records),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "failing": self._failing,
+            "spooled": self._spooled,
+            "spilled": self.spilled,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_batch": round(
+                (self.ingest_stats.messages_upserted + self.ingest_stats.statuses_applied) / self.flushes, 1
+            )
+            if self.flushes
+            else 0.0,
+            "ingest": self.ingest_stats.as_dict(),
+            "dedup": self.dedup.stats(),
+        }
+
+
+batcher = WebhookBatcher()
@@ -1,35 +1,306 @@
 from __future__ import annotations
 
+import asyncio
 import json
-from typing import Set
+from typing import Callable, Dict, Iterable, List, Optional, Set
 
 from fastapi import WebSocket
 
+from . import config
+from .backplane import Backplane
+from .metrics import timed, ws_broadcast_latency
+
+
+# Topic for clients showing the conversation list; every write is published here
+CONVERSATIONS_TOPIC = "conversations"
+# Upper bound on topics one socket may hold, to keep the index bounded
+MAX_TOPICS_PER_CONNECTION = 256
+# Topics starting with this carry events between workers (cache
+# invalidations) and cannot be subscribed to by clients
+INTERNAL_TOPIC_PREFIX = "_"
+USERS_TOPIC = "_users"
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+
+# Schema version of live events (see app.deltas); 1 was the bare
+# {"type": "insert"} / {"type": "status"} refetch triggers
+EVENT_VERSION = 2
+
+# listener(data, topics): sees every event this process delivers, before its sockets
+Listener = Callable[[str, Optional[List[str]]], None]
+# Sent instead of a backlog under the "coalesce" policy: the client missed
+# events and should catch up through GET /sync
+RESYNC_FRAME = json.dumps({"v": EVENT_VERSION, "type": "resync"})
+
+
+def wa_topic(wa_id: str) -> str:
+    return f"wa:{wa_id}"
+
+
+def is_client_topic(topic: object) -> bool:
+    return isinstance(topic, str) and bool(topic) and not topic.startswith(INTERNAL_TOPIC_PREFIX)
+
+
+def topics_for(wa_id: Optional[str]) -> list[str]:
+    """Topics a write to ``wa_id`` is published on."""
+    topics = [CONVERSATIONS_TOPIC]
+    if wa_id:
+        topics.append(wa_topic(wa_id))
+    return topics
+
+
+class _Connection:
+    __slots__ = ("websocket", "queue", "writer", "topics", "seq")
+
+    def __init__(self, websocket: WebSocket, queue_size: int) -> None:
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.topics: Set[str] = set()
+        # Number of the last frame queued for this socket
+        self.seq = 0
+
 
 class WebSocketManager:
-    def __init__(self) -> None:
-        self._connections: Set[WebSocket] = set()
+    """Topic-indexed fan-out with one bounded send queue per connection.
+
+    ``broadcast`` only enqueues; each connection's writer task drains its own
+    queue, so a slow socket never delays the caller or the other sockets.
+    Every frame a socket is sent carries ``seq``, counting up from 1 per
+    connection; a frame dropped for a slow consumer leaves a gap, which
+    tells the client to catch up through GET /sync.
+    """
+
+    def __init__(self, queue_size: Optional[int] = None, policy: Optional[str] = None) -> None:
+        self.queue_size = queue_size or config.WS_SEND_QUEUE_SIZE
+        self.policy = policy or config.WS_SLOW_CONSUMER_POLICY
+        if self.policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {self.policy}")
+        self._connections: Dict[WebSocket, _Connection] = {}
+        # topic -> sockets subscribed to it
+        self._topics: Dict[str, Set[WebSocket]] = {}
+        self._backplane: Optional[Backplane] = None
+        self._listeners: List[Listener] = []
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.backplane_losses = 0
+
+    async def start(self, backplane: Backplane) -> None:
+        """Route broadcasts through ``backplane`` so every worker receives them."""
+        await backplane.start(self.deliver, self._on_backplane_loss)
+        self._backplane = backplane
+
+    def _on_backplane_loss(self) -> None:
+        # Another worker's events never arrived: sockets and listeners (read
+        # and user caches) cannot tell which, so everything starts over
+        self.backplane_losses += 1
+        self.deliver(RESYNC_FRAME, None)
+
+    async def stop(self) -> None:
+        if self._backplane is not None:
+            await self._backplane.stop()
+            self._backplane = None
+
+    def add_listener(self, listener: Listener) -> None:
+        """Also hand every delivered event to ``listener`` (e.g. cache invalidation).
+
+        Events from other workers arrive through the backplane, so listeners
+        see every worker's writes.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
 
     async def connect(self, websocket: WebSocket) -> None:
         await websocket.accept()
-        self._connections.add(websocket)
+        conn = _Connection(websocket, self.queue_size)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self._connections[websocket] = conn
 
     def disconnect(self, websocket: WebSocket) -> None:
-        if websocket in self._connections:
-            self._connections.remove(websocket)
+        conn = self._connections.pop(websocket, None)
+        if conn is None:
+            return
+        for topic in conn.topics:
+            self._remove_from_topic(topic, websocket)
+        self._clear(conn)
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
 
-    async def broadcast(self, message: dict) -> None:
-        data = json.dumps(message)
-        dead: list[WebSocket] = []
-        for ws in list(self._connections):
-            try:
-                await ws.send_text(data)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(ws)
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        conn = self._connections.get(websocket)
+        if conn is None:
+            return set()
+        for topic in topics:
+            if topic in conn.topics:
+                continue
+            if len(conn.topics) >= MAX_TOPICS_PER_CONNECTION:
+                break
+            conn.topics.add(topic)
+            self._topics.setdefault(topic, set()).add(websocket)
+        return set(conn.topics)
 
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        conn = self._connections.get(websocket)
+        if conn is None:
+            return set()
+        for topic in topics:
+            if topic in conn.topics:
+                conn.topics.remove(topic)
+                self._remove_from_topic(topic, websocket)
+        return set(conn.topics)
 
-manager = WebSocketManager()
+    def _remove_from_topic(self, topic: str, websocket: WebSocket) -> None:
+        sockets = self._topics.get(topic)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self._topics[topic]
+
+    async def handle_client_message(self, websocket: WebSocket, text: str) -> None:
+        """Apply a ``{"action": "subscribe"|"unsubscribe", "topics": [...]}`` frame.
+
+        Topics are ``"conversations"`` or ``"wa:<waId>"``; the reply lists the
+        socket's subscriptions after the change.
+        """
+        conn = self._connections.get(websocket)
+        if conn is None:
+            return
+        try:
+            frame = json.loads(text)
+            action = frame.get("action")
+            topics = frame.get("topics") or []
+            if action not in ("subscribe", "unsubscribe") or not isinstance(topics, list):
+                raise ValueError
+            topics = [t for t in topics if is_client_topic(t)]
+        except Exception:
+            self._enqueue(conn, json.dumps({"type": "error", "detail": "Invalid frame"}))
+            return
+        if action == "subscribe":
+            current = self.subscribe(websocket, topics)
+        else:
+            current = self.unsubscribe(websocket, topics)
+        self._enqueue(conn, json.dumps({"type": "subscriptions", "topics": sorted(current)}))
+
+    def _targets(self, topics: Optional[Iterable[str]]) -> Set[WebSocket]:
+        if topics is None:
+            return set(self._connections)
+        targets: Set[WebSocket] = set()
+        for topic in topics:
+            targets.update(self._topics.get(topic, ()))
+        return targets
+
+    async def broadcast(self, message: dict, topics: Optional[Iterable[str]] = None) -> None:
+        """Publish ``message`` to sockets subscribed to any of ``topics``.
+
+        ``topics=None`` sends to every socket. With a backplane started the
+        event reaches the sockets of every worker. Never waits on a socket.
+        """
+        with timed(ws_broadcast_latency):
+            data = json.dumps(message)
+            topic_list = list(topics) if topics is not None else None
+            if self._backplane is not None:
+                await self._backplane.publish(data, topic_list)
+            else:
+                self.deliver(data, topic_list)
+
+    def deliver(self, data: str, topics: Optional[Iterable[str]] = None) -> None:
+        """Queue an already serialised event for this process's sockets."""
+        for listener in self._listeners:
+            listener(data, topics)
+        for ws in self._targets(topics):
+            conn = self._connections.get(ws)
+            if conn is not None:
+                self._enqueue(conn, data)
 
+    @staticmethod
+    def _stamp(conn: _Connection, data: str) -> str:
+        # Events are serialised JSON objects; splice the sequence number in
+        # rather than parsing and re-encoding once per socket. Anything else
+        # (a listener's or another worker's array, say) is wrapped instead.
+        conn.seq += 1
+        body = data.strip()
+        if not (body.startswith("{") and body.endswith("}")):
+            return f'{{"data": {body}, "seq": {conn.seq}}}'
+        if body[1:-1].strip() == "":
+            return f'{{"seq": {conn.seq}}}'
+        return f'{body[:-1]}, "seq": {conn.seq}}}'
 
+    def _enqueue(self, conn: _Connection, data: str) -> None:
+        frame = self._stamp(conn, data)
+        try:
+            conn.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "disconnect":
+            self.slow_disconnects += 1
+            self.disconnect(conn.websocket)
+            asyncio.create_task(self._close_quietly(conn.websocket))
+        elif self.policy == "coalesce":
+            self.coalesced += self._clear(conn)
+            conn.queue.put_nowait(self._stamp(conn, RESYNC_FRAME))
+        else:
+            self.dropped += self._clear(conn, 1)
+            conn.queue.put_nowait(frame)
+
+    @staticmethod
+    def _clear(conn: _Connection, limit: Optional[int] = None) -> int:
+        removed = 0
+        while not conn.queue.empty() and (limit is None or removed < limit):
+            conn.queue.get_nowait()
+            conn.queue.task_done()
+            removed += 1
+        return removed
+
+    async def _writer(self, conn: _Connection) -> None:
+        try:
+            while True:
+                data = await conn.queue.get()
+                try:
+                    await conn.websocket.send_text(data)
+                    self.sent += 1
+                finally:
+                    conn.queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(conn.websocket)
+            # Half-open sockets still hold a connection until they are closed
+            asyncio.create_task(self._close_quietly(conn.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket) -> None:
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    async def drain(self) -> None:
+        """Wait until every queued frame has been handed to its socket."""
+        await asyncio.gather(*(c.queue.join() for c in list(self._connections.values())))
+
+    def stats(self) -> dict:
+        depths = [c.queue.qsize() for c in self._connections.values()]
+        return {
+            "connections": len(depths),
+            "topics": len(self._topics),
+            "queue_size": self.queue_size,
+            "policy": self.policy,
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "backplane_losses": self.backplane_losses,
+            "backplane": self._backplane.stats() if self._backplane is not None else None,
+        }
+
+
+manager = WebSocketManager()
@@ -0,0 +1,74 @@
+import sys
+import os
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..', 'scripts'))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from fastapi.testclient import TestClient
+
+from app import config
+from app import db as app_db
+from app import main as app_main
+from memmongo import MemoryClient
+
+
+# Module globals init_database sets; reset after every test that uses db_globals
+_DB_GLOBALS = (
+    "mongo_client",
+    "messages_collection",
+    "users_collection",
+    "conversations_collection",
+    "changelog",
+    "pending_statuses",
+    "webhook_spool",
+    "leases_collection",
+)
+
+
+@pytest.fixture
+def memory_client():
+    return MemoryClient()
+
+
+@pytest.fixture
+def memory_db(memory_client):
+    """In-memory stand-in for the app's database (scripts/memmongo.py).
+
+    Seed it with ``memory_db[collection].load(docs)``.
+    """
+    return memory_client[config.DATABASE_NAME]
+
+
+@pytest.fixture
+def db_globals(monkeypatch):
+    """Unbound app.db globals, restored after the test calls init_database."""
+    for name in _DB_GLOBALS:
+        monkeypatch.setattr(app_db, name, None)
+    return app_db
+
+
+@pytest.fixture
+def app_client(monkeypatch, db_globals, memory_client, memory_db):
+    """TestClient for the app, connected to ``memory_db`` through init_database."""
+
+    async def connect():
+        await app_db.init_database(memory_client, memory_db)
+
+    monkeypatch.setattr(app_main, "connect_to_mongo", connect)
+    with TestClient(app_main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def ops_headers(monkeypatch):
+    """Headers for the OPS_TOKEN-protected endpoints (/metrics, /*/stats)."""
+    monkeypatch.setattr(config, "OPS_TOKEN", "test-ops-token")
+    return {"Authorization": "Bearer test-ops-token"}
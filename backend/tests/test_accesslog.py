@@ -0,0 +1,119 @@
+import sys
+import os
+import io
+import json
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+
+from app import main as app_main
+from app.accesslog import AccessLogger, AccessLogMiddleware, access_log
+
+
+def test_successes_are_sampled_but_errors_and_slow_requests_always_logged():
+    logger = AccessLogger(enabled=True, sample_rate=0.0, slow_ms=100, stream=io.StringIO())
+    assert logger.should_log(200, 0.01) is None
+    assert logger.should_log(404, 0.01) == "error"
+    assert logger.should_log(503, 0.01) == "error"
+    assert logger.should_log(200, 0.5) == "slow"
+    assert logger.skipped == 1
+    logger.sample_rate = 1.0
+    assert logger.should_log(200, 0.01) == "sampled"
+
+
+def test_full_queue_drops_instead_of_blocking():
+    stream = io.StringIO()
+    logger = AccessLogger(enabled=True, queue_size=2, stream=stream)
+    for i in range(5):
+        logger.submit({"ts": 0, "n": i})
+    assert logger.dropped == 3
+    # The writer drains what was queued before it started, then stops
+    logger.start()
+    logger.stop()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["n"] for line in lines] == [0, 1]
+    assert lines[0]["ts"] == "1970-01-01T00:00:00.000+00:00"
+    assert logger.written == 2
+
+
+class BlockingStream(io.StringIO):
+    """Holds the first write until ``release`` is set, like a stalled pipe."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+def test_stop_does_not_block_on_a_full_queue():
+    stream = BlockingStream()
+    logger = AccessLogger(enabled=True, queue_size=1, stream=stream)
+    logger.start()
+    logger.submit({"ts": 0, "n": 0})
+    # Let the writer take the first record and stall on it, then fill the queue
+    while logger._queue.qsize():
+        time.sleep(0.001)
+    logger.submit({"ts": 0, "n": 1})
+    threading.Timer(0.3, stream.release.set).start()
+    started = time.perf_counter()
+    logger.stop(timeout=0.01)
+    assert time.perf_counter() - started < 0.2
+    # The writer still finishes what was queued, then exits
+    deadline = time.monotonic() + 5
+    while logger.written < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert logger.written == 2
+
+
+def test_unhandled_errors_reach_the_error_log_even_when_disabled(caplog):
+    async def failing(scope, receive, send):
+        raise RuntimeError("boom")
+
+    middleware = AccessLogMiddleware(failing, AccessLogger(enabled=False))
+    with caplog.at_level(logging.ERROR, logger="uvicorn.error"):
+        with pytest.raises(RuntimeError):
+            asyncio.run(middleware({"type": "http", "method": "GET", "path": "/x"}, None, None))
+    assert "Unhandled error on GET /x: boom" in caplog.text
+
+
+@pytest.fixture
+def logged(monkeypatch):
+    async def fake_connect():
+        return None
+
+    async def fake_close():
+        return None
+
+    stream = io.StringIO()
+    monkeypatch.setattr(app_main, "connect_to_mongo", fake_connect)
+    monkeypatch.setattr(app_main, "close_mongo_connection", fake_close)
+    monkeypatch.setattr(access_log, "enabled", True)
+    monkeypatch.setattr(access_log, "sample_rate", 0.0)
+    monkeypatch.setattr(access_log, "stream", stream)
+    return stream
+
+
+def test_requests_are_written_as_json_lines_by_the_writer(logged):
+    with TestClient(app_main.app) as client:
+        for _ in range(3):
+            assert client.get("/health").status_code == 200
+        assert client.get("/messages").status_code == 422
+    # Shutdown stops the writer after it has written everything queued
+    lines = [json.loads(line) for line in logged.getvalue().splitlines()]
+    assert len(lines) == 1
+    assert lines[0]["path"] == "/messages" and lines[0]["route"] == "/messages"
+    assert lines[0]["status"] == 422 and lines[0]["reason"] == "error" and lines[0]["sample_rate"] == 0.0
+    assert lines[0]["duration_ms"] >= 0
@@ -2,6 +2,7 @@ import sys
 import os
 import types
 import asyncio
+import threading
 
 import pytest
 
@@ -13,16 +14,22 @@ if BACKEND_DIR not in sys.path:
 
 from fastapi.testclient import TestClient
 
+from app import auth as auth_module
+from app import config as app_config
 from app import db as app_db
 from app import main as app_main
+from app.auth import user_changed
+from app.authcache import claims_cache, user_cache
 
 
 class FakeUsersCollection:
     def __init__(self):
         self.by_id = {}
         self.by_username = {}
+        self.reads = 0
 
-    async def find_one(self, query):
+    async def find_one(self, query, projection=None):
+        self.reads += 1
         if "_id" in query:
             return self.by_id.get(query["_id"]) or None
         if "username" in query:
@@ -61,12 +68,15 @@ def client(monkeypatch):
 
     # Ensure SECRET_KEY is set for JWT
     monkeypatch.setenv("SECRET_KEY", "testsecret")
+    # config reads the environment at import time
+    monkeypatch.setattr(app_config, "SECRET_KEY", "testsecret")
 
     # Patch the bound functions in main module (startup/shutdown)
     monkeypatch.setattr(app_main, "connect_to_mongo", fake_connect)
     monkeypatch.setattr(app_main, "close_mongo_connection", fake_close)
 
     with TestClient(app_main.app) as c:
+        c.users = users
         yield c
 
 
@@ -97,3 +107,82 @@ def test_register_login_me_flow(client):
     # Wrong password
     r5 = client.post("/login", json={"username": "alice", "password": "wrong"})
     assert r5.status_code == 401
+
+
+def test_authenticated_requests_skip_jwt_and_db_after_the_first(client, monkeypatch, ops_headers):
+    client.post("/register", json={"username": "bob", "password": "secret123"})
+    tok = client.post("/login", json={"username": "bob", "password": "secret123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {tok}"}
+    claims_cache.clear()
+
+    assert client.get("/me", headers=headers).status_code == 200
+    reads = client.users.reads
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("token decoded again")
+
+    monkeypatch.setattr(auth_module.jwt, "decode", no_decode)
+    for _ in range(3):
+        assert client.get("/me", headers=headers).status_code == 200
+    assert client.users.reads == reads
+    stats = client.get("/auth/stats", headers=ops_headers).json()
+    assert stats["users"]["hits"] >= 3 and stats["claims"]["hits"] >= 3
+
+
+def test_disabling_a_user_takes_effect_through_user_changed(client):
+    user = client.post("/register", json={"username": "carol", "password": "secret123"}).json()
+    tok = client.post("/login", json={"username": "carol", "password": "secret123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {tok}"}
+    assert client.get("/me", headers=headers).status_code == 200
+
+    client.users.by_id[user["_id"]]["disabled"] = True
+    # Still cached until the change is announced
+    assert client.get("/me", headers=headers).status_code == 200
+    client.portal.call(user_changed, user["_id"], "carol")
+    assert client.get("/me", headers=headers).status_code == 400
+    assert user_cache.stats()["invalidations"] >= 1
+
+
+def test_login_is_refused_with_503_when_the_hash_pool_is_saturated(client, monkeypatch):
+    client.post("/register", json={"username": "dave", "password": "secret123"})
+    pool = auth_module.hash_pool
+    monkeypatch.setattr(pool, "in_flight", pool.workers + pool.queue_limit)
+    r = client.post("/login", json={"username": "dave", "password": "secret123"})
+    assert r.status_code == 503 and r.headers["retry-after"] == "1"
+    assert pool.stats()["rejected"] >= 1
+
+
+def test_hash_pool_holds_a_slot_until_the_thread_finishes():
+    release = threading.Event()
+
+    def slow_hash():
+        release.wait(5)
+        return "hash"
+
+    def broken_hash():
+        raise ValueError("bad salt")
+
+    async def scenario():
+        pool = auth_module.HashPool(workers=1, queue_limit=0)
+        caller = asyncio.create_task(pool.run(slow_hash))
+        await asyncio.sleep(0.05)
+        # The client went away, but bcrypt keeps running on the thread
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        with pytest.raises(Exception) as refused:
+            await pool.run(slow_hash)
+        release.set()
+        for _ in range(100):
+            if pool.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        with pytest.raises(ValueError):
+            await pool.run(broken_hash)
+        await asyncio.sleep(0.01)
+        pool.shutdown()
+        return refused.value, pool.stats()
+
+    refused, stats = asyncio.run(scenario())
+    assert refused.status_code == 503
+    assert stats["in_flight"] == 0 and stats["rejected"] == 1
+    assert stats["completed"] == 1 and stats["failed"] == 1
@@ -0,0 +1,152 @@
+import sys
+import os
+import asyncio
+import json
+import subprocess
+import textwrap
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.authcache import UserCache
+from app.backplane import UnixSocketBackplane
+from app.ws import RESYNC_FRAME, WebSocketManager
+
+# One "worker": a WebSocketManager with a single fake socket on the
+# conversation list topic, joined to the Unix-socket backplane in argv[1].
+WORKER = textwrap.dedent(
+    """
+    import asyncio, json, sys
+    sys.path.insert(0, sys.argv[3])
+    from app.backplane import UnixSocketBackplane
+    from app.ws import CONVERSATIONS_TOPIC, WebSocketManager
+
+    class FakeSocket:
+        def __init__(self):
+            self.sent = []
+        async def accept(self):
+            pass
+        async def send_text(self, data):
+            self.sent.append(json.loads(data))
+
+    async def main():
+        manager = WebSocketManager()
+        sock = FakeSocket()
+        await manager.connect(sock)
+        manager.subscribe(sock, [CONVERSATIONS_TOPIC])
+        await manager.start(UnixSocketBackplane(sys.argv[1]))
+        print("ready", flush=True)
+        loop = asyncio.get_running_loop()
+        command = (await loop.run_in_executor(None, sys.stdin.readline)).strip()
+        if command == "publish":
+            await manager.broadcast({"type": "insert", "origin": sys.argv[2]}, topics=[CONVERSATIONS_TOPIC])
+        for _ in range(50):
+            if sock.sent:
+                break
+            await asyncio.sleep(0.02)
+        await manager.drain()
+        print(json.dumps(sock.sent), flush=True)
+        await manager.stop()
+
+    asyncio.run(main())
+    """
+)
+
+
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"), reason="needs Unix sockets")
+def test_broadcast_reaches_every_worker_process(tmp_path):
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, str(tmp_path), str(i), BACKEND_DIR],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for i in range(3)
+    ]
+    try:
+        for proc in workers:
+            assert proc.stdout.readline().strip() == "ready"
+        # Worker 0 publishes; the others only listen
+        for i, proc in enumerate(workers):
+            proc.stdin.write("publish\n" if i == 0 else "listen\n")
+            proc.stdin.flush()
+        received = [json.loads(proc.stdout.readline()) for proc in workers]
+    finally:
+        for proc in workers:
+            proc.wait(timeout=10)
+
+    assert received == [[{"type": "insert", "origin": "0", "seq": 1}]] * 3
+    # Every worker removed its socket file on shutdown
+    assert list(tmp_path.glob("*.sock")) == []
+
+
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"), reason="needs Unix sockets")
+def test_lost_datagrams_resync_the_receiving_worker(tmp_path):
+    async def scenario():
+        receiver = WebSocketManager()
+        users = UserCache(ttl_seconds=60)
+        users.put("u1", {"_id": "u1"})
+        receiver.add_listener(users.on_event)
+        delivered = []
+        receiver.add_listener(lambda data, topics: delivered.append((data, topics)))
+        backplane = UnixSocketBackplane(str(tmp_path))
+        await receiver.start(backplane)
+        envelope = {"node": "peer", "data": "{}", "topics": ["_users"]}
+        backplane._on_datagram(json.dumps({**envelope, "seq": 1}).encode())
+        # Seq 2 never arrived
+        backplane._on_datagram(json.dumps({**envelope, "seq": 3}).encode())
+        # A ping for seq 4: the event itself was lost too
+        backplane._on_datagram(json.dumps({"node": "peer", "seq": 4}).encode())
+        backplane._on_datagram(json.dumps({"node": "peer", "seq": 4}).encode())
+        await receiver.stop()
+        return delivered, backplane.stats(), receiver.backplane_losses, users.get("u1")
+
+    delivered, stats, losses, cached_user = asyncio.run(scenario())
+    assert [d for d in delivered if d[1] is None] == [(RESYNC_FRAME, None)] * 2
+    assert stats["received"] == 2 and stats["losses"] == 2 and losses == 2
+    assert cached_user is None
+
+
+class FailingOnce:
+    def __init__(self, sock):
+        self.sock = sock
+        self.failed = False
+
+    def sendto(self, data, peer):
+        if not self.failed:
+            self.failed = True
+            raise BlockingIOError("buffer full")
+        return self.sock.sendto(data, peer)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"), reason="needs Unix sockets")
+def test_sender_pings_a_peer_it_could_not_reach(tmp_path):
+    async def scenario():
+        sender = UnixSocketBackplane(str(tmp_path))
+        receiver = UnixSocketBackplane(str(tmp_path))
+        losses = []
+        await sender.start(lambda data, topics: None)
+        await receiver.start(lambda data, topics: None, lambda: losses.append(1))
+        await sender.publish("{}", ["_users"])
+        await asyncio.sleep(0.01)
+        # Simulate a full receive buffer for the next event
+        sender._sender = FailingOnce(sender._sender)
+        await sender.publish("{}", ["_users"])
+        await asyncio.sleep(sender.RETRY_SECONDS * 3)
+        stats = sender.stats()
+        await sender.stop()
+        await receiver.stop()
+        return stats, losses
+
+    stats, losses = asyncio.run(scenario())
+    assert stats["send_failures"] == 1 and stats["peers_behind"] == 0
+    assert losses == [1]
+
@@ -0,0 +1,210 @@
+import sys
+import os
+import asyncio
+import json
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app import config
+from app.changes import ChangeLog, MESSAGE_INSERTED
+from app.leases import Lease
+from app.conversations import (
+    COVERED_INDEX_KEYS,
+    COVERED_INDEX_NAME,
+    SUMMARY_FIELDS,
+    SUMMARY_PROJECTION,
+    list_cursor,
+    rebuild_conversations,
+    rebuild_pipeline,
+    record_message,
+    record_status,
+)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.hinted = None
+
+    def sort(self, *args):
+        return self
+
+    def hint(self, index):
+        self.hinted = index
+        return self
+
+
+class RecordingCollection:
+    def find(self, query, projection=None):
+        self.projection = projection
+        return RecordingCursor()
+
+
+def test_rebuild_pipeline_carries_only_summary_fields():
+    pipeline = rebuild_pipeline("conversations")
+    assert "$$ROOT" not in json.dumps(pipeline)
+    # The first stage after the filter narrows every document
+    assert list(pipeline[1]) == ["$project"]
+
+
+def test_covered_index_holds_every_listed_field(monkeypatch):
+    assert {key for key, _ in COVERED_INDEX_KEYS} == set(SUMMARY_FIELDS)
+    assert COVERED_INDEX_KEYS[0] == ("lastMessageAt", -1)
+    # _id is excluded, otherwise the query would have to fetch documents
+    assert SUMMARY_PROJECTION["_id"] == 0
+
+    collection = RecordingCollection()
+    assert list_cursor(collection).hinted is None
+    monkeypatch.setattr(config, "CONVERSATIONS_COVERED_INDEX", True)
+    assert list_cursor(collection).hinted == COVERED_INDEX_NAME
+    assert collection.projection == SUMMARY_PROJECTION
+
+
+def _message(message_id, ts, direction="inbound", status=None, name=None):
+    return {
+        "_id": message_id,
+        "waId": "911",
+        "name": name,
+        "text": message_id,
+        "direction": direction,
+        "status": status,
+        "timestamps": {"whatsapp": ts},
+    }
+
+
+def test_record_message_keeps_the_newest_message_whatever_the_arrival_order(memory_db):
+    conversations = memory_db[config.COLLECTION_CONVERSATIONS]
+
+    async def scenario():
+        await record_message(conversations, _message("m2", 200, name="Ravi"))
+        # Older, arriving late: counted, but not the last message
+        older = await record_message(conversations, _message("m1", 100, direction="outbound", status="sent"))
+        # Same second as m2 but a larger _id: the (timestamp, _id) order puts it last
+        tied = await record_message(conversations, _message("m3", 200))
+        return older, tied, await conversations.find_one({"_id": "911"})
+
+    older, tied, summary = asyncio.run(scenario())
+    assert older["lastMessageText"] == "m2" and older["name"] == "Ravi"
+    assert tied["lastMessageText"] == "m3" and tied["lastMessageAt"] == 200
+    assert summary["lastMessageId"] == "m3"
+    assert (summary["messageCount"], summary["inboundCount"], summary["outboundCount"]) == (3, 2, 1)
+    # A message without a name does not erase the one already seen
+    assert summary["name"] == "Ravi"
+
+
+def test_record_status_only_promotes_the_last_message(memory_db):
+    conversations = memory_db[config.COLLECTION_CONVERSATIONS]
+
+    async def scenario():
+        await record_message(conversations, _message("m1", 100, direction="outbound", status="sent"))
+        await record_message(conversations, _message("m2", 200, direction="outbound", status="sent"))
+        stale = await record_status(conversations, "911", "m1", "read")
+        read = await record_status(conversations, "911", "m2", "read")
+        # "delivered" arriving after "read" must not move the ticks back
+        late = await record_status(conversations, "911", "m2", "delivered")
+        return stale, read, late
+
+    stale, read, late = asyncio.run(scenario())
+    assert stale is None
+    assert read["lastMessageStatus"] == "read"
+    assert late["lastMessageStatus"] == "read"
+
+
+def test_startup_rebuilds_summaries_only_when_they_are_behind(db_globals, memory_client, memory_db, monkeypatch):
+    monkeypatch.setattr(config, "CHANGELOG_GAP_GRACE_SECONDS", 0)
+    messages = memory_db[config.COLLECTION_MESSAGES]
+    conversations = memory_db[config.COLLECTION_CONVERSATIONS]
+    messages.load([_message("m1", 100), _message("m2", 200)])
+
+    async def start():
+        before = messages.calls["aggregate"]
+        await db_globals.init_database(memory_client, memory_db)
+        return messages.calls["aggregate"] - before
+
+    # Upgrade: no summaries yet
+    assert asyncio.run(start()) == 1
+    assert asyncio.run(conversations.find_one({"_id": "911"}))["messageCount"] == 2
+    # Summaries kept current by the writes: no rebuild on restart
+    asyncio.run(record_message(conversations, _message("m3", 300)))
+    messages.load([_message("m3", 300)])
+    assert asyncio.run(start()) == 0
+    # A message written around the app puts them behind
+    messages.load([_message("m4", 400)])
+    assert asyncio.run(start()) == 1
+    assert asyncio.run(conversations.find_one({"_id": "911"}))["lastMessageId"] == "m4"
+
+
+def test_only_the_lease_holder_rebuilds_at_startup(db_globals, memory_client, memory_db, monkeypatch):
+    monkeypatch.setattr(config, "CHANGELOG_GAP_GRACE_SECONDS", 0)
+    messages = memory_db[config.COLLECTION_MESSAGES]
+    messages.load([_message("m1", 100)])
+    other_worker = Lease(memory_db[config.COLLECTION_LEASES], "conversations.rebuild", 600)
+
+    async def start():
+        await db_globals.init_database(memory_client, memory_db)
+        return messages.calls["aggregate"]
+
+    # Another worker is rebuilding: this one serves the summaries as they are
+    assert asyncio.run(other_worker.acquire()) is True
+    assert asyncio.run(start()) == 0
+    asyncio.run(other_worker.release())
+    assert asyncio.run(start()) == 1
+    # The lease is given back once the rebuild is done
+    assert asyncio.run(other_worker.acquire()) is True
+
+
+class RacingMessages:
+    """Messages whose rebuild aggregation races one API write.
+
+    The write updates the summary before ``$out`` swaps the collection and
+    inserts its message after the aggregation has read the messages.
+    """
+
+    def __init__(self, inner, write):
+        self.inner = inner
+        self.write = write
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def aggregate(self, pipeline, **kwargs):
+        if "$out" not in pipeline[-1]:
+            return self.inner.aggregate(pipeline, **kwargs)
+        return self._racing(pipeline, **kwargs)
+
+    async def _racing(self, pipeline, **kwargs):
+        message = await self.write()
+        async for row in self.inner.aggregate(pipeline, **kwargs):
+            yield row
+        await self.inner.insert_one(message)
+
+
+def test_rebuild_recomputes_summaries_written_while_it_ran(memory_db, monkeypatch):
+    monkeypatch.setattr(config, "CHANGELOG_GAP_GRACE_SECONDS", 0)
+    conversations = memory_db[config.COLLECTION_CONVERSATIONS]
+    changelog = ChangeLog(memory_db[config.COLLECTION_CHANGES], memory_db[config.COLLECTION_COUNTERS])
+    memory_db[config.COLLECTION_MESSAGES].load([_message("m1", 100)])
+
+    async def api_write():
+        message = _message("m2", 200, direction="outbound", status="sent")
+        await record_message(conversations, message)
+        await changelog.append((MESSAGE_INSERTED, "911", message))
+        return message
+
+    messages = RacingMessages(memory_db[config.COLLECTION_MESSAGES], api_write)
+
+    async def scenario():
+        await rebuild_conversations(messages, conversations)
+        lost = await conversations.find_one({"_id": "911"})
+        await messages.delete_one({"_id": "m2"})
+        await conversations.drop()
+        await rebuild_conversations(messages, conversations, changelog)
+        return lost, await conversations.find_one({"_id": "911"})
+
+    lost, summary = asyncio.run(scenario())
+    # Without the change log the swap discards the write's summary update
+    assert lost["lastMessageId"] == "m1" and lost["messageCount"] == 1
+    assert summary["lastMessageId"] == "m2" and summary["messageCount"] == 2
+    assert summary["lastMessageStatus"] == "sent"
@@ -0,0 +1,91 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app import dedup as dedup_module
+from app.dedup import DedupCache, record_key
+from app.ingest import BulkIngestor
+
+
+def _status(mid, status, ts):
+    return {"id": mid, "meta_msg_id": None, "status": status, "timestamp": ts}
+
+
+def test_record_key_distinguishes_status_and_timestamp():
+    assert record_key("message", {"_id": "a"}) == "m:a"
+    assert record_key("status", _status("a", "read", 5)) != record_key("status", _status("a", "read", 6))
+    assert record_key("status", _status("a", "read", 5)) != record_key("status", _status("a", "delivered", 5))
+    assert record_key("message", {"_id": None}) is None
+
+
+def test_lru_window_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup_module.time, "time", lambda: now[0])
+    cache = DedupCache(max_entries=2, ttl_seconds=10, bloom_capacity=0)
+    assert cache.seen("a") is False
+    assert cache.seen("a") is True
+    cache.seen("b")
+    cache.seen("a")  # refreshes "a", so "b" is the one evicted next
+    cache.seen("c")
+    assert cache.seen("b") is False
+    now[0] += 11
+    assert cache.seen("c") is False
+    stats = cache.stats()
+    assert stats["evicted"] == 2 and stats["expired"] == 1 and stats["hits"] == 2
+
+
+def test_bloom_filter_remembers_keys_beyond_the_window():
+    cache = DedupCache(max_entries=10, ttl_seconds=60, bloom_capacity=1000)
+    for i in range(100):
+        cache.seen(f"k{i}")
+    assert len(cache) == 10
+    assert all(cache.seen(f"k{i}") for i in range(90))
+    assert cache.stats()["bloom_hits"] == 90
+
+
+class FakeResult:
+    upserted_ids = {}
+
+
+class FakeCollection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.ops = 0
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.fail:
+            raise RuntimeError("write failed")
+        self.ops += len(ops)
+        return FakeResult()
+
+
+def test_bulk_ingestor_skips_duplicates_before_writing():
+    async def scenario():
+        collection = FakeCollection()
+        bulk = BulkIngestor(collection, batch_size=100, dedup=DedupCache(bloom_capacity=0))
+        for _ in range(3):
+            await bulk.add_message({"_id": "m1", "waId": "1"})
+        await bulk.flush()
+        return collection.ops, bulk.stats
+
+    ops, stats = asyncio.run(scenario())
+    assert ops == 1 and stats.duplicates_skipped == 2
+
+
+def test_failed_write_does_not_mark_records_as_seen():
+    async def scenario():
+        cache = DedupCache(bloom_capacity=0)
+        bulk = BulkIngestor(FakeCollection(fail=True), batch_size=100, dedup=cache)
+        await bulk.add_message({"_id": "m1", "waId": "1"})
+        with pytest.raises(RuntimeError):
+            await bulk.flush()
+        return cache.seen("m:m1")
+
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,123 @@
+import sys
+import os
+import asyncio
+import json
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+
+from app import main as app_main
+from app.events import EventStream, event_stream, long_poll, sse_frames
+from app.ws import RESYNC_FRAME, topics_for
+
+
+def _publish(stream, wa_id, n):
+    stream.on_event(json.dumps({"type": "insert", "n": n}), topics_for(wa_id))
+
+
+def test_replay_filters_topics_and_detects_gaps():
+    stream = EventStream(history=3)
+    start = stream.cursor
+    _publish(stream, "1", 1)
+    _publish(stream, "2", 2)
+    assert [json.loads(e[1])["n"] for e in stream.replay(start, ["wa:2"])] == [2]
+    assert len(stream.replay(start, ["conversations"])) == 2
+    assert stream.replay(stream.cursor, ["wa:1"]) == []
+    # Another worker's cursor, or one older than the history, cannot be replayed
+    assert stream.replay("other:1", ["wa:1"]) is None
+    for n in range(3, 6):
+        _publish(stream, "1", n)
+    assert stream.replay(start, ["wa:1"]) is None
+
+
+def test_long_poll_wakes_on_a_matching_event():
+    async def scenario():
+        stream = EventStream()
+        waiter = asyncio.ensure_future(long_poll(stream, ["wa:1"], stream.cursor, timeout=5))
+        await asyncio.sleep(0)
+        _publish(stream, "2", 1)
+        _publish(stream, "1", 2)
+        cursor, reset, entries = await waiter
+        timed_out = await long_poll(stream, ["wa:1"], cursor, timeout=0.01)
+        return reset, [json.loads(e[1])["n"] for e in entries], timed_out
+
+    reset, events, timed_out = asyncio.run(scenario())
+    assert reset is False and events == [2]
+    assert timed_out[1:] == (False, [])
+
+
+def test_long_poll_with_a_foreign_cursor_reports_reset_after_waiting():
+    async def scenario():
+        stream = EventStream()
+        # Cursor from another worker, as when polls alternate between two
+        waiter = asyncio.ensure_future(long_poll(stream, ["wa:1"], "other:5", timeout=5))
+        await asyncio.sleep(0.01)
+        waited = not waiter.done()
+        _publish(stream, "1", 1)
+        cursor, reset, entries = await waiter
+        return waited, cursor, reset, entries, stream.resets
+
+    waited, cursor, reset, entries, resets = asyncio.run(scenario())
+    assert waited and reset is True and len(entries) == 1
+    assert cursor.endswith(":1") and resets == 1
+
+
+def test_slow_subscriber_backlog_collapses_to_resync():
+    async def scenario():
+        stream = EventStream(queue_size=2)
+        waiter = stream.subscribe(["conversations"])
+        for n in range(4):
+            _publish(stream, "1", n)
+        return await waiter.next_batch(0)
+
+    batch = asyncio.run(scenario())
+    assert batch[0][1] == RESYNC_FRAME and json.loads(batch[1][1])["n"] == 3
+
+
+def test_sse_stream_replays_after_last_event_id():
+    async def scenario():
+        stream = EventStream()
+        _publish(stream, "1", 1)
+        last_id = stream.cursor
+        _publish(stream, "1", 2)
+        frames = sse_frames(stream, ["wa:1"], last_event_id=last_id, heartbeat=5)
+        head = await frames.__anext__()
+        _publish(stream, "1", 3)
+        live = await frames.__anext__()
+        await frames.aclose()
+        return head, live, stream.stats()["subscribers"]
+
+    head, live, subscribers = asyncio.run(scenario())
+    assert head.startswith(b"retry: 3000") and b'"n": 2' in head and b'"n": 1' not in head
+    assert live.startswith(b"id: ") and b'"n": 3' in live
+    assert subscribers == 0
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def noop():
+        return None
+
+    monkeypatch.setattr(app_main, "connect_to_mongo", noop)
+    monkeypatch.setattr(app_main, "close_mongo_connection", noop)
+    with TestClient(app_main.app) as c:
+        yield c
+
+
+def test_poll_endpoint(client):
+    assert client.get("/events/poll").status_code == 422
+    # Internal topics (cache invalidations between workers) are not for clients
+    assert client.get("/events/poll", params={"topics": "_users"}).status_code == 400
+    first = client.get("/events/poll", params={"topics": "wa:1", "timeout": 0}).json()
+    assert first["events"] == [] and first["reset"] is False
+
+    _publish(event_stream, "1", 7)
+    data = client.get("/events/poll", params={"topics": ["wa:1"], "cursor": first["cursor"], "timeout": 0}).json()
+    assert data["events"] == [{"type": "insert", "n": 7}] and data["cursor"] != first["cursor"]
+    assert client.get("/events/poll", params={"topics": "wa:1", "cursor": "gone:1", "timeout": 0}).json()["reset"] is True
@@ -0,0 +1,112 @@
+import sys
+import os
+import json
+import asyncio
+from pathlib import Path
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+ROOT_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..'))
+for path in (BACKEND_DIR, os.path.join(ROOT_DIR, 'scripts')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import ingest_payloads as ingest
+from memmongo import MemoryClient
+
+SAMPLES = Path(ROOT_DIR) / "whatsapp sample payloads"
+
+
+def test_directory_and_ndjson_inputs_parse_to_the_same_records(tmp_path):
+    files = sorted(SAMPLES.glob("*.json"))
+    archive = tmp_path / "payloads.jsonl"
+    with open(archive, "w", encoding="utf-8") as f:
+        for p in files:
+            f.write(json.dumps(json.loads(p.read_text(encoding="utf-8"))) + "\n")
+        f.write("\n{not json}\n")
+
+    dir_chunks = list(ingest.iter_chunks(SAMPLES, chunk_size=3))
+    assert [kind for kind, _, _ in dir_chunks] == ["files"] * 3
+    assert sum(len(items) for _, items, _ in dir_chunks) == len(files)
+
+    line_chunks = list(ingest.iter_chunks(archive, chunk_size=3))
+    assert sum(len(items) for _, items, _ in line_chunks) == len(files) + 1
+
+    from_dir = [r for _, items, _ in dir_chunks for r in ingest.parse_chunk(items)[1]]
+    parsed_lines = [ingest.parse_chunk(items) for _, items, _ in line_chunks]
+    assert sum(errors for errors, _ in parsed_lines) == 1
+    from_lines = [r for _, records in parsed_lines for r in records]
+
+    assert from_dir == from_lines
+    kinds = [kind for kind, _ in from_dir]
+    assert "message" in kinds and "status" in kinds
+
+
+def _write_archive(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"n": i}) + "\n")
+
+
+def test_resuming_from_a_chunk_position_skips_completed_input(tmp_path):
+    dir_chunks = list(ingest.iter_chunks(SAMPLES, chunk_size=3))
+    rest = list(ingest.iter_chunks(SAMPLES, chunk_size=3, start=dir_chunks[0][2]))
+    assert [items for _, items, _ in rest] == [items for _, items, _ in dir_chunks[1:]]
+
+    archive = tmp_path / "payloads.jsonl"
+    _write_archive(archive, 10)
+    line_chunks = list(ingest.iter_chunks(archive, chunk_size=4))
+    rest = list(ingest.iter_chunks(archive, chunk_size=4, start=line_chunks[0][2]))
+    assert [items for _, items, _ in rest] == [items for _, items, _ in line_chunks[1:]]
+    assert line_chunks[-1][2] == {"offset": archive.stat().st_size}
+
+
+def test_shards_split_input_without_overlap(tmp_path):
+    archive = tmp_path / "payloads.jsonl"
+    _write_archive(archive, 50)
+    for source in (SAMPLES, archive):
+        everything = [i for _, items, _ in ingest.iter_chunks(source, chunk_size=4) for i in items]
+        per_shard = [
+            [i for _, items, _ in ingest.iter_chunks(source, chunk_size=4, shards=3, shard_index=k) for i in items]
+            for k in range(3)
+        ]
+        assert sorted(i for shard in per_shard for i in shard) == sorted(everything)
+        assert sum(len(shard) for shard in per_shard) == len(everything)
+
+
+def test_reconcile_pending_walks_the_overflow_in_batches(monkeypatch):
+    monkeypatch.setattr(ingest, "RECONCILE_BATCH_SIZE", 2)
+
+    async def scenario():
+        db = MemoryClient()["test"]
+        messages = db["processed_messages"]
+        # Messages 0..2 arrived (e.g. in another shard); 3 and 4 did not
+        messages.load(
+            {"_id": f"m{i}", "waId": "911", "status": "sent", "timestamps": {"whatsapp": 1}} for i in range(3)
+        )
+        pending = ingest.PendingStatusBuffer(db["pending_statuses"])
+        await pending.load()
+        await pending.add_many(
+            {"id": f"m{i}", "status": "read", "timestamp": "5", "recipient_id": "911"} for i in range(5)
+        )
+        await pending.persist()
+        target = ingest.IngestTarget(
+            client=None,
+            collection=messages,
+            conversations=db["conversations"],
+            changelog=ingest.ChangeLog(db["changes"], db["counters"]),
+            pending=pending,
+            dedup=ingest.DedupCache(),
+            checkpoints=db["ingest_checkpoints"],
+        )
+        lookups = messages.calls["find"]
+        await ingest.reconcile_pending(target, ingest.IngestStats())
+        statuses = [doc["status"] async for doc in messages.find({}).sort("_id", 1)]
+        left = sorted(k for row in await db["pending_statuses"].find({}).to_list(None) for k in row["keys"])
+        return statuses, left, messages.calls["find"] - lookups
+
+    statuses, left, lookups = asyncio.run(scenario())
+    assert statuses == ["read", "read", "read"]
+    assert left == ["m3", "m4"]
+    # One bounded $in lookup per batch of keys instead of a single one for all
+    assert lookups >= 3
@@ -0,0 +1,103 @@
+import sys
+import os
+import asyncio
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+ROOT_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..'))
+for path in (BACKEND_DIR, os.path.join(ROOT_DIR, 'scripts')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.conversations import rebuild_conversations, record_message
+from app.statuses import apply_status, apply_status_batch
+from memmongo import MemoryClient
+
+
+def _message(i, wa_id, ts, direction="inbound"):
+    return {
+        "_id": f"m{i:03d}",
+        "waId": wa_id,
+        "name": "Ravi" if i % 3 else None,
+        "direction": direction,
+        "text": f"text {i}",
+        "status": "sent" if direction == "outbound" else "read",
+        "timestamps": {"whatsapp": ts, "sent": None, "delivered": None, "read": None},
+    }
+
+
+def test_incremental_summaries_match_the_rebuild_aggregation():
+    async def scenario():
+        db = MemoryClient()["test"]
+        messages, conversations = db["messages"], db["conversations"]
+        # Out of order and with a timestamp tie, decided by _id
+        docs = [_message(i, f"9100{i % 3}", 1000 + (i * 7) % 5, "outbound" if i % 2 else "inbound") for i in range(30)]
+        for doc in docs:
+            await messages.insert_one(dict(doc))
+            await record_message(conversations, doc)
+        await apply_status(messages, {"id": "m027", "status": "delivered", "timestamp": 5}, conversations)
+        incremental = {d["_id"]: d async for d in conversations.find({})}
+
+        rebuilt = db["rebuilt"]
+        assert await rebuild_conversations(messages, rebuilt) == 3
+        assert {d["_id"]: d async for d in rebuilt.find({})} == incremental
+        return incremental
+
+    summaries = asyncio.run(scenario())
+    assert summaries["91000"]["lastMessageId"] == "m027"
+    assert summaries["91000"]["lastMessageStatus"] == "delivered"
+    assert sum(s["messageCount"] for s in summaries.values()) == 30
+
+
+def test_index_scan_pages_like_a_sort():
+    async def scenario():
+        messages = MemoryClient()["test"]["messages"]
+        await messages.create_index([("waId", 1), ("timestamps.whatsapp", -1), ("_id", -1)])
+        for i in range(40):
+            await messages.insert_one(_message(i, "a" if i % 4 else "b", 100 + i // 3))
+        query = {"waId": "a", "$or": [{"timestamps.whatsapp": {"$lt": 110}}, {"timestamps.whatsapp": 110, "_id": {"$lt": "m031"}}]}
+        order = [("timestamps.whatsapp", -1), ("_id", -1)]
+        page = await messages.find(query, {"_id": 1}).sort(order).limit(5).to_list(None)
+        everything = [d async for d in messages.find({})]
+        expected = sorted(
+            (d for d in everything if d["waId"] == "a" and (d["timestamps"]["whatsapp"], d["_id"]) < (110, "m031")),
+            key=lambda d: (d["timestamps"]["whatsapp"], d["_id"]),
+            reverse=True,
+        )[:5]
+        assert page == [{"_id": d["_id"]} for d in expected]
+        return messages.calls
+
+    calls = asyncio.run(scenario())
+    assert calls["insert_one"] == 40 and calls["find"] == 2
+
+
+def test_bulk_writes_upsert_promote_and_enforce_unique_indexes():
+    async def scenario():
+        db = MemoryClient()["test"]
+        messages = db["messages"]
+        docs = [_message(i, "a", 100 + i, "outbound") for i in range(3)]
+        ops = [UpdateOne({"_id": d["_id"]}, {"$setOnInsert": d}, upsert=True) for d in docs]
+        assert sorted((await messages.bulk_write(ops, ordered=False)).upserted_ids) == [0, 1, 2]
+        assert (await messages.bulk_write(ops, ordered=False)).upserted_ids == {}
+
+        updates = [
+            {"id": "m000", "status": "read", "timestamp": 9},
+            {"id": "m000", "status": "delivered", "timestamp": 8},
+            {"id": "nope", "status": "read", "timestamp": 9},
+        ]
+        applied, missing = await apply_status_batch(messages, updates)
+        assert applied["m000"]["status"] == "read" and missing == [updates[2]]
+        assert applied["m000"]["timestamps"]["delivered"] == 8
+
+        users = db["users"]
+        await users.create_index("username", unique=True)
+        await users.insert_one({"username": "ravi"})
+        with pytest.raises(DuplicateKeyError):
+            await users.insert_one({"username": "ravi"})
+        assert await users.find_one({"username": "ravi"}, {"_id": 0, "username": 1}) == {"username": "ravi"}
+
+    asyncio.run(scenario())
@@ -0,0 +1,158 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app import config
+from app import ws as app_ws
+from app.models import ConversationOut, MessageOut, MessagePage
+from app.serialization import conversation_list, message_page
+from app.utils import decode_cursor, encode_cursor
+
+
+def _message(i, wa_id="919999999999", ts=None):
+    return {
+        "_id": f"m{i:03d}",
+        "waId": wa_id,
+        "direction": "inbound",
+        "text": f"hello {i}",
+        "status": "read",
+        "timestamps": {"whatsapp": ts if ts is not None else 1000 + i},
+    }
+
+
+@pytest.fixture
+def client(app_client, memory_db):
+    # Two messages share a timestamp to exercise the _id tiebreaker
+    docs = [_message(i) for i in range(7)] + [_message(7, ts=1006), _message(99, wa_id="910000000000")]
+    memory_db[config.COLLECTION_MESSAGES].load(docs)
+    return app_client
+
+
+def test_startup_drops_the_superseded_messages_index(db_globals, memory_client, memory_db):
+    messages = memory_db[config.COLLECTION_MESSAGES]
+
+    async def start():
+        await db_globals.init_database(memory_client, memory_db)
+        return await messages.index_information()
+
+    asyncio.run(messages.create_index([("waId", 1), ("timestamps.whatsapp", -1)]))
+    indexes = asyncio.run(start())
+    assert "waId_1_timestamps.whatsapp_-1" not in indexes
+    assert "waId_1_timestamps.whatsapp_-1__id_-1" in indexes
+    # Already gone on the next start
+    assert asyncio.run(start()) == indexes
+
+
+def test_cursor_round_trip():
+    cur = encode_cursor(1712345678, "wamid.abc:def==")
+    assert decode_cursor(cur) == (1712345678, "wamid.abc:def==")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_newest_page_first_then_walk_back(client):
+    r = client.get("/messages", params={"wa_id": "919999999999", "limit": 3})
+    assert r.status_code == 200, r.text
+    page = r.json()
+    assert [m["_id"] for m in page["items"]] == ["m005", "m006", "m007"]
+    assert page["has_more"] is True
+
+    seen = [m["_id"] for m in page["items"]]
+    cursor = page["next_cursor"]
+    while cursor:
+        page = client.get("/messages", params={"wa_id": "919999999999", "limit": 3, "before": cursor}).json()
+        seen = [m["_id"] for m in page["items"]] + seen
+        cursor = page["next_cursor"]
+    assert seen == [f"m{i:03d}" for i in range(8)]
+
+
+def test_after_cursor_returns_newer_messages(client):
+    cursor = encode_cursor(1004, "m004")
+    page = client.get("/messages", params={"wa_id": "919999999999", "after": cursor}).json()
+    assert [m["_id"] for m in page["items"]] == ["m005", "m006", "m007"]
+    assert page["has_more"] is False
+    # Clients keep polling from the newest message they have
+    assert decode_cursor(page["next_cursor"]) == (1006, "m007")
+
+
+def test_invalid_cursor_is_rejected(client):
+    r = client.get("/messages", params={"wa_id": "919999999999", "before": "%%%"})
+    assert r.status_code == 400
+    r = client.get("/messages", params={"wa_id": "919999999999", "before": "a", "after": "b"})
+    assert r.status_code == 400
+
+
+def test_fast_path_renders_exactly_what_the_response_models_would():
+    docs = [
+        _message(1),
+        # Every optional field set, plus a stored field the API does not expose
+        {
+            **_message(2),
+            "name": "Ravi",
+            "type": "text",
+            "timestamps": {"whatsapp": 5, "sent": 5, "delivered": 6, "read": 7},
+            "businessPhone": "918329446654",
+            "phoneNumberId": "1",
+            "conversationId": "c",
+            "gsId": "g",
+            "metaMsgId": "mm",
+            "raw": {"big": "payload"},
+        },
+    ]
+    legacy = MessagePage(items=[MessageOut(**d) for d in docs], next_cursor="x", has_more=True)
+    assert message_page(docs, "x", True) == legacy.model_dump(mode="json", by_alias=True)
+
+    summaries = [{"waId": "1", "name": None, "lastMessageAt": 3, "lastMessageStatus": "read"}]
+    assert conversation_list(summaries) == [ConversationOut(**s).model_dump(mode="json") for s in summaries]
+
+
+def test_repeated_reads_are_cached_until_a_write(client, ops_headers):
+    params = {"wa_id": "919999999999", "limit": 3}
+    first = client.get("/messages", params=params).json()
+    assert client.get("/messages", params=params).json() == first
+    assert client.get("/cache/stats", headers=ops_headers).json()["hits"] >= 1
+
+    created = client.post("/messages", json={"waId": "919999999999", "text": "new"}).json()
+    latest = client.get("/messages", params=params).json()
+    assert latest["items"][-1]["_id"] == created["_id"]
+
+
+def test_conditional_get_answers_304_until_the_thread_changes(client):
+    params = {"wa_id": "919999999999", "limit": 3}
+    first = client.get("/messages", params=params)
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    unchanged = client.get("/messages", params=params, headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304 and unchanged.content == b""
+    # Another thread's write leaves this one's validator alone
+    client.post("/messages", json={"waId": "910000000000", "text": "elsewhere"})
+    assert client.get("/messages", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/messages", json={"waId": "919999999999", "text": "new"})
+    changed = client.get("/messages", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+
+def test_created_message_is_pushed_as_a_delta(client, monkeypatch):
+    events = []
+
+    async def fake_broadcast(message, topics=None):
+        events.append((message, topics))
+
+    monkeypatch.setattr(app_ws.manager, "broadcast", fake_broadcast)
+    created = client.post("/messages", json={"waId": "919999999999", "text": "new"}).json()
+    inserted, summary = events
+    assert inserted == (
+        {"v": 2, "type": "message.inserted", "waId": "919999999999", "data": created},
+        ["conversations", "wa:919999999999"],
+    )
+    assert summary[0]["type"] == "conversation.updated"
+    assert summary[0]["data"]["lastMessageText"] == "new" and summary[1] == inserted[1]
@@ -0,0 +1,71 @@
+import sys
+import os
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app import main as app_main
+from app import metrics
+from app.metrics import Registry, mongo_timer
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "Operation time", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, 'say "hi"')
+    registry.sampled("gauge", "open_things", "Things", lambda: 3)
+    with pytest.raises(ValueError):
+        registry.counter("open_things", "Again")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE op_seconds histogram" in lines
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="0.1"} 2' in lines
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="1"} 3' in lines
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="+Inf"} 4' in lines
+    assert 'op_seconds_count{op="say \\"hi\\""} 4' in lines
+    assert 'op_seconds_sum{op="say \\"hi\\""} 3.65' in lines
+    assert "open_things 3" in lines
+
+
+def test_failed_database_calls_are_timed_and_counted():
+    before = metrics.mongo_errors.value("users", "find_one")
+    count = metrics.mongo_latency.count("users", "find_one")
+    with pytest.raises(RuntimeError):
+        with mongo_timer("users", "find_one"):
+            raise RuntimeError("down")
+    assert metrics.mongo_errors.value("users", "find_one") == before + 1
+    assert metrics.mongo_latency.count("users", "find_one") == count + 1
+
+
+def test_requests_are_labelled_by_route_template(app_client, ops_headers):
+    requests = metrics.http_requests.value("GET", "/messages", "200")
+    finds = metrics.mongo_latency.count("processed_messages", "find")
+    for wa_id in ("911", "912"):
+        assert app_client.get("/messages", params={"wa_id": wa_id}).status_code == 200
+    assert app_client.get("/no/such/path").status_code == 404
+
+    assert metrics.http_requests.value("GET", "/messages", "200") == requests + 2
+    assert metrics.mongo_latency.count("processed_messages", "find") == finds + 2
+
+    with app_client.websocket_connect("/ws"):
+        r = app_client.get("/metrics", headers=ops_headers)
+        assert r.headers["content-type"] == metrics.CONTENT_TYPE
+        lines = r.text.splitlines()
+        assert "ws_connections 1" in lines
+    assert any(line.startswith('http_requests_total{method="GET",route="unmatched",status="404"}') for line in lines)
+    assert any(line.startswith('http_request_duration_seconds_bucket{method="GET",route="/messages",le="+Inf"}') for line in lines)
+
+
+def test_ops_endpoints_are_hidden_without_a_token_and_checked_with_one(app_client, monkeypatch):
+    paths = ["/metrics", "/ws/stats", "/webhook/stats", "/cache/stats", "/auth/stats", "/events/stats"]
+    assert [app_client.get(path).status_code for path in paths] == [404] * len(paths)
+
+    monkeypatch.setattr(app_main.config, "OPS_TOKEN", "secret")
+    assert app_client.get("/metrics").status_code == 401
+    assert app_client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert app_client.get("/ws/stats", headers={"Authorization": "Bearer secret"}).status_code == 200
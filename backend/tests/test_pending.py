@@ -0,0 +1,127 @@
+import sys
+import os
+import asyncio
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..', 'scripts'))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from app import pending as pending_module
+from app.ingest import BulkIngestor
+from app.pending import PendingStatusBuffer
+from memmongo import MemoryClient
+
+
+def _status(mid, status, meta=None):
+    return {"id": mid, "meta_msg_id": meta, "status": status, "timestamp": 1}
+
+
+def test_take_returns_updates_in_arrival_order_by_either_key():
+    async def scenario():
+        buf = PendingStatusBuffer(memory_limit=10, ttl_seconds=60)
+        await buf.add(_status("a", "delivered"))
+        await buf.add(_status("b", "read", meta="m-1"))
+        await buf.add(_status("a", "read"))
+        assert await buf.take(["a"]) == [_status("a", "delivered"), _status("a", "read")]
+        assert await buf.take(["m-1", None]) == [_status("b", "read", meta="m-1")]
+        assert await buf.take(["b"]) == []
+        return buf.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["added"] == 3 and stats["hits"] == 3 and stats["hit_rate"] == 1.0
+    assert stats["buffered"] == 0
+
+
+def test_expired_and_evicted_entries_are_counted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pending_module.time, "time", lambda: now[0])
+
+    async def scenario():
+        buf = PendingStatusBuffer(memory_limit=2, ttl_seconds=10)
+        await buf.add(_status("old", "read"))
+        now[0] += 11
+        await buf.add(_status("x", "read"))
+        await buf.add(_status("y", "read"))
+        # No overflow collection: the oldest entry beyond the limit is dropped
+        await buf.add(_status("z", "read"))
+        assert await buf.take(["old", "x"]) == []
+        assert buf.stats()["oldest_age_seconds"] == 0.0
+        return buf.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["expired"] == 1 and stats["evicted"] == 1
+    assert stats["buffered"] == 2 and stats["hits"] == 0
+
+
+def test_durable_buffer_shares_statuses_between_workers():
+    async def scenario():
+        overflow = MemoryClient()["test"]["pending_statuses"]
+        worker_a = PendingStatusBuffer(overflow, durable=True)
+        worker_b = PendingStatusBuffer(overflow, durable=True)
+        await worker_a.load()
+        await worker_b.load()
+        await worker_a.add_many([_status("a", "delivered"), _status("a", "read")])
+        # Nothing held in memory, so a crash of worker A loses nothing
+        assert len(worker_a) == 0 and await overflow.count_documents({}) == 2
+        taken = await worker_b.take(["a"])
+        return taken, await overflow.count_documents({})
+
+    taken, left = asyncio.run(scenario())
+    assert taken == [_status("a", "delivered"), _status("a", "read")] and left == 0
+
+
+def test_overflow_lookups_stop_once_the_collection_is_drained():
+    async def scenario():
+        overflow = MemoryClient()["test"]["pending_statuses"]
+        buf = PendingStatusBuffer(overflow, memory_limit=1, ttl_seconds=60)
+        await buf.load()
+        await buf.add(_status("a", "read"))
+        await buf.add(_status("b", "read"))
+        spilled_active = buf._overflow_active
+        assert await buf.take(["a"]) == [_status("a", "read")]
+        return spilled_active, buf._overflow_active
+
+    spilled_active, active_after = asyncio.run(scenario())
+    assert spilled_active is True and active_after is False
+
+
+class RacingBuffer(PendingStatusBuffer):
+    """Runs ``before_park`` (another worker's write) just before parking."""
+
+    before_park = None
+
+    async def add_many(self, updates):
+        updates = list(updates)
+        if self.before_park is not None and updates:
+            before_park, self.before_park = self.before_park, None
+            await before_park()
+        await super().add_many(updates)
+
+
+def test_status_parked_while_its_message_is_inserted_is_not_stranded():
+    async def scenario():
+        db = MemoryClient()["test"]
+        messages = db["processed_messages"]
+        overflow = db["pending_statuses"]
+        worker_a = BulkIngestor(messages, pending=RacingBuffer(overflow, durable=True))
+        worker_b = BulkIngestor(messages, pending=PendingStatusBuffer(overflow, durable=True))
+        await worker_a.pending.load()
+
+        async def insert_message():
+            # Worker B's take runs before A has parked, so it finds nothing
+            await worker_b.add_message({"_id": "m1", "waId": "911", "status": "sent"})
+            await worker_b.flush()
+
+        worker_a.pending.before_park = insert_message
+        await worker_a.add_status(_status("m1", "read"))
+        await worker_a.flush()
+        return await messages.find_one({"_id": "m1"}), await overflow.count_documents({}), worker_a.stats
+
+    message, left, stats = asyncio.run(scenario())
+    assert message["status"] == "read"
+    assert left == 0 and stats.statuses_applied == 1
@@ -0,0 +1,65 @@
+import sys
+import os
+import asyncio
+import json
+import time
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.profiling import Profiler, profiler, span
+
+
+@pytest.fixture
+def client(app_client, monkeypatch):
+    # Trace every request and keep them all
+    monkeypatch.setattr(profiler, "enabled", True)
+    monkeypatch.setattr(profiler, "sample_rate", 1.0)
+    monkeypatch.setattr(profiler, "slow_ms", 0.0)
+    profiler.reports.clear()
+    return app_client
+
+
+def test_slow_requests_are_reported_with_their_spans(client, ops_headers):
+    assert client.get("/messages", params={"wa_id": "911"}).status_code == 200
+
+    body = client.get("/debug/profile", headers=ops_headers).json()
+    report = next(r for r in body["reports"] if r.get("route") == "/messages")
+    assert report["status"] == 200
+    kinds = {(s["kind"], s["detail"]) for s in report["spans"]}
+    assert ("db", "processed_messages.find") in kinds
+    assert ("serialization", "message_page") in kinds
+    assert set(report["totals_ms"]) == {"db", "serialization", "other"}
+    assert sum(report["totals_ms"].values()) == pytest.approx(report["duration_ms"], abs=0.01)
+
+
+def test_profile_endpoint_is_hidden_while_disabled(client, monkeypatch, ops_headers):
+    monkeypatch.setattr(profiler, "enabled", False)
+    assert client.get("/debug/profile", headers=ops_headers).status_code == 404
+    # Not sampled, so no trace: spans are no-ops
+    with span("db", "x") as s:
+        pass
+    assert s.trace is None
+
+
+def test_loop_lag_monitor_reports_stalls_to_file(tmp_path):
+    output = tmp_path / "profile.jsonl"
+
+    async def scenario():
+        monitor = Profiler(enabled=True, lag_interval_ms=5, lag_threshold_ms=30, output=str(output))
+        await monitor.start()
+        await asyncio.sleep(0.02)
+        # Blocks the loop like inline bcrypt would
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(scenario())
+    assert monitor.lag_events >= 1 and monitor.max_lag_ms >= 50
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert lines and all(line["type"] == "loop_lag" for line in lines)
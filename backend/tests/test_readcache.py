@@ -0,0 +1,130 @@
+import sys
+import os
+import asyncio
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app import readcache as readcache_module
+from app.readcache import ReadCache, etag_for, etag_matches
+from app.ws import WebSocketManager, topics_for
+
+
+class SlowLoader:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        return f"v{call}".encode()
+
+
+async def _body(cache, key, tags, loader):
+    _, body = await cache.get(key, tags, loader)
+    return body
+
+
+def test_concurrent_reads_share_one_load():
+    async def scenario():
+        cache = ReadCache(ttl_seconds=60)
+        loader = SlowLoader()
+        waiters = [asyncio.ensure_future(_body(cache, "k", ["wa:1"], loader)) for _ in range(10)]
+        await asyncio.sleep(0)
+        loader.release.set()
+        results = await asyncio.gather(*waiters)
+        again = await _body(cache, "k", ["wa:1"], loader)
+        return results, again, loader.calls, cache.stats()
+
+    results, again, calls, stats = asyncio.run(scenario())
+    assert results == [b"v1"] * 10 and again == b"v1" and calls == 1
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 9, 1)
+
+
+def test_invalidation_is_per_tag_and_detaches_running_loads():
+    async def scenario():
+        cache = ReadCache(ttl_seconds=60)
+        other = SlowLoader()
+        other.release.set()
+        await cache.get("b", ["wa:2"], other)
+
+        loader = SlowLoader()
+        first = asyncio.ensure_future(_body(cache, "a", ["wa:1"], loader))
+        await asyncio.sleep(0)
+        # A write lands while the read is running: its result must not be reused
+        cache.invalidate(["wa:1"])
+        second = asyncio.ensure_future(_body(cache, "a", ["wa:1"], loader))
+        await asyncio.sleep(0)
+        loader.release.set()
+        results = await asyncio.gather(first, second)
+        cached = await _body(cache, "a", ["wa:1"], loader)
+        return results, cached, await _body(cache, "b", ["wa:2"], other), loader.calls
+
+    results, cached, untouched, calls = asyncio.run(scenario())
+    assert results == [b"v1", b"v2"] and cached == b"v2" and calls == 2
+    assert untouched == b"v1"
+
+
+def test_etag_is_trusted_no_longer_than_the_body(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(readcache_module.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        cache = ReadCache(ttl_seconds=2)
+        loader = SlowLoader()
+        loader.release.set()
+        etag, first = await cache.get("k", ["conversations"], loader)
+        now[0] += 1
+        known = cache.revalidate("k", etag)
+        now[0] += 2
+        # An invalidation may have been lost since; the client must be checked
+        expired = cache.revalidate("k", etag)
+        second = await _body(cache, "k", ["conversations"], loader)
+        return first, known == etag, expired, second, len(cache), cache.stats()["not_modified"]
+
+    assert asyncio.run(scenario()) == (b"v1", True, None, b"v2", 1, 1)
+
+
+def test_failed_load_is_not_cached():
+    async def scenario():
+        cache = ReadCache(ttl_seconds=60)
+
+        async def failing():
+            raise RuntimeError("db down")
+
+        try:
+            await cache.get("k", ["wa:1"], failing)
+        except RuntimeError:
+            pass
+        return len(cache), cache._key_tags, cache._tags
+
+    assert asyncio.run(scenario()) == (0, {}, {})
+
+
+def test_broadcasts_invalidate_through_the_manager_listener():
+    async def scenario():
+        cache = ReadCache(ttl_seconds=60)
+        manager = WebSocketManager()
+        manager.add_listener(cache.on_event)
+        loader = SlowLoader()
+        loader.release.set()
+        etag, _ = await cache.get(("conversations",), ["conversations"], loader)
+        await cache.get(("messages", "2"), ["wa:2"], loader)
+        await manager.broadcast({"type": "insert"}, topics=topics_for("1"))
+        unknown = cache.revalidate(("conversations",), etag)
+        return len(cache), unknown, await _body(cache, ("messages", "2"), ["wa:2"], loader)
+
+    assert asyncio.run(scenario()) == (1, None, b"v2")
+
+
+def test_if_none_match_parsing():
+    etag = etag_for(b"body")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
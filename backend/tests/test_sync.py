@@ -0,0 +1,136 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..', 'scripts'))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from fastapi.testclient import TestClient
+
+from app import config
+from app import db as app_db
+from app import main as app_main
+from app.changes import MESSAGE_INSERTED, ChangeLog, ensure_indexes
+from memmongo import MemoryClient
+
+
+class FakeChangeLog:
+    def __init__(self, rows, current):
+        self.rows = rows
+        self._current = current
+
+    async def current(self):
+        return self._current
+
+    async def oldest(self):
+        return self.rows[0]["_id"] if self.rows else None
+
+    async def since(self, token, limit):
+        return [r for r in self.rows if r["_id"] > token][:limit]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    rows = [
+        {"_id": seq, "kind": "message.inserted", "waId": "919999999999", "data": {"_id": f"m{seq}"}}
+        for seq in range(11, 16)
+    ]
+    changelog = FakeChangeLog(rows, current=15)
+
+    async def fake_connect():
+        app_db.changelog = changelog
+
+    async def fake_close():
+        app_db.changelog = None
+
+    monkeypatch.setattr(app_main, "connect_to_mongo", fake_connect)
+    monkeypatch.setattr(app_main, "close_mongo_connection", fake_close)
+
+    with TestClient(app_main.app) as c:
+        yield c
+
+
+def test_sync_without_token_bootstraps(client):
+    data = client.get("/sync").json()
+    assert data == {"token": 15, "reset": True, "has_more": False, "changes": []}
+
+
+def test_sync_pages_through_changes(client):
+    data = client.get("/sync", params={"since": 10, "limit": 3}).json()
+    assert [c["seq"] for c in data["changes"]] == [11, 12, 13]
+    assert data["token"] == 13 and data["has_more"] is True
+
+    data = client.get("/sync", params={"since": data["token"], "limit": 3}).json()
+    assert [c["seq"] for c in data["changes"]] == [14, 15]
+    assert data["token"] == 15 and data["has_more"] is False
+
+    data = client.get("/sync", params={"since": 15}).json()
+    assert data["changes"] == [] and data["token"] == 15 and data["reset"] is False
+
+
+def test_sync_resets_when_log_no_longer_covers_token(client):
+    # Entries up to 10 expired; a client at 5 has missed 6..10
+    assert client.get("/sync", params={"since": 5}).json()["reset"] is True
+    # Token ahead of the log, e.g. after the database was wiped
+    assert client.get("/sync", params={"since": 99}).json()["reset"] is True
+
+
+class SlowFirstInsert:
+    """Change collection whose first ``insert_many`` waits for ``release``."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def insert_many(self, docs, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            await self.release.wait()
+        return await self.collection.insert_many(docs, **kwargs)
+
+
+def test_since_stops_at_a_seq_whose_write_is_still_in_flight():
+    async def scenario():
+        db = MemoryClient()["test"]
+        changes = SlowFirstInsert(db["changes"])
+        changelog = ChangeLog(changes, db["counters"])
+
+        # Seq 1 is allocated first but written after seq 2
+        first = asyncio.create_task(changelog.append((MESSAGE_INSERTED, "911", {"_id": "m1"})))
+        await asyncio.sleep(0)
+        assert await changelog.append((MESSAGE_INSERTED, "911", {"_id": "m2"})) == 2
+
+        assert await changelog.since(0, 10) == []
+        # Once the hole is older than the grace period it is skipped
+        assert [r["_id"] for r in await changelog.since(0, 10, grace_seconds=0)] == [2]
+
+        changes.release.set()
+        assert await first == 1
+        rows = await changelog.since(0, 10)
+        assert [r["_id"] for r in rows] == [1, 2]
+        assert "at" not in rows[0]
+
+    asyncio.run(scenario())
+
+
+def test_retention_is_read_when_the_index_is_created(monkeypatch):
+    class RecordingChanges:
+        async def create_index(self, keys, **kwargs):
+            self.kwargs = kwargs
+
+    monkeypatch.setattr(config, "CHANGELOG_RETENTION_SECONDS", 60)
+    changes = RecordingChanges()
+    asyncio.run(ensure_indexes(changes))
+    assert changes.kwargs["expireAfterSeconds"] == 60
@@ -0,0 +1,296 @@
+import sys
+import os
+import hashlib
+import hmac
+import json
+import time
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+PAYLOADS_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..', 'whatsapp sample payloads'))
+SCRIPTS_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..', 'scripts'))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from app import config
+from app import ws as ws_module
+from app.webhook import WebhookBatcher, batcher as app_batcher
+from memmongo import MemoryClient
+
+
+class FakeBulkResult:
+    def __init__(self, upserted_ids):
+        self.upserted_ids = upserted_ids
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        self._it = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeMessages:
+    """Upserts via $setOnInsert; pipeline (status) updates are only recorded."""
+
+    def __init__(self):
+        self.docs = {}
+        self.bulk_calls = 0
+        self.status_ops = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.bulk_calls += 1
+        upserted = {}
+        for i, op in enumerate(ops):
+            mid = op._filter["_id"]
+            if isinstance(op._doc, list):
+                self.status_ops.append(mid)
+            elif mid not in self.docs:
+                self.docs[mid] = dict(op._doc["$setOnInsert"])
+                upserted[i] = mid
+        return FakeBulkResult(upserted)
+
+    def find(self, query, projection=None):
+        ids = query["_id"]["$in"]
+        return FakeCursor([self.docs[i] for i in ids if i in self.docs])
+
+
+def _load(name):
+    with open(os.path.join(PAYLOADS_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+WEBHOOK_SECRET = "test-app-secret"
+
+
+def _signed(body, secret=WEBHOOK_SECRET):
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return {"content-type": "application/json", "x-hub-signature-256": f"sha256={signature}"}
+
+
+def _post(client, payload):
+    body = json.dumps(payload).encode()
+    return client.post("/webhook", content=body, headers=_signed(body))
+
+
+@pytest.fixture
+def client(app_client, memory_db, monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_APP_SECRET", WEBHOOK_SECRET)
+    broadcasts = []
+
+    async def fake_broadcast(message, topics=None):
+        broadcasts.append(message)
+
+    monkeypatch.setattr(ws_module.manager, "broadcast", fake_broadcast)
+    app_client.messages = memory_db[config.COLLECTION_MESSAGES]
+    app_client.broadcasts = broadcasts
+    return app_client
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_webhook_acknowledges_then_writes_in_one_batch(client, ops_headers):
+    # The status arrives first; it waits in the pending buffer for its message
+    status = _load("conversation_1_status_2.json")
+    message = _load("conversation_1_message_2.json")
+    resp = _post(client, status)
+    assert resp.status_code == 202 and resp.json()["statuses"] == 1
+    resp = _post(client, message)
+    assert resp.status_code == 202 and resp.json()["messages"] == 1
+
+    message_id = message["metaData"]["entry"][0]["changes"][0]["value"]["messages"][0]["id"]
+    # The early status is applied in the flush that inserts its message
+    assert _wait_for(
+        lambda: [b["type"] for b in client.broadcasts if b["type"].startswith("message.")]
+        == ["message.inserted", "message.status"]
+    )
+    inserted, status = [b for b in client.broadcasts if b["type"].startswith("message.")]
+    assert inserted["v"] == 2 and inserted["data"]["_id"] == message_id
+    assert status["data"]["_id"] == message_id and status["data"]["status"] == "read"
+    assert status["data"]["timestamps"]["read"] == 1754400040
+    assert len(client.messages) == 1
+    stats = client.get("/webhook/stats", headers=ops_headers).json()
+    assert stats["accepted"] == 2 and stats["rejected"] == 0 and stats["errors"] == 0
+    assert stats["ingest"]["messages_upserted"] == 1
+
+
+def test_webhook_rejects_invalid_json(client):
+    resp = client.post("/webhook", content=b"{not json", headers=_signed(b"{not json"))
+    assert resp.status_code == 400
+
+
+def test_webhook_requires_a_valid_signature(client, monkeypatch):
+    body = json.dumps(_load("conversation_1_message_2.json")).encode()
+    assert client.post("/webhook", content=body).status_code == 401
+    assert client.post("/webhook", content=body, headers=_signed(body, "other-secret")).status_code == 401
+    # Signed, then altered in transit
+    assert client.post("/webhook", content=body + b" ", headers=_signed(body)).status_code == 401
+    assert len(client.messages) == 0
+    monkeypatch.setattr(config, "WEBHOOK_APP_SECRET", "")
+    assert client.post("/webhook", content=body, headers=_signed(body)).status_code == 404
+
+
+def test_webhook_refuses_large_bodies_and_full_queues_before_parsing(client, monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_MAX_BODY_BYTES", 64)
+    body = b"[" + b"{}," * 100 + b"{}]"
+    assert client.post("/webhook", content=body, headers=_signed(body)).status_code == 413
+    # Chunked: no Content-Length to go by, so the streamed size is what counts
+    chunks = iter([body[:50], body[50:]])
+    assert client.post("/webhook", content=chunks, headers=_signed(body)).status_code == 413
+
+    monkeypatch.setattr(config, "WEBHOOK_MAX_BODY_BYTES", 1024 * 1024)
+    monkeypatch.setattr(app_batcher, "_failing", True)
+    # Rejected before the body is even read: invalid JSON does not get a 400
+    resp = client.post("/webhook", content=b"{not json", headers=_signed(b"{not json"))
+    assert resp.status_code == 503 and resp.headers["retry-after"] == "1"
+
+
+def test_subscription_handshake_echoes_the_challenge(client, monkeypatch):
+    params = {"hub.mode": "subscribe", "hub.verify_token": "verify-me", "hub.challenge": "1158201444"}
+    assert client.get("/webhook", params=params).status_code == 404
+    monkeypatch.setattr(config, "WEBHOOK_VERIFY_TOKEN", "verify-me")
+    resp = client.get("/webhook", params=params)
+    assert resp.status_code == 200 and resp.text == "1158201444"
+    assert client.get("/webhook", params={**params, "hub.verify_token": "wrong"}).status_code == 403
+
+
+def test_batcher_refuses_work_beyond_queue_limit():
+    async def scenario():
+        batcher = WebhookBatcher(batch_size=10, max_delay_ms=1000, queue_limit=2)
+        await batcher.start(FakeMessages())
+        record = ("message", {"_id": "m1", "waId": "1"})
+        assert batcher.submit([record, record]) is True
+        assert batcher.submit([record]) is False
+        await batcher.stop()
+        return batcher.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["accepted"] == 1 and stats["rejected"] == 1
+    # stop() still wrote the buffered records
+    assert stats["buffered"] == 0 and stats["flushes"] == 1
+
+
+class FlakyMessages(FakeMessages):
+    """Fails the first ``failures`` bulk writes, like a primary stepping down."""
+
+    def __init__(self, failures=1, delay=0.0):
+        super().__init__()
+        self.failures = failures
+        self.delay = delay
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            await asyncio.sleep(self.delay)
+            raise RuntimeError("not primary")
+        return await super().bulk_write(ops, ordered)
+
+
+def test_failed_batch_is_retried_and_new_work_refused_meanwhile(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_RETRY_BASE_MS", 20)
+
+    async def scenario():
+        messages = FlakyMessages(failures=1)
+        batcher = WebhookBatcher(batch_size=10, max_delay_ms=0, queue_limit=100)
+        await batcher.start(messages)
+        assert batcher.submit([("message", {"_id": "m1", "waId": "1"}), ("message", {"_id": "m2", "waId": "1"})])
+        for _ in range(100):
+            await asyncio.sleep(0.005)
+            if batcher.stats()["failing"]:
+                break
+        # Until the retry succeeds the provider is asked to come back later
+        assert batcher.submit([("message", {"_id": "m3", "waId": "1"})]) is False
+        for _ in range(200):
+            await asyncio.sleep(0.005)
+            if "m2" in messages.docs:
+                break
+        assert batcher.submit([("message", {"_id": "m3", "waId": "1"})]) is True
+        await batcher.stop()
+        return messages, batcher.stats()
+
+    messages, stats = asyncio.run(scenario())
+    assert sorted(messages.docs) == ["m1", "m2", "m3"]
+    assert stats["errors"] == 1 and not stats["failing"]
+
+
+def test_failed_records_that_do_not_fit_are_spooled_and_written_later(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_RETRY_BASE_MS", 20)
+
+    async def scenario():
+        spool = MemoryClient()["test"]["webhook_spool"]
+        messages = FlakyMessages(failures=1, delay=0.05)
+        batcher = WebhookBatcher(batch_size=2, max_delay_ms=0, queue_limit=2)
+        await batcher.start(messages, spool=spool)
+        assert batcher.submit([("message", {"_id": "m1", "waId": "1"}), ("message", {"_id": "m2", "waId": "1"})])
+        # Arrives while the first batch is being written, filling the queue again
+        await asyncio.sleep(0.01)
+        assert batcher.submit([("message", {"_id": "m3", "waId": "1"}), ("message", {"_id": "m4", "waId": "1"})])
+        for _ in range(200):
+            await asyncio.sleep(0.005)
+            if len(messages.docs) == 4:
+                break
+        await batcher.stop()
+        return messages, batcher.stats(), await spool.count_documents({})
+
+    messages, stats, left = asyncio.run(scenario())
+    assert sorted(messages.docs) == ["m1", "m2", "m3", "m4"]
+    assert stats["spilled"] == 2 and stats["spooled"] == 0 and left == 0
+
+
+def test_one_worker_drains_the_shared_spool_without_blocking_the_others():
+    class CountingMessages(FakeMessages):
+        def __init__(self):
+            super().__init__()
+            self.writes = []
+
+        async def bulk_write(self, ops, ordered=True):
+            self.writes.extend(op._filter["_id"] for op in ops if not isinstance(op._doc, list))
+            return await super().bulk_write(ops, ordered)
+
+    async def scenario():
+        db = MemoryClient()["test"]
+        spool = db["webhook_spool"]
+        # Left by a worker that has since gone away
+        spool.load(
+            [{"_id": ObjectId(), "kind": "message", "record": {"_id": f"s{i}", "waId": "1"}, "node": "gone"} for i in range(5)]
+        )
+        messages = CountingMessages()
+        workers = [WebhookBatcher(batch_size=2, max_delay_ms=0) for _ in range(2)]
+        for worker in workers:
+            await worker.start(messages, spool=spool, leases=db["leases"])
+        # Someone else's backlog does not make either worker refuse work
+        assert all(w.submit([("message", {"_id": f"new-{i}", "waId": "1"})]) for i, w in enumerate(workers))
+        for _ in range(200):
+            await asyncio.sleep(0.005)
+            if len(messages.docs) == 7:
+                break
+        for worker in workers:
+            await worker.stop()
+        return messages, await spool.count_documents({}), await db["leases"].count_documents({})
+
+    messages, left, leases = asyncio.run(scenario())
+    assert len(messages.docs) == 7 and left == 0 and leases == 0
+    # Each spooled row was written by one worker only
+    spooled = [mid for mid in messages.writes if mid.startswith("s")]
+    assert sorted(spooled) == [f"s{i}" for i in range(5)]
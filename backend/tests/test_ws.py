@@ -0,0 +1,156 @@
+import sys
+import os
+import asyncio
+import json
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.deltas import delta_event
+from app.ws import CONVERSATIONS_TOPIC, WebSocketManager, topics_for, wa_topic
+
+
+class FakeSocket:
+    def __init__(self, fail=False, gate=None):
+        self.sent = []
+        self.fail = fail
+        self.gate = gate
+        self.closed = False
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, data):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise RuntimeError("closed")
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+def test_broadcast_reaches_only_subscribers():
+    async def scenario():
+        manager = WebSocketManager()
+        lister, alice, bob, idle = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+        for sock in (lister, alice, bob, idle):
+            await manager.connect(sock)
+        await manager.handle_client_message(lister, json.dumps({"action": "subscribe", "topics": [CONVERSATIONS_TOPIC]}))
+        await manager.handle_client_message(alice, json.dumps({"action": "subscribe", "topics": [wa_topic("111")]}))
+        await manager.handle_client_message(bob, json.dumps({"action": "subscribe", "topics": [wa_topic("222")]}))
+        await manager.drain()
+        assert alice.sent[-1] == {"type": "subscriptions", "topics": ["wa:111"], "seq": 1}
+
+        await manager.broadcast({"type": "insert"}, topics=topics_for("111"))
+        await manager.drain()
+        assert [m["type"] for m in lister.sent] == ["subscriptions", "insert"]
+        assert [m["type"] for m in alice.sent] == ["subscriptions", "insert"]
+        assert [m["type"] for m in bob.sent] == ["subscriptions"]
+        assert idle.sent == []
+
+        await manager.handle_client_message(alice, json.dumps({"action": "unsubscribe", "topics": [wa_topic("111")]}))
+        await manager.broadcast({"type": "insert"}, topics=topics_for("111"))
+        await manager.drain()
+        assert [m["type"] for m in alice.sent] == ["subscriptions", "insert", "subscriptions"]
+        # Each socket numbers its own frames
+        assert [m["seq"] for m in alice.sent] == [1, 2, 3]
+        assert [m["seq"] for m in lister.sent] == [1, 2, 3]
+
+    asyncio.run(scenario())
+
+
+def test_invalid_frame_and_dead_socket_cleanup():
+    async def scenario():
+        manager = WebSocketManager()
+        sock, dead = FakeSocket(), FakeSocket(fail=True)
+        await manager.connect(sock)
+        await manager.connect(dead)
+        await manager.handle_client_message(sock, "not json")
+        await manager.drain()
+        assert sock.sent == [{"type": "error", "detail": "Invalid frame", "seq": 1}]
+
+        manager.subscribe(dead, [CONVERSATIONS_TOPIC])
+        await manager.broadcast({"type": "insert"}, topics=[CONVERSATIONS_TOPIC])
+        await manager.drain()
+        assert CONVERSATIONS_TOPIC not in manager._topics
+        assert dead not in manager._connections
+        # A failed send also closes the socket instead of leaving it half open
+        await asyncio.sleep(0)
+        assert dead.closed
+
+    asyncio.run(scenario())
+
+
+def test_every_serialised_frame_gets_a_valid_seq():
+    async def scenario():
+        manager = WebSocketManager()
+        sock = FakeSocket()
+        await manager.connect(sock)
+        # Backplane payloads and listeners hand over strings as they come
+        for data in ('{"type": "insert"}\n', "{}", " { } ", '[{"type": "insert"}]', "3"):
+            manager.deliver(data)
+        await manager.drain()
+        return sock.sent
+
+    assert asyncio.run(scenario()) == [
+        {"type": "insert", "seq": 1},
+        {"seq": 2},
+        {"seq": 3},
+        {"data": [{"type": "insert"}], "seq": 4},
+        {"data": 3, "seq": 5},
+    ]
+
+
+def test_slow_consumer_does_not_block_others():
+    async def scenario(policy):
+        manager = WebSocketManager(queue_size=2, policy=policy)
+        gate = asyncio.Event()
+        slow, fast = FakeSocket(gate=gate), FakeSocket()
+        for sock in (slow, fast):
+            await manager.connect(sock)
+            manager.subscribe(sock, [CONVERSATIONS_TOPIC])
+        for n in range(5):
+            await manager.broadcast({"type": "insert", "n": n}, topics=[CONVERSATIONS_TOPIC])
+            await asyncio.sleep(0)
+        assert [m["n"] for m in fast.sent] == [0, 1, 2, 3, 4]
+        gate.set()
+        await manager.drain()
+        await asyncio.sleep(0)
+        return manager, slow
+
+    manager, slow = asyncio.run(scenario("coalesce"))
+    # First frame was in flight; the backlog behind it collapsed into a resync
+    assert slow.sent == [
+        {"type": "insert", "n": 0, "seq": 1},
+        {"v": 2, "type": "resync", "seq": 5},
+        {"type": "insert", "n": 4, "seq": 6},
+    ]
+    assert manager.stats()["coalesced"] > 0
+
+    manager, slow = asyncio.run(scenario("drop"))
+    assert [m["n"] for m in slow.sent] == [0, 3, 4]
+    # The dropped frames show up as a gap in the sequence numbers
+    assert [m["seq"] for m in slow.sent] == [1, 4, 5]
+    assert manager.stats()["dropped"] == 2
+
+    manager, slow = asyncio.run(scenario("disconnect"))
+    assert slow.closed and manager.stats()["slow_disconnects"] == 1
+    assert manager.stats()["connections"] == 1
+
+
+def test_delta_events_carry_what_clients_patch_state_with():
+    doc = {"_id": "m1", "waId": "111", "direction": "inbound", "text": "hi", "timestamps": {"whatsapp": 5}, "raw": {}}
+    inserted = delta_event(("message.inserted", "111", doc))
+    assert inserted["v"] == 2 and inserted["type"] == "message.inserted" and inserted["waId"] == "111"
+    assert "raw" not in inserted["data"] and inserted["data"]["timestamps"]["read"] is None
+
+    status = {"_id": "m1", "status": "read", "timestamps": {"read": 9}}
+    assert delta_event(("message.status", "111", status))["data"] == status
+    summary = {"waId": "111", "lastMessageAt": 5, "lastMessageId": "m1"}
+    assert "lastMessageId" not in delta_event(("conversation.updated", "111", summary))["data"]
+    # A status that left the summary unchanged has nothing to push
+    assert delta_event(("conversation.updated", "111", None)) is None
@@ -1,4 +1,4 @@
-import { useEffect, useMemo, useState } from 'react'
+import { useEffect, useMemo, useRef, useState } from 'react'
 import { getToken, setToken, authFetch } from './auth'
 
 const API_BASE = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000'
@@ -55,6 +55,24 @@ function formatDateChip(epochSec) {
   return d.toLocaleDateString('en-IN', { day: '2-digit', month: '2-digit', year: 'numeric', timeZone: IST_TZ })
 }
 
+function compareMessages(a, b) {
+  const ta = a?.timestamps?.whatsapp ?? 0
+  const tb = b?.timestamps?.whatsapp ?? 0
+  if (ta !== tb) return ta - tb
+  return a._id < b._id ? -1 : a._id > b._id ? 1 : 0
+}
+
+function mergeMessages(prev, incoming) {
+  const byId = new Map(prev.map((m) => [m._id, m]))
+  for (const m of incoming) byId.set(m._id, m)
+  return [...byId.values()].sort(compareMessages)
+}
+
+function upsertConversation(prev, summary) {
+  const rest = prev.filter((c) => c.waId !== summary.waId)
+  return [...rest, summary].sort((a, b) => (b.lastMessageAt ?? 0) - (a.lastMessageAt ?? 0))
+}
+
 export default function App() {
   const [conversations, setConversations] = useState([])
   const [activeWaId, setActiveWaId] = useState(null)
@@ -63,12 +81,22 @@ export default function App() {
   const [loading, setLoading] = useState(false)
   const [conversationsLoading, setConversationsLoading] = useState(true)
   const [messagesLoading, setMessagesLoading] = useState(false)
+  const [olderCursor, setOlderCursor] = useState(null)
+  const [olderLoading, setOlderLoading] = useState(false)
   const [showList, setShowList] = useState(true)
   const [ws, setWs] = useState(null)
+  const [wsFailed, setWsFailed] = useState(false)
   const [showColdStartInfo, setShowColdStartInfo] = useState(true)
   const [authUser, setAuthUser] = useState(null)
   const [authForm, setAuthForm] = useState({ username: '', password: '' })
   const token = getToken()
+  const syncTokenRef = useRef(null)
+  const syncingRef = useRef(false)
+  // True while a WebSocket or SSE stream is delivering events
+  const liveRef = useRef(false)
+  const wsSeqRef = useRef(0)
+  const activeWaIdRef = useRef(null)
+  activeWaIdRef.current = activeWaId
 
   async function fetchMe() {
     if (!getToken()) { setAuthUser(null); return }
@@ -105,59 +133,180 @@ export default function App() {
     if (!waId) return
     try {
       if (!silent) setMessagesLoading(true)
+      // Newest page first; older pages are loaded on demand
       const res = await fetch(`${API_BASE}/messages?wa_id=${encodeURIComponent(waId)}`)
       if (!res.ok) throw new Error('failed')
       const data = await res.json()
-      setMessages(Array.isArray(data) ? data : [])
+      const items = Array.isArray(data?.items) ? data.items : []
+      if (silent) {
+        setMessages((prev) => mergeMessages(prev, items))
+      } else {
+        setMessages(items)
+        setOlderCursor(data?.has_more ? data.next_cursor : null)
+      }
     } catch (e) {
-      setMessages([])
+      if (!silent) {
+        setMessages([])
+        setOlderCursor(null)
+      }
     } finally {
       if (!silent) setMessagesLoading(false)
     }
   }
 
+  async function fetchOlderMessages() {
+    if (!activeWaId || !olderCursor || olderLoading) return
+    try {
+      setOlderLoading(true)
+      const res = await fetch(`${API_BASE}/messages?wa_id=${encodeURIComponent(activeWaId)}&before=${encodeURIComponent(olderCursor)}`)
+      if (!res.ok) throw new Error('failed')
+      const data = await res.json()
+      const items = Array.isArray(data?.items) ? data.items : []
+      setMessages((prev) => mergeMessages(prev, items))
+      setOlderCursor(data?.has_more ? data.next_cursor : null)
+    } catch {
+      // keep what we have; the button stays available for a retry
+    } finally {
+      setOlderLoading(false)
+    }
+  }
+
+  function applyChange(change) {
+    const data = change?.data
+    if (!data) return
+    if (change.kind === 'conversation.updated') {
+      setConversations((prev) => upsertConversation(prev, data))
+    } else if (change.kind === 'message.inserted') {
+      if (data.waId === activeWaIdRef.current) setMessages((prev) => mergeMessages(prev, [data]))
+    } else if (change.kind === 'message.status') {
+      setMessages((prev) => prev.map((m) => (m._id === data._id ? { ...m, status: data.status, timestamps: { ...m.timestamps, ...data.timestamps } } : m)))
+    }
+  }
+
+  // Pull only what changed since the last token; full reload on reset
+  async function syncChanges() {
+    if (syncingRef.current) return
+    syncingRef.current = true
+    try {
+      let hasMore = true
+      while (hasMore) {
+        const since = syncTokenRef.current
+        const qs = since === null ? '' : `?since=${since}`
+        const res = await fetch(`${API_BASE}/sync${qs}`)
+        if (!res.ok) throw new Error('failed')
+        const data = await res.json()
+        if (data.reset && since !== null) {
+          fetchConversations(true)
+          if (activeWaIdRef.current) fetchMessages(activeWaIdRef.current, true)
+        }
+        for (const change of data.changes || []) applyChange(change)
+        syncTokenRef.current = data.token
+        hasMore = Boolean(data.has_more)
+      }
+    } catch {
+      // next tick retries from the same token
+    } finally {
+      syncingRef.current = false
+    }
+  }
+
   useEffect(() => {
-  fetchMe()
-  fetchConversations()
+    fetchMe()
+    // Take the sync token before the initial load so no write is missed
+    syncChanges().finally(() => fetchConversations())
   }, [])
 
   useEffect(() => {
     fetchMessages(activeWaId)
   }, [activeWaId])
 
-  // Polling for updates every 5s
+  // Delta sync every 5s, only while no live event channel is connected
   useEffect(() => {
     const interval = setInterval(() => {
-      fetchConversations(true)
-      if (activeWaId) {
-        fetchMessages(activeWaId, true)
-      }
+      if (!liveRef.current) syncChanges()
     }, 5000)
     return () => clearInterval(interval)
-  }, [activeWaId])
+  }, [])
+
+  function handleLiveEvent(raw) {
+    let data
+    try {
+      data = JSON.parse(raw)
+    } catch {
+      return
+    }
+    // Socket frames are numbered; a gap means some were dropped for us
+    if (typeof data?.seq === 'number') {
+      const gap = data.seq !== wsSeqRef.current + 1
+      wsSeqRef.current = data.seq
+      if (gap) syncChanges()
+    }
+    if (data?.v >= 2 && data.type !== 'resync') {
+      // Deltas carry the new state; patch it in place instead of refetching
+      applyChange({ kind: data.type, data: data.data })
+    } else if (data?.type === 'insert' || data?.type === 'status' || data?.type === 'resync') {
+      // 'resync' means our send queue overflowed and events were coalesced
+      syncChanges()
+    }
+  }
 
   // Connect WebSocket for realtime updates (if available)
   useEffect(() => {
     const url = (API_BASE.replace('http', 'ws') + '/ws')
     try {
       const socket = new WebSocket(url)
-      socket.onmessage = (evt) => {
-        try {
-          const data = JSON.parse(evt.data)
-          if (data?.type === 'insert') {
-            fetchConversations(true)
-            if (data.message?.waId === activeWaId) {
-              fetchMessages(activeWaId, true)
-            }
-          }
-        } catch {}
+      socket.onopen = () => {
+        wsSeqRef.current = 0
+        socket.send(JSON.stringify({ action: 'subscribe', topics: ['conversations'] }))
+        liveRef.current = true
+        setWs(socket)
+        syncChanges()
+      }
+      socket.onmessage = (evt) => handleLiveEvent(evt.data)
+      socket.onclose = () => {
+        liveRef.current = false
+        setWs(null)
+        setWsFailed(true)
+      }
+      return () => {
+        socket.onclose = null
+        liveRef.current = false
+        setWs(null)
+        socket.close()
       }
-      setWs(socket)
-      return () => socket.close()
     } catch {
-      // ignore if ws fails
+      setWsFailed(true)
     }
-  }, [activeWaId])
+  }, [])
+
+  // Without a WebSocket, hold one server-sent events stream instead of polling
+  useEffect(() => {
+    if (!wsFailed || typeof EventSource === 'undefined') return
+    const topics = ['conversations', ...(activeWaId ? [`wa:${activeWaId}`] : [])]
+    const qs = topics.map((t) => `topics=${encodeURIComponent(t)}`).join('&')
+    const source = new EventSource(`${API_BASE}/events?${qs}`)
+    source.onopen = () => {
+      liveRef.current = true
+      syncChanges()
+    }
+    // The browser reconnects by itself (sending Last-Event-ID); poll meanwhile
+    source.onerror = () => { liveRef.current = false }
+    source.onmessage = (evt) => handleLiveEvent(evt.data)
+    return () => {
+      liveRef.current = false
+      source.close()
+    }
+  }, [wsFailed, activeWaId])
+
+  // Follow the open chat's topic on the socket
+  useEffect(() => {
+    if (!ws || ws.readyState !== WebSocket.OPEN || !activeWaId) return
+    const topics = [`wa:${activeWaId}`]
+    ws.send(JSON.stringify({ action: 'subscribe', topics }))
+    return () => {
+      if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ action: 'unsubscribe', topics }))
+    }
+  }, [ws, activeWaId])
 
   useEffect(() => {
     // On small screens, auto-hide list when a chat is selected
@@ -188,7 +337,7 @@ export default function App() {
       })
       const saved = await res.json()
       setMessages((prev) => prev.map((m) => (m._id === optimistic._id ? saved : m)))
-      fetchConversations()
+      syncChanges()
     } catch (e) {
       // rollback on error
       setMessages((prev) => prev.filter((m) => m._id !== optimistic._id))
@@ -280,6 +429,13 @@ export default function App() {
             <button className="md:hidden text-[var(--wa-accent)]" onClick={()=>setShowList(true)}>Back</button>
           </div>
           <div className="flex-1 overflow-auto p-4 space-y-1 chat-scroll chat-bg">
+            {!messagesLoading && olderCursor && (
+              <div className="w-full flex justify-center">
+                <button onClick={fetchOlderMessages} disabled={olderLoading} className="date-chip disabled:opacity-50">
+                  {olderLoading ? 'Loading…' : 'Load older messages'}
+                </button>
+              </div>
+            )}
             {messagesLoading && (
               <div className="space-y-1">
                 {[...Array(5)].map((_,i)=> (
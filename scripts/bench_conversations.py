@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Compare the legacy /conversations aggregation with the summary collection.
+
+Seeds a throwaway database (``<DATABASE_NAME>_bench``) with synthetic messages
+spread over a fixed number of waIds and times both read paths at each size.
+Latency of the summary read should stay flat as the message count grows.
+
+    python scripts/bench_conversations.py --sizes 10000 100000 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+from app.config import MONGODB_URI, DATABASE_NAME
+from app.conversations import SUMMARY_PROJECTION, ensure_indexes, rebuild_conversations
+
+
+LEGACY_PIPELINE: List[Dict[str, Any]] = [
+    {"$match": {"waId": {"$type": "string"}}},
+    {"$sort": {"timestamps.whatsapp": 1, "_id": 1}},
+    {
+        "$group": {
+            "_id": "$waId",
+            "last": {"$last": "$$ROOT"},
+            "name": {"$max": {"$ifNull": ["$name", ""]}},
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,
+            "waId": "$_id",
+            "name": {"$cond": [{"$eq": ["$name", ""]}, None, "$name"]},
+            "lastMessageText": "$last.text",
+            "lastMessageAt": "$last.timestamps.whatsapp",
+            "lastMessageDirection": "$last.direction",
+            "lastMessageStatus": "$last.status",
+        }
+    },
+    {"$sort": {"lastMessageAt": -1}},
+]
+
+
+def synthetic_message(i: int, wa_ids: int, base_ts: int) -> Dict[str, Any]:
+    wa_id = f"91{random.randrange(wa_ids):010d}"
+    ts = base_ts + i
+    outbound = i % 2 == 0
+    return {
+        "_id": f"bench-{i}",
+        "waId": wa_id,
+        "name": f"Contact {wa_id[-4:]}",
+        "direction": "outbound" if outbound else "inbound",
+        "text": f"message {i}",
+        "type": "text",
+        "status": "sent" if outbound else "read",
+        "timestamps": {"whatsapp": ts, "sent": ts if outbound else None, "delivered": None, "read": None},
+        "businessPhone": None,
+        "phoneNumberId": None,
+        "conversationId": None,
+        "gsId": None,
+        "metaMsgId": None,
+    }
+
+
+async def seed(messages, start: int, stop: int, wa_ids: int, batch: int = 10_000) -> None:
+    base_ts = 1_700_000_000
+    for offset in range(start, stop, batch):
+        docs = [synthetic_message(i, wa_ids, base_ts) for i in range(offset, min(offset + batch, stop))]
+        await messages.insert_many(docs, ordered=False)
+
+
+async def time_call(fn, repeat: int) -> Dict[str, float]:
+    samples: List[float] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--wa-ids", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the summary read")
+    args = parser.parse_args()
+
+    if not MONGODB_URI:
+        raise RuntimeError("MONGODB_URI is not set. Define it in .env before running the benchmark.")
+
+    client = AsyncIOMotorClient(MONGODB_URI)
+    db = client[f"{DATABASE_NAME}_bench"]
+    messages = db["processed_messages"]
+    conversations = db["conversations"]
+    await messages.drop()
+    await conversations.drop()
+    await messages.create_index([("waId", 1), ("timestamps.whatsapp", -1), ("_id", -1)])
+    await ensure_indexes(conversations)
+
+    async def legacy() -> None:
+        await messages.aggregate(LEGACY_PIPELINE, allowDiskUse=True).to_list(length=None)
+
+    async def summary() -> None:
+        await conversations.find({}, SUMMARY_PROJECTION).sort("lastMessageAt", -1).to_list(length=None)
+
+    results = []
+    seeded = 0
+    for size in sorted(args.sizes):
+        await seed(messages, seeded, size, args.wa_ids)
+        seeded = size
+        await rebuild_conversations(messages, conversations)
+        row: Dict[str, Any] = {"messages": size, "wa_ids": args.wa_ids}
+        row["summary"] = await time_call(summary, args.repeat)
+        if not args.skip_legacy:
+            row["legacy"] = await time_call(legacy, max(1, args.repeat // 4))
+        results.append(row)
+        print(json.dumps(row), flush=True)
+
+    await client.drop_database(db.name)
+    client.close()
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
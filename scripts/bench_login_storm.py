@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""GET /conversations latency while a burst of logins is running.
+
+Mounts the real routers on a bare FastAPI app next to a re-creation of the
+previous login handler (bcrypt inline in the async handler) and drives both
+in-process over ASGI with in-memory collections. A sampler requests
+/conversations every ``--interval-ms`` while ``--concurrency`` clients keep
+logging in; with bcrypt on the hash pool the sampler's p99 should stay
+close to the idle baseline.
+
+    python scripts/bench_login_storm.py --logins 24 --concurrency 8
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+from fastapi import FastAPI, HTTPException
+
+from app import config
+from app import db as db_module
+from app.auth import create_access_token, get_password_hash, hash_pool, verify_password
+from app.readcache import read_cache
+from app.routes import router
+from app.routes_auth import LoginRequest, TokenResponse
+from app.routes_auth import router as auth_router
+
+USERNAME = "storm"
+PASSWORD = "correct horse battery staple"
+
+
+class FakeCursor:
+    def __init__(self, docs: List[dict]) -> None:
+        self.docs = docs
+
+    def sort(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def hint(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def __aiter__(self):
+        self._it = iter(self.docs)
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, docs: List[dict]) -> None:
+        self.docs = docs
+
+    def find(self, *args, **kwargs) -> FakeCursor:
+        return FakeCursor(list(self.docs))
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        return next((d for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+    app.include_router(auth_router)
+
+    @app.post("/legacy/login", response_model=TokenResponse)
+    async def legacy_login(payload: LoginRequest) -> TokenResponse:
+        user = await db_module.users_collection.find_one({"username": payload.username}, {"hashed_password": 1})
+        if not user or not verify_password(payload.password, user.get("hashed_password", "")):
+            raise HTTPException(status_code=401, detail="Incorrect username or password")
+        return TokenResponse(access_token=create_access_token(subject=user["_id"]))
+
+    return app
+
+
+async def call(app: FastAPI, method: str, path: str, body: bytes = b"") -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+    status: List[int] = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+async def sample(app: FastAPI, interval: float, stop: asyncio.Event) -> List[float]:
+    latencies: List[float] = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await call(app, "GET", "/conversations")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def storm(app: FastAPI, path: str, logins: int, concurrency: int) -> Dict[int, int]:
+    body = json.dumps({"username": USERNAME, "password": PASSWORD}).encode()
+    remaining = [logins]
+    codes: Dict[int, int] = {}
+
+    async def client() -> None:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            code = await call(app, "POST", path, body)
+            codes[code] = codes.get(code, 0) + 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return codes
+
+
+async def run(mode: str, app: FastAPI, logins: int, concurrency: int, interval: float, idle_seconds: float) -> dict:
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample(app, interval, stop))
+    started = time.perf_counter()
+    if mode == "idle":
+        await asyncio.sleep(idle_seconds)
+        codes: Dict[int, int] = {}
+    else:
+        codes = await storm(app, "/legacy/login" if mode == "inline" else "/login", logins, concurrency)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    latencies = await sampler
+    return {
+        "mode": mode,
+        "elapsed_seconds": round(elapsed, 3),
+        "logins": codes,
+        "conversations": summarize(latencies),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--interval-ms", type=float, default=10)
+    parser.add_argument("--conversations", type=int, default=50, help="Rows in the conversation list")
+    args = parser.parse_args()
+
+    config.SECRET_KEY = config.SECRET_KEY or "bench-secret"
+    # Every sample must run the handler, not hit the read cache
+    read_cache.ttl_seconds = 0
+    db_module.users_collection = FakeCollection(
+        [{"_id": "u1", "username": USERNAME, "hashed_password": get_password_hash(PASSWORD)}]
+    )
+    db_module.conversations_collection = FakeCollection(
+        [{"waId": f"91{i:010d}", "name": f"Contact {i}", "lastMessageAt": i} for i in range(args.conversations)]
+    )
+    app = build_app()
+    interval = args.interval_ms / 1000
+    results = [await run("idle", app, 0, 0, interval, 2.0)]
+    for mode in ("inline", "pool"):
+        results.append(await run(mode, app, args.logins, args.concurrency, interval, 0))
+    results.append({"hash_pool": hash_pool.stats()})
+    hash_pool.shutdown()
+    for row in results:
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
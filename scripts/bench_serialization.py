@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Response serialization benchmark for GET /messages and GET /conversations.
+
+Both endpoints are mounted on a bare FastAPI app next to re-creations of
+their previous implementations (one Pydantic model per row, validated again
+through ``response_model``) and called in-process over ASGI with an
+in-memory collection, so only routing and serialization are measured. The
+re-creations take the same parameters, so request parsing costs the same on
+both sides; the real endpoints additionally go through the read cache (at
+TTL 0, so every call still loads) and compute an ETag. Each pair of
+responses is also checked to be the same JSON.
+
+    python scripts/bench_serialization.py --sizes 50 500 --repeat 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+from fastapi import FastAPI, Header, Query
+
+from app import db as db_module
+from app.models import ConversationOut, MessageOut, MessagePage
+from app.readcache import read_cache
+from app.routes import router
+from app.utils import encode_cursor
+
+
+class FakeCursor:
+    def __init__(self, docs: List[dict]) -> None:
+        self.docs = docs
+
+    def sort(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def limit(self, n: int) -> "FakeCursor":
+        return self
+
+    async def to_list(self, length=None) -> List[dict]:
+        return self.docs[:length]
+
+    def __aiter__(self):
+        self._it = iter(self.docs)
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, docs: List[dict]) -> None:
+        self.docs = docs
+
+    def find(self, *args, **kwargs) -> FakeCursor:
+        return FakeCursor(list(self.docs))
+
+
+def make_messages(n: int) -> List[dict]:
+    return [
+        {
+            "_id": f"wamid.{i:012d}",
+            "waId": "919937320320",
+            "name": "Ravi Kumar",
+            "direction": "inbound" if i % 2 else "outbound",
+            "text": "Hi, I'd like to know more about your services. " * 2,
+            "type": "text",
+            "status": "read",
+            "timestamps": {"whatsapp": 1754400000 + i, "sent": None, "delivered": None, "read": 1754400000 + i},
+            "businessPhone": "918329446654",
+            "phoneNumberId": "629305560276479",
+            "conversationId": None,
+            "gsId": None,
+            "metaMsgId": None,
+        }
+        for i in range(n)
+    ]
+
+
+def make_summaries(n: int) -> List[dict]:
+    return [
+        {
+            "waId": f"91{i:010d}",
+            "name": f"Contact {i}",
+            "lastMessageText": "See you tomorrow",
+            "lastMessageAt": 1754400000 + i,
+            "lastMessageDirection": "inbound",
+            "lastMessageStatus": "read",
+        }
+        for i in range(n)
+    ]
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+
+    # Same parameters as the real endpoints, so request parsing costs the same
+    @app.get("/legacy/messages", response_model=MessagePage)
+    async def legacy_messages(
+        wa_id: str = Query(...),
+        before: Optional[str] = Query(None),
+        after: Optional[str] = Query(None),
+        limit: int = Query(50, ge=1, le=500),
+        if_none_match: Optional[str] = Header(None),
+    ) -> MessagePage:
+        cursor = db_module.messages_collection.find({"waId": wa_id}).sort([]).limit(limit + 1)
+        docs = await cursor.to_list(limit + 1)
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["timestamps"]["whatsapp"], docs[-1]["_id"]) if has_more else None
+        docs.reverse()
+        return MessagePage(items=[MessageOut(**d) for d in docs], next_cursor=next_cursor, has_more=has_more)
+
+    @app.get("/legacy/conversations", response_model=List[ConversationOut])
+    async def legacy_conversations(if_none_match: Optional[str] = Header(None)) -> List[ConversationOut]:
+        return [ConversationOut(**row) async for row in db_module.conversations_collection.find({}).sort("x")]
+
+    return app
+
+
+async def call(app: FastAPI, path: str, query: str = "") -> bytes:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+    body: List[bytes] = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def timed(app: FastAPI, path: str, query: str, repeat: int) -> float:
+    for _ in range(min(repeat, 20)):
+        await call(app, path, query)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        await call(app, path, query)
+    return (time.perf_counter() - t0) / repeat
+
+
+async def run(size: int, repeat: int, rounds: int = 5) -> List[dict]:
+    db_module.messages_collection = FakeCollection(make_messages(size + 1))
+    db_module.conversations_collection = FakeCollection(make_summaries(size))
+    # Every call must reach the serializer, not the read cache
+    read_cache.ttl_seconds = 0
+    app = build_app()
+    results = []
+    for name, fast, legacy, query in (
+        ("messages", "/messages", "/legacy/messages", f"wa_id=919937320320&limit={size}"),
+        ("conversations", "/conversations", "/legacy/conversations", ""),
+    ):
+        same = json.loads(await call(app, fast, query)) == json.loads(await call(app, legacy, query))
+        # Alternate the two and keep each one's best round, so that noise
+        # from other processes does not favour whichever ran in a quiet spell
+        legacy_s = fast_s = float("inf")
+        for _ in range(rounds):
+            legacy_s = min(legacy_s, await timed(app, legacy, query, repeat))
+            fast_s = min(fast_s, await timed(app, fast, query, repeat))
+        results.append(
+            {
+                "endpoint": name,
+                "rows": size,
+                "legacy_us": round(legacy_s * 1e6, 1),
+                "fast_us": round(fast_s * 1e6, 1),
+                "speedup": round(legacy_s / fast_s, 2) if fast_s else None,
+                "identical_json": same,
+            }
+        )
+    return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes:
+        for result in await run(size, args.repeat, args.rounds):
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
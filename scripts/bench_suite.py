@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the API's hot paths on an in-memory database.
+
+The real application (middleware, routers, read cache, WebSocket manager,
+change log) runs in-process over ASGI on top of scripts/memmongo.py, seeded
+with a synthetic dataset of ``--messages`` messages spread over
+``--wa-ids`` conversations (``--skew`` > 1 makes a few conversations hot).
+Scenarios:
+
+    conversations   GET /conversations
+    messages        GET /messages?wa_id=...  (newest page of a random thread)
+    post_messages   POST /messages
+    ws_fanout       delta events to --sockets subscribed sockets, until delivered
+    ingest          scripts/ingest_payloads.py over an NDJSON archive
+
+HTTP scenarios issue ``--requests`` calls from ``--concurrency`` concurrent
+clients. Each scenario reports throughput, p50/p90/p99/max latency in ms and
+the database calls it made, as one JSON line; ``--output`` also writes the
+whole run as a JSON document, and ``--baseline`` compares against one.
+The read cache is off unless ``--read-cache`` is given, so every request
+reaches the database. ``--db-latency-ms`` adds a simulated round trip per
+database call. Seeded documents take about 1 KB of RAM each, so
+``--messages 10m`` needs a machine with well over 10 GB.
+
+    python scripts/bench_suite.py --messages 100k --wa-ids 1000 --output bench.json
+    python scripts/bench_suite.py --messages 100k --wa-ids 1000 --baseline bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+import orjson
+
+from app import config
+from app import db as db_module
+from app import main as app_main
+from app.changes import CONVERSATION_UPDATED, MESSAGE_INSERTED
+from app.deltas import publish_changes
+from app.ingest import BulkIngestor
+from app.accesslog import access_log
+from app.readcache import read_cache
+from app.ws import CONVERSATIONS_TOPIC, manager, wa_topic
+
+import ingest_payloads
+from loadtest_webhook import BUSINESS_PHONE, message_payload, status_payload
+from memmongo import MemoryClient, MemoryDatabase
+
+SCENARIOS = ("conversations", "messages", "post_messages", "ws_fanout", "ingest")
+
+START_TS = 1754400000
+TEXTS = [
+    "Hi, I'd like to know more about your services.",
+    "Sure, here is the brochure.",
+    "What are your opening hours?",
+    "We are open 9am to 6pm, Monday to Saturday.",
+    "Can I book a demo for tomorrow?",
+    "Booked for 11am, see you then!",
+    "Thanks!",
+    "Is there a discount for annual plans?",
+]
+
+
+def parse_count(text: str) -> int:
+    """``10k``, ``1.5m`` or a plain number."""
+    text = text.strip().lower().replace("_", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+# ===== Dataset =====
+
+
+def wa_id_for(n: int) -> str:
+    return f"91{n:010d}"
+
+
+class Dataset:
+    """Deterministic synthetic messages plus the summaries they produce.
+
+    Message ``i`` has timestamp ``START_TS + i // 4`` (so some share a
+    second and the ``_id`` tiebreaker matters) and belongs to a waId drawn
+    with weight ``rank ** -skew``.
+    """
+
+    def __init__(self, messages: int, wa_ids: int, skew: float = 1.0, seed: int = 7) -> None:
+        self.messages = messages
+        self.wa_ids = [wa_id_for(n) for n in range(wa_ids)]
+        self.skew = skew
+        self.seed = seed
+        weights = [(rank + 1) ** -(skew - 1) for rank in range(wa_ids)] if skew > 1 else None
+        self._weights = weights
+
+    def pick_wa_id(self, rng: random.Random) -> str:
+        if self._weights is None:
+            return self.wa_ids[rng.randrange(len(self.wa_ids))]
+        return rng.choices(self.wa_ids, self._weights)[0]
+
+    def docs(self, summaries: Dict[str, Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        rng = random.Random(self.seed)
+        names = {wa_id: f"Contact {wa_id[-4:]}" for wa_id in self.wa_ids}
+        for i in range(self.messages):
+            wa_id = self.pick_wa_id(rng)
+            ts = START_TS + i // 4
+            inbound = rng.random() < 0.5
+            status = "read" if inbound else rng.choice(("sent", "delivered", "read"))
+            doc = {
+                "_id": f"wamid.bench{i:012d}",
+                "waId": wa_id,
+                "name": names[wa_id],
+                "direction": "inbound" if inbound else "outbound",
+                "text": TEXTS[i % len(TEXTS)],
+                "type": "text",
+                "status": status,
+                "timestamps": {
+                    "whatsapp": ts,
+                    "sent": None if inbound else ts,
+                    "delivered": ts + 1 if status in ("delivered", "read") and not inbound else None,
+                    "read": ts + 2 if status == "read" else None,
+                },
+                "businessPhone": BUSINESS_PHONE,
+                "phoneNumberId": "629305560276479",
+                "conversationId": None,
+                "gsId": None,
+                "metaMsgId": None,
+            }
+            # Same fields the summary pipelines maintain; ids and timestamps
+            # only grow, so the latest message is the last one
+            summary = summaries.get(wa_id)
+            if summary is None:
+                summary = summaries[wa_id] = {
+                    "_id": wa_id,
+                    "waId": wa_id,
+                    "name": names[wa_id],
+                    "messageCount": 0,
+                    "inboundCount": 0,
+                    "outboundCount": 0,
+                }
+            summary.update(
+                lastMessageId=doc["_id"],
+                lastMessageText=doc["text"],
+                lastMessageAt=ts,
+                lastMessageDirection=doc["direction"],
+                lastMessageStatus=status,
+            )
+            summary["messageCount"] += 1
+            summary["inboundCount" if inbound else "outboundCount"] += 1
+            yield doc
+
+    def seed_into(self, db: MemoryDatabase) -> float:
+        """Load messages and summaries; returns the seconds it took."""
+        started = time.perf_counter()
+        summaries: Dict[str, Dict[str, Any]] = {}
+        db[config.COLLECTION_MESSAGES].load(self.docs(summaries))
+        db[config.COLLECTION_CONVERSATIONS].load(summaries.values())
+        return time.perf_counter() - started
+
+
+# ===== In-process ASGI =====
+
+
+@asynccontextmanager
+async def running(app) -> AsyncIterator[None]:
+    """Run the app's startup and shutdown handlers through the ASGI lifespan protocol."""
+    inbox: asyncio.Queue = asyncio.Queue()
+    outbox: asyncio.Queue = asyncio.Queue()
+    task = asyncio.ensure_future(
+        app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, inbox.get, outbox.put)
+    )
+    await inbox.put({"type": "lifespan.startup"})
+    message = await outbox.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(message.get("message") or "startup failed")
+    try:
+        yield
+    finally:
+        await inbox.put({"type": "lifespan.shutdown"})
+        await outbox.get()
+        await task
+
+
+async def request(app, method: str, path: str, query: str = "", body: Optional[bytes] = None) -> Tuple[int, bytes]:
+    headers = [(b"host", b"bench")]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+    status = 0
+    chunks: List[bytes] = []
+    sent = False
+
+    async def receive() -> dict:
+        nonlocal sent
+        if sent:
+            # Nothing more to read; wait like a client that keeps the connection open
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body or b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+# ===== Measurement =====
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def summarize(latencies: List[float], elapsed: float, operations: Optional[int] = None) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    count = operations if operations is not None else len(ordered)
+    return {
+        "operations": count,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p90": round(percentile(ordered, 90) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "max": round((ordered[-1] if ordered else 0.0) * 1000, 3),
+        },
+    }
+
+
+async def drive(call: Callable[[int], Awaitable[bool]], total: int, concurrency: int) -> Dict[str, Any]:
+    """Run ``call(n)`` for n < total from ``concurrency`` concurrent clients."""
+    latencies: List[float] = []
+    errors = 0
+    numbers = iter(range(total))
+
+    async def client() -> None:
+        nonlocal errors
+        for n in numbers:
+            started = time.perf_counter()
+            ok = await call(n)
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(max(1, concurrency))))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["errors"] = errors
+    return result
+
+
+def call_counts(db: MemoryDatabase, before: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    """Database calls per collection since ``before``."""
+    delta: Dict[str, Dict[str, int]] = {}
+    for name, calls in db.calls().items():
+        changed = {op: n - before.get(name, {}).get(op, 0) for op, n in calls.items()}
+        changed = {op: n for op, n in changed.items() if n}
+        if changed:
+            delta[name] = changed
+    return delta
+
+
+# ===== Scenarios =====
+
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def accept(self) -> None:
+        return None
+
+    async def send_text(self, data: str) -> None:
+        self.sent += 1
+
+
+async def bench_conversations(app, dataset: Dataset, args: argparse.Namespace) -> Dict[str, Any]:
+    async def call(n: int) -> bool:
+        status, _ = await request(app, "GET", "/conversations")
+        return status == 200
+
+    return await drive(call, args.requests, args.concurrency)
+
+
+async def bench_messages(app, dataset: Dataset, args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    threads = [dataset.pick_wa_id(rng) for _ in range(args.requests)]
+
+    async def call(n: int) -> bool:
+        status, _ = await request(app, "GET", "/messages", f"wa_id={threads[n]}&limit={args.page_size}")
+        return status == 200
+
+    return await drive(call, args.requests, args.concurrency)
+
+
+async def bench_post_messages(app, dataset: Dataset, args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed + 1)
+    bodies = [
+        orjson.dumps({"waId": dataset.pick_wa_id(rng), "text": TEXTS[n % len(TEXTS)]}) for n in range(args.requests)
+    ]
+
+    async def call(n: int) -> bool:
+        status, _ = await request(app, "POST", "/messages", body=bodies[n])
+        return status == 201
+
+    return await drive(call, args.requests, args.concurrency)
+
+
+async def bench_ws_fanout(app, dataset: Dataset, args: argparse.Namespace) -> Dict[str, Any]:
+    """Publish one write's deltas and wait until every subscribed socket has them."""
+    rng = random.Random(args.seed + 2)
+    sockets = [FakeSocket() for _ in range(args.sockets)]
+    for i, sock in enumerate(sockets):
+        await manager.connect(sock)
+        topics = [wa_topic(dataset.pick_wa_id(rng))]
+        if i % 10 == 0:
+            topics.append(CONVERSATIONS_TOPIC)
+        manager.subscribe(sock, topics)
+    try:
+        writes = args.requests
+        latencies: List[float] = []
+        started = time.perf_counter()
+        for n in range(writes):
+            wa_id = dataset.pick_wa_id(rng)
+            ts = START_TS + dataset.messages + n
+            doc = {"_id": f"wamid.fanout{n:09d}", "waId": wa_id, "direction": "outbound", "text": "x",
+                   "status": "sent", "timestamps": {"whatsapp": ts, "sent": ts}}
+            summary = {"waId": wa_id, "lastMessageText": "x", "lastMessageAt": ts,
+                       "lastMessageDirection": "outbound", "lastMessageStatus": "sent"}
+            t0 = time.perf_counter()
+            await publish_changes([(MESSAGE_INSERTED, wa_id, doc), (CONVERSATION_UPDATED, wa_id, summary)])
+            await manager.drain()
+            latencies.append(time.perf_counter() - t0)
+        result = summarize(latencies, time.perf_counter() - started)
+        result["sockets"] = len(sockets)
+        result["frames_delivered"] = sum(s.sent for s in sockets)
+        result["dropped"] = manager.stats()["dropped"] + manager.stats()["coalesced"]
+        return result
+    finally:
+        for sock in sockets:
+            manager.disconnect(sock)
+
+
+def write_archive(path: Path, dataset: Dataset, payloads: int, seed: int) -> int:
+    """NDJSON of message payloads, each followed by a status; some statuses come first."""
+    rng = random.Random(seed)
+    written = 0
+    with open(path, "wb") as f:
+        for i in range(payloads // 2 or 1):
+            wa_id = dataset.pick_wa_id(rng)
+            message_id = f"wamid.ingest{i:012d}"
+            ts = START_TS + dataset.messages + i
+            pair = [message_payload(message_id, wa_id, ts), status_payload(message_id, wa_id, ts + 1)]
+            if rng.random() < 0.05:
+                # Status before its message, as providers sometimes deliver them
+                pair.reverse()
+            for payload in pair:
+                f.write(orjson.dumps(payload) + b"\n")
+                written += 1
+    return written
+
+
+async def bench_ingest(app, dataset: Dataset, args: argparse.Namespace) -> Dict[str, Any]:
+    """``ingest_stream`` on a fresh in-memory database, timing every flush."""
+    client = MemoryClient(args.db_latency_ms)
+    db = client[config.DATABASE_NAME]
+    flushes: List[float] = []
+
+    class TimedIngestor(BulkIngestor):
+        async def flush(self):
+            started = time.perf_counter()
+            try:
+                return await super().flush()
+            finally:
+                flushes.append(time.perf_counter() - started)
+
+    async def open_target(bloom_capacity=None):
+        pending = ingest_payloads.PendingStatusBuffer(db[config.COLLECTION_PENDING_STATUSES])
+        await pending.load()
+        return ingest_payloads.IngestTarget(
+            client=client,
+            collection=db[config.COLLECTION_MESSAGES],
+            conversations=db[config.COLLECTION_CONVERSATIONS],
+            changelog=ingest_payloads.ChangeLog(db[config.COLLECTION_CHANGES], db[config.COLLECTION_COUNTERS]),
+            pending=pending,
+            dedup=ingest_payloads.DedupCache(bloom_capacity=bloom_capacity),
+            checkpoints=db[config.COLLECTION_INGEST_CHECKPOINTS],
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Path(tmp) / "payloads.jsonl"
+        payloads = write_archive(archive, dataset, args.ingest_payloads, args.seed + 3)
+        originals = ingest_payloads.open_target, ingest_payloads.BulkIngestor
+        ingest_payloads.open_target, ingest_payloads.BulkIngestor = open_target, TimedIngestor
+        try:
+            await db[config.COLLECTION_MESSAGES].create_index([("waId", 1), ("timestamps.whatsapp", -1), ("_id", -1)])
+            started = time.perf_counter()
+            stats = await ingest_payloads.ingest_stream(archive, batch_size=args.batch_size, workers=0)
+            elapsed = time.perf_counter() - started
+        finally:
+            ingest_payloads.open_target, ingest_payloads.BulkIngestor = originals
+    # Latencies are per flushed batch; throughput counts payloads
+    result = summarize(flushes, elapsed, operations=payloads)
+    result["batch_size"] = args.batch_size
+    result["docs_per_second"] = stats.as_dict()["docs_per_second"]
+    result["messages_upserted"] = stats.messages_upserted
+    result["statuses_applied"] = stats.statuses_applied
+    result["db_calls"] = {name: dict(calls) for name, calls in db.calls().items()}
+    return result
+
+
+RUNNERS = {
+    "conversations": bench_conversations,
+    "messages": bench_messages,
+    "post_messages": bench_post_messages,
+    "ws_fanout": bench_ws_fanout,
+    "ingest": bench_ingest,
+}
+
+
+# ===== Runner =====
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    dataset = Dataset(args.messages, args.wa_ids, args.skew, args.seed)
+    client = MemoryClient(args.db_latency_ms)
+    db = client[config.DATABASE_NAME]
+    seed_seconds = dataset.seed_into(db)
+
+    async def connect() -> None:
+        await db_module.init_database(client, db)
+
+    app_main.connect_to_mongo = connect
+    # Results are JSON lines on stdout; keep request logging out of the measurement
+    access_log.enabled = False
+    if not args.read_cache:
+        read_cache.ttl_seconds = 0
+
+    results: List[Dict[str, Any]] = []
+    async with running(app_main.app):
+        for name in args.scenarios:
+            before = db.calls()
+            result = await RUNNERS[name](app_main.app, dataset, args)
+            result.setdefault("db_calls", call_counts(db, before))
+            result = {"scenario": name, **result}
+            print(json.dumps(result), flush=True)
+            results.append(result)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "messages": args.messages,
+            "wa_ids": args.wa_ids,
+            "skew": args.skew,
+            "seed": args.seed,
+            "seed_seconds": round(seed_seconds, 3),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "db_latency_ms": args.db_latency_ms,
+            "read_cache": args.read_cache,
+        },
+        "results": results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-scenario change against ``baseline``; ratios above 1 mean faster."""
+    previous = {r["scenario"]: r for r in baseline.get("results", [])}
+    rows = []
+    for result in report["results"]:
+        old = previous.get(result["scenario"])
+        if old is None:
+            continue
+        row: Dict[str, Any] = {"scenario": result["scenario"]}
+        if old["throughput_per_second"]:
+            row["throughput_ratio"] = round(result["throughput_per_second"] / old["throughput_per_second"], 3)
+        for pct in ("p50", "p99"):
+            if result["latency_ms"][pct]:
+                row[f"{pct}_ratio"] = round(old["latency_ms"][pct] / result["latency_ms"][pct], 3)
+        rows.append(row)
+    return rows
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=parse_count, default=parse_count("10k"), help="Seeded messages (10k .. 10m)")
+    parser.add_argument("--wa-ids", type=parse_count, default=200, help="Conversations the messages are spread over")
+    parser.add_argument("--skew", type=float, default=1.0, help="1 spreads evenly; larger values favour a few waIds")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=parse_count, default=2000, help="Calls (or writes) per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients in HTTP scenarios")
+    parser.add_argument("--page-size", type=int, default=50, help="limit for GET /messages")
+    parser.add_argument("--sockets", type=parse_count, default=1000, help="Subscribed sockets for ws_fanout")
+    parser.add_argument("--ingest-payloads", type=parse_count, default=parse_count("20k"))
+    parser.add_argument("--batch-size", type=int, default=500, help="BulkIngestor batch size for ingest")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Simulated round trip per database call")
+    parser.add_argument("--read-cache", action="store_true", help="Keep the read cache on (READ_CACHE_TTL_SECONDS)")
+    parser.add_argument("--output", type=Path, help="Write the whole run as JSON")
+    parser.add_argument("--baseline", type=Path, help="Earlier --output to compare against")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.baseline is not None:
+        report["comparison"] = compare(report, json.loads(args.baseline.read_text()))
+        for row in report["comparison"]:
+            print(json.dumps({"compare": row}))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
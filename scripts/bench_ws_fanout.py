@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Fan-out microbenchmark for WebSocketManager with simulated connections.
+
+Each fake socket subscribes to one waId topic (a few also follow the
+conversation list). Writes are spread over all waIds and the benchmark
+compares the legacy send-to-everyone broadcast with topic-based delivery.
+``broadcast_us`` is what a request handler pays; ``delivered_ms`` is the time
+until every writer task has drained its queue.
+
+    python scripts/bench_ws_fanout.py --connections 10000 --writes 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+from app.ws import CONVERSATIONS_TOPIC, WebSocketManager, topics_for, wa_topic
+
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def accept(self) -> None:
+        return None
+
+    async def send_text(self, data: str) -> None:
+        self.sent += 1
+
+
+async def run(connections: int, wa_ids: int, list_watchers: int, writes: int, topic_based: bool) -> dict:
+    manager = WebSocketManager(queue_size=writes)
+    sockets = [FakeSocket() for _ in range(connections)]
+    for i, sock in enumerate(sockets):
+        await manager.connect(sock)
+        topics = [wa_topic(f"91{i % wa_ids:010d}")]
+        if i < list_watchers:
+            topics.append(CONVERSATIONS_TOPIC)
+        manager.subscribe(sock, topics)
+
+    message = {"v": 2, "type": "message.inserted", "waId": None, "data": {"_id": "bench", "text": "x" * 64}}
+    t0 = time.perf_counter()
+    for n in range(writes):
+        wa_id = f"91{n % wa_ids:010d}"
+        await manager.broadcast(message, topics=topics_for(wa_id) if topic_based else None)
+    elapsed = time.perf_counter() - t0
+    # broadcast only enqueues; delivery happens in the per-connection writers
+    await manager.drain()
+    delivered = time.perf_counter() - t0
+    sends = sum(s.sent for s in sockets)
+    for sock in sockets:
+        manager.disconnect(sock)
+    return {
+        "mode": "topics" if topic_based else "global",
+        "connections": connections,
+        "writes": writes,
+        "sends": sends,
+        "sends_per_write": round(sends / writes, 1),
+        "broadcast_us": round(elapsed / writes * 1e6, 1),
+        "delivered_ms": round(delivered * 1000, 1),
+        "dropped": manager.stats()["dropped"] + manager.stats()["coalesced"],
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10_000)
+    parser.add_argument("--wa-ids", type=int, default=2_000)
+    parser.add_argument("--list-watchers", type=int, default=100)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    for topic_based in (False, True):
+        result = await run(args.connections, args.wa_ids, args.list_watchers, args.writes, topic_based)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,208 +1,324 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import argparse
 import asyncio
 import json
 import os
 import sys
+import time
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import orjson
 
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 
-# Allow importing backend app config if needed
+# The backend app provides the config and the whole write path
 ROOT = Path(__file__).resolve().parents[1]
 BACKEND_PATH = ROOT / "backend"
 if str(BACKEND_PATH) not in sys.path:
     sys.path.insert(0, str(BACKEND_PATH))
 
-try:
-    from app.config import MONGODB_URI, DATABASE_NAME, COLLECTION_MESSAGES
-except Exception:
-    load_dotenv(ROOT / ".env")
-    load_dotenv(ROOT / ".env.example")
-    MONGODB_URI = os.environ.get("MONGODB_URI") or ""
-    DATABASE_NAME = "whatsapp"
-    COLLECTION_MESSAGES = "processed_messages"
-
-
-STATUS_ORDER = {"sent": 1, "delivered": 2, "read": 3}
+# app.config reads .env from the working directory; also find the repo's
+load_dotenv(ROOT / ".env")
 
-
-def promote_status(current: Optional[str], new: Optional[str]) -> Optional[str]:
-    if new is None:
-        return current
-    if current is None:
-        return new
-    if STATUS_ORDER.get(new, 0) > STATUS_ORDER.get(current, 0):
-        return new
-    return current
-
-
-@dataclass
-class IngestStats:
-    files_read: int = 0
-    messages_upserted: int = 0
-    statuses_applied: int = 0
-    status_skipped_missing_message: int = 0
+try:
+    from app.config import (
+        MONGODB_URI,
+        DATABASE_NAME,
+        COLLECTION_MESSAGES,
+        COLLECTION_CONVERSATIONS,
+        COLLECTION_CHANGES,
+        COLLECTION_COUNTERS,
+        COLLECTION_PENDING_STATUSES,
+        COLLECTION_INGEST_CHECKPOINTS,
+        WS_BACKPLANE,
+    )
+    from app.backplane import Backplane, create_backplane
+    from app.changes import Change, ChangeLog
+    from app.dedup import DedupCache, record_key
+    from app.deltas import delta_frames
+    from app.ingest import (
+        BulkIngestor,
+        IngestStats,
+        OnFlush,
+        Record,
+        extract_message_doc,
+        extract_records,
+        extract_status_updates,
+        find_value_block,
+        is_message_payload,
+        is_status_payload,
+        upsert_message,
+    )
+    from app.pending import PendingStatusBuffer
+    from app.statuses import apply_status
+    from app.ws import RESYNC_FRAME, topics_for
+except ImportError as exc:
+    # Ingestion shares the API's write path, so there is no standalone fallback
+    raise SystemExit(
+        f"ingest_payloads.py needs the backend app ({exc}); run `pip install -r backend/requirements.txt`"
+    ) from exc
 
 
-def find_value_block(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+def load_payload(file_path: Path) -> Optional[Dict[str, Any]]:
     try:
-        entry = payload["metaData"]["entry"][0]
-        change = entry["changes"][0]
-        return change["value"]
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
     except Exception:
         return None
 
 
-def is_message_payload(value: Dict[str, Any]) -> bool:
-    return "messages" in value and isinstance(value.get("messages"), list)
+@dataclass
+class IngestTarget:
+    client: Any
+    collection: Any
+    conversations: Any
+    changelog: ChangeLog
+    pending: PendingStatusBuffer
+    dedup: DedupCache
+    checkpoints: Any
+    # Set when the API runs a cross-process backplane (WS_BACKPLANE=unix)
+    backplane: Optional[Backplane] = None
+
+
+async def open_target(bloom_capacity: Optional[int] = None) -> IngestTarget:
+    if not MONGODB_URI:
+        raise RuntimeError("MONGODB_URI is not set. Define it in .env before running ingestion.")
 
+    client = AsyncIOMotorClient(MONGODB_URI)
+    db = client[DATABASE_NAME]
+    pending = PendingStatusBuffer(db[COLLECTION_PENDING_STATUSES])
+    await pending.load()
+    backplane: Optional[Backplane] = None
+    if WS_BACKPLANE != "local":
+        # Join as a publish-only peer so API workers hear about our writes
+        backplane = create_backplane()
+        await backplane.start(lambda data, topics: None)
+    return IngestTarget(
+        client=client,
+        collection=db[COLLECTION_MESSAGES],
+        conversations=db[COLLECTION_CONVERSATIONS],
+        changelog=ChangeLog(db[COLLECTION_CHANGES], db[COLLECTION_COUNTERS]),
+        pending=pending,
+        dedup=DedupCache(bloom_capacity=bloom_capacity),
+        checkpoints=db[COLLECTION_INGEST_CHECKPOINTS],
+        backplane=backplane,
+    )
 
-def is_status_payload(value: Dict[str, Any]) -> bool:
-    return "statuses" in value and isinstance(value.get("statuses"), list)
 
+async def close_target(target: IngestTarget) -> None:
+    if target.backplane is not None:
+        await target.backplane.stop()
+    target.client.close()
 
-def extract_message_doc(value: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    try:
-        msg = value["messages"][0]
-        metadata = value.get("metadata", {})
-        contacts = value.get("contacts", [])
-        contact = contacts[0] if contacts else {}
-        business_phone = metadata.get("display_phone_number")
-
-        msg_id = msg.get("id")
-        msg_from = msg.get("from")
-        msg_type = msg.get("type")
-        text = (msg.get("text") or {}).get("body")
-        wa_id = None
-        direction = None
-
-        if business_phone and msg_from == business_phone:
-            # outbound
-            direction = "outbound"
-            wa_id = contact.get("wa_id") or None
-        else:
-            # inbound
-            direction = "inbound"
-            wa_id = msg_from
-
-        timestamps = {
-            "whatsapp": int(msg.get("timestamp", 0) or 0),
-            "sent": None,
-            "delivered": None,
-            "read": None,
-        }
-
-        status = "sent" if direction == "outbound" else "read"
-        if direction == "inbound":
-            timestamps["read"] = timestamps["whatsapp"]
-
-        doc = {
-            "_id": msg_id,
-            "waId": wa_id,
-            "name": (contact.get("profile") or {}).get("name"),
-            "direction": direction,
-            "text": text,
-            "type": msg_type,
-            "status": status,
-            "timestamps": timestamps,
-            "businessPhone": business_phone,
-            "phoneNumberId": metadata.get("phone_number_id"),
-            "conversationId": None,
-            "gsId": None,
-            "metaMsgId": None,
-        }
-        return doc
-    except Exception:
-        return None
 
+# Larger batches (bulk backfills) are announced with one resync instead of
+# a delta per change, so live clients are not flooded
+MAX_DELTAS_PER_BATCH = 100
+# Pending-status keys looked up per message query in reconcile_pending
+RECONCILE_BATCH_SIZE = 1000
 
-def extract_status_updates(value: Dict[str, Any]) -> List[Dict[str, Any]]:
-    updates: List[Dict[str, Any]] = []
-    for st in value.get("statuses", []) or []:
-        try:
-            updates.append(
-                {
-                    "id": st.get("id"),
-                    "meta_msg_id": st.get("meta_msg_id"),
-                    "status": st.get("status"),
-                    "timestamp": int(st.get("timestamp", 0) or 0),
-                    "conversationId": (st.get("conversation") or {}).get("id"),
-                    "gsId": st.get("gs_id"),
-                    "recipient_id": st.get("recipient_id"),
-                }
-            )
-        except Exception:
-            continue
-    return updates
-
-
-async def upsert_message(collection, doc: Dict[str, Any]) -> bool:
-    if not doc or not doc.get("_id"):
-        return False
-    await collection.update_one(
-        {"_id": doc["_id"]},
-        {
-            "$setOnInsert": doc,
-        },
-        upsert=True,
-    )
-    return True
 
+def notifier(target: IngestTarget) -> Optional[OnFlush]:
+    """on_flush hook publishing written changes to running API workers.
 
-async def apply_status(collection, update: Dict[str, Any]) -> Optional[bool]:
-    message_id = update.get("id") or update.get("meta_msg_id")
-    if not message_id:
+    A batch of up to MAX_DELTAS_PER_BATCH changes goes out as delta events
+    (see app.deltas), which clients apply without a refetch. A larger one
+    is a single resync event on the topics of every waId in it, making
+    subscribed clients catch up through /sync. Either way the workers'
+    read caches drop those entries. Without a backplane the caches simply
+    expire (READ_CACHE_TTL_SECONDS).
+    """
+    backplane = target.backplane
+    if backplane is None:
         return None
 
-    # Fetch current to compute promotion and merge timestamps
-    doc = await collection.find_one({"_id": message_id})
-    if not doc:
-        return False  # skip if message not present
-
-    current_status = doc.get("status")
-    new_status = promote_status(current_status, update.get("status"))
-    timestamps = doc.get("timestamps") or {}
-
-    ts_field = update.get("status")
-    if ts_field in ("sent", "delivered", "read"):
-        timestamps[ts_field] = update.get("timestamp")
-
-    await collection.update_one(
-        {"_id": message_id},
-        {
-            "$set": {
-                "status": new_status,
-                "timestamps": timestamps,
-                "conversationId": update.get("conversationId") or doc.get("conversationId"),
-                "gsId": update.get("gsId") or doc.get("gsId"),
-                "metaMsgId": update.get("meta_msg_id") or doc.get("metaMsgId"),
-            }
-        },
+    async def notify(changes: List[Change]) -> None:
+        if len(changes) <= MAX_DELTAS_PER_BATCH:
+            for data, topics in delta_frames(changes):
+                await backplane.publish(data, topics)
+            return
+        topics = sorted({topic for _, wa_id, _ in changes for topic in topics_for(wa_id)})
+        if topics:
+            await backplane.publish(RESYNC_FRAME, topics)
+
+    return notify
+
+
+async def reconcile_pending(target: IngestTarget, stats: IngestStats) -> None:
+    """Apply persisted statuses whose message has been inserted meanwhile.
+
+    With ``--shards`` a status and its message can land in different
+    processes. Every shard runs this after persisting its own leftovers, so
+    whichever finishes last sees both sides. The overflow collection is
+    walked RECONCILE_BATCH_SIZE rows at a time, so neither the keys nor the
+    ``$in`` lookup for them grow with the backlog (a single ``distinct``
+    could exceed the 16 MB document limit).
+    """
+    overflow = target.pending.overflow
+    if overflow is None:
+        return
+    bulk = BulkIngestor(
+        target.collection,
+        target.conversations,
+        target.changelog,
+        stats=stats,
+        pending=target.pending,
+        on_flush=notifier(target),
+    )
+    applied = False
+    keys: List[str] = []
+    cursor = overflow.find({}, {"keys": 1}).sort("_id", 1).batch_size(RECONCILE_BATCH_SIZE)
+    async for row in cursor:
+        keys.extend(row.get("keys") or ())
+        if len(keys) >= RECONCILE_BATCH_SIZE:
+            applied = await _reconcile_keys(target, bulk, keys) or applied
+            keys = []
+    if keys:
+        applied = await _reconcile_keys(target, bulk, keys) or applied
+    if applied:
+        await target.pending.persist()
+
+
+async def _reconcile_keys(target: IngestTarget, bulk: BulkIngestor, keys: List[str]) -> bool:
+    """Apply the pending statuses of those ``keys`` whose message exists."""
+    unique = list(dict.fromkeys(keys))
+    existing = [doc["_id"] async for doc in target.collection.find({"_id": {"$in": unique}}, {"_id": 1})]
+    if existing:
+        # Removes the matched rows, which the overflow cursor then skips
+        await bulk.apply_pending(existing)
+    return bool(existing)
+
+
+async def finish_target(target: IngestTarget, stats: IngestStats) -> None:
+    # Whatever is still waiting survives in the overflow collection until
+    # a later run (or the webhook) inserts the message, or the TTL expires
+    await target.pending.persist()
+    await reconcile_pending(target, stats)
+    stats.statuses_recovered += target.pending.hits
+    stats.pending = target.pending.stats()
+    stats.dedup = target.dedup.stats()
+
+
+def shard_of(key: bytes, shards: int) -> int:
+    """Stable shard number for a file name or NDJSON line."""
+    return zlib.crc32(key) % shards
+
+
+def list_files(dir_path: Path, shards: int = 1, shard_index: int = 0, after: Optional[str] = None) -> List[Path]:
+    """This shard's ``*.json`` files in sorted order, optionally only those after ``after``.
+
+    Files are assigned by a hash of their name, so every process of a
+    sharded run agrees on the split, also when files are added later.
+    """
+    return [
+        p
+        for p in sorted(dir_path.glob("*.json"))
+        if shard_of(p.name.encode("utf-8"), shards) == shard_index and (after is None or p.name > after)
+    ]
+
+
+class Checkpoint:
+    """Progress of one (path, shard) run, kept in COLLECTION_INGEST_CHECKPOINTS.
+
+    ``position`` is the last fully written file name (``{"file": ...}``) or
+    the byte offset after the last fully written NDJSON line
+    (``{"offset": ...}``); the stats so far are stored next to it. Saves are
+    rate-limited to one per ``interval`` seconds.
+    """
+
+    def __init__(self, collection, path: Path, shards: int = 1, shard_index: int = 0, interval: float = 5.0) -> None:
+        self.collection = collection
+        self.key = f"{path.resolve()}#{shard_index}/{shards}"
+        self.interval = interval
+        self._saved_at = time.monotonic()
+
+    async def load(self) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": self.key})
+
+    def due(self) -> bool:
+        return time.monotonic() - self._saved_at >= self.interval
+
+    async def save(self, position: Dict[str, Any], stats: IngestStats, done: bool = False) -> None:
+        await self.collection.replace_one(
+            {"_id": self.key},
+            {"position": position, "stats": stats.as_dict(), "done": done, "updatedAt": time.time()},
+            upsert=True,
+        )
+        self._saved_at = time.monotonic()
+
+
+async def start_run(
+    target: IngestTarget, path: Path, resume: bool, shards: int, shard_index: int, interval: float
+) -> Tuple[Checkpoint, IngestStats, Optional[Dict[str, Any]]]:
+    """Checkpoint for this run plus the stats and position to continue from."""
+    checkpoint = Checkpoint(target.checkpoints, path, shards, shard_index, interval)
+    saved = await checkpoint.load() if resume else None
+    if saved is None:
+        return checkpoint, IngestStats(), None
+    return checkpoint, IngestStats.from_dict(saved.get("stats") or {}), saved.get("position")
+
+
+async def save_progress(
+    checkpoint: Checkpoint, target: IngestTarget, position: Dict[str, Any], stats: IngestStats, elapsed: float
+) -> None:
+    # Statuses from completed input must not live only in this process
+    await target.pending.persist()
+    stats.elapsed_seconds = elapsed
+    await checkpoint.save(position, stats)
+
+
+async def ingest_directory(
+    dir_path: Path,
+    batch_size: int = 0,
+    bloom_capacity: Optional[int] = None,
+    resume: bool = False,
+    shards: int = 1,
+    shard_index: int = 0,
+    checkpoint_seconds: float = 5.0,
+) -> IngestStats:
+    """Ingest every ``*.json`` payload in ``dir_path`` in sorted order.
+
+    ``batch_size`` > 0 uses BulkIngestor; 0 writes one document at a time.
+    Replayed records are skipped by the dedup cache either way. Progress is
+    checkpointed after fully written files; ``resume`` continues from there.
+    """
+    target = await open_target(bloom_capacity)
+    checkpoint, stats, position = await start_run(
+        target, dir_path, resume, shards, shard_index, checkpoint_seconds
+    )
+    collection, conversations, changelog, pending, dedup = (
+        target.collection,
+        target.conversations,
+        target.changelog,
+        target.pending,
+        target.dedup,
+    )
+    notify = notifier(target)
+    bulk = (
+        BulkIngestor(collection, conversations, changelog, batch_size, stats, pending, on_flush=notify, dedup=dedup)
+        if batch_size > 0
+        else None
     )
-    return True
-
-
-async def ingest_directory(dir_path: Path) -> IngestStats:
-    stats = IngestStats()
-
-    if not MONGODB_URI:
-        raise RuntimeError("MONGODB_URI is not set. Define it in .env before running ingestion.")
-
-    client = AsyncIOMotorClient(MONGODB_URI)
-    collection = client[DATABASE_NAME][COLLECTION_MESSAGES]
 
-    json_files = sorted([p for p in dir_path.glob("*.json")])
-    for file_path in json_files:
+    started = time.perf_counter() - stats.elapsed_seconds
+    last_file = (position or {}).get("file")
+    for file_path in list_files(dir_path, shards, shard_index, last_file):
+        if checkpoint.due():
+            if bulk is not None:
+                await bulk.flush()
+            if last_file is not None:
+                await save_progress(checkpoint, target, {"file": last_file}, stats, time.perf_counter() - started)
+        last_file = file_path.name
         stats.files_read += 1
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                payload = json.load(f)
-        except Exception:
+        payload = load_payload(file_path)
+        if payload is None:
             continue
 
         value = find_value_block(payload)
@@ -211,42 +327,269 @@ async def ingest_directory(dir_path: Path) -> IngestStats:
 
         if is_message_payload(value):
             doc = extract_message_doc(value)
-            if doc and await upsert_message(collection, doc):
+            if bulk is not None:
+                await bulk.add_message(doc)
+            elif doc and dedup.seen(record_key("message", doc)):
+                stats.duplicates_skipped += 1
+            elif doc and await upsert_message(collection, doc, conversations, changelog, pending, notify):
                 stats.messages_upserted += 1
 
         if is_status_payload(value):
             for upd in extract_status_updates(value):
-                res = await apply_status(collection, upd)
+                if bulk is not None:
+                    await bulk.add_status(upd)
+                    continue
+                if dedup.seen(record_key("status", upd)):
+                    stats.duplicates_skipped += 1
+                    continue
+                res = await apply_status(collection, upd, conversations, changelog, notify)
                 if res is True:
                     stats.statuses_applied += 1
                 elif res is False:
-                    stats.status_skipped_missing_message += 1
+                    await pending.add(upd)
+                    stats.statuses_buffered += 1
+
+    if bulk is not None:
+        await bulk.flush()
+    else:
+        # The batch path counts these itself when it applies them
+        stats.statuses_applied += pending.hits
+    await finish_target(target, stats)
+    stats.elapsed_seconds = time.perf_counter() - started
+    await checkpoint.save({"file": last_file}, stats, done=True)
+    await close_target(target)
+    return stats
+
 
-    client.close()
+# ===== Streaming front-end =====
+
+
+def parse_chunk(items: List[Union[str, bytes]]) -> Tuple[int, List[Record]]:
+    """Parse a chunk of file paths (str) or NDJSON lines (bytes).
+
+    Runs in a worker process; returns the error count and the records in
+    input order.
+    """
+    errors = 0
+    records: List[Record] = []
+    for item in items:
+        try:
+            raw = Path(item).read_bytes() if isinstance(item, str) else item
+            payload = orjson.loads(raw)
+        except Exception:
+            errors += 1
+            continue
+        records.extend(extract_records(payload))
+    return errors, records
+
+
+Chunk = Tuple[str, List[Union[str, bytes]], Dict[str, Any]]
+
+
+def iter_chunks(
+    path: Path,
+    chunk_size: int,
+    shards: int = 1,
+    shard_index: int = 0,
+    start: Optional[Dict[str, Any]] = None,
+) -> Iterator[Chunk]:
+    """Yield ("files", paths, position) for a directory or ("lines", lines,
+    position) for NDJSON, where ``position`` is the checkpoint after the chunk.
+
+    ``start`` is a position from an earlier run; NDJSON lines are assigned
+    to shards by a hash of their content.
+    """
+    start = start or {}
+    if path.is_dir():
+        files = list_files(path, shards, shard_index, start.get("file"))
+        for i in range(0, len(files), chunk_size):
+            batch = files[i : i + chunk_size]
+            yield "files", [str(p) for p in batch], {"file": batch[-1].name}
+        return
+    offset = start.get("offset", 0)
+    chunk: List[Union[str, bytes]] = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            offset += len(raw)
+            line = raw.strip()
+            if not line or (shards > 1 and shard_of(line, shards) != shard_index):
+                continue
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield "lines", chunk, {"offset": offset}
+                chunk = []
+    if chunk:
+        yield "lines", chunk, {"offset": offset}
+
+
+async def ingest_stream(
+    path: Path,
+    batch_size: int = 500,
+    workers: Optional[int] = None,
+    chunk_size: int = 256,
+    max_chunks_in_flight: Optional[int] = None,
+    bloom_capacity: Optional[int] = None,
+    resume: bool = False,
+    shards: int = 1,
+    shard_index: int = 0,
+    checkpoint_seconds: float = 5.0,
+) -> IngestStats:
+    """Ingest a directory of ``*.json`` files or an NDJSON archive.
+
+    Chunks are parsed with orjson in a process pool (``workers=0`` parses
+    in-process) while earlier chunks are being written, and results are
+    consumed in input order through a bounded queue. At most
+    ``max_chunks_in_flight`` chunks are read ahead, so memory stays flat
+    however large the archive is. Every ``checkpoint_seconds`` the batch is
+    flushed at a chunk boundary and the position saved for ``resume``.
+    """
+    target = await open_target(bloom_capacity)
+    checkpoint, stats, position = await start_run(target, path, resume, shards, shard_index, checkpoint_seconds)
+    bulk = BulkIngestor(
+        target.collection,
+        target.conversations,
+        target.changelog,
+        max(1, batch_size),
+        stats,
+        target.pending,
+        on_flush=notifier(target),
+        dedup=target.dedup,
+    )
+    loop = asyncio.get_running_loop()
+    n_workers = workers if workers is not None else (os.cpu_count() or 1)
+    pool: Optional[Executor] = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 0 else None
+    in_flight = max_chunks_in_flight or 2 * max(1, n_workers)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=in_flight)
+
+    async def produce() -> None:
+        chunks = iter_chunks(path, chunk_size, shards, shard_index, position)
+        try:
+            while True:
+                # File listing and line reads stay off the event loop thread
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                kind, items, end = chunk
+                if pool is not None:
+                    parsed = loop.run_in_executor(pool, parse_chunk, items)
+                else:
+                    parsed = loop.create_future()
+                    parsed.set_result(parse_chunk(items))
+                await queue.put((kind, len(items), end, parsed))
+        finally:
+            await queue.put(None)
+
+    last = position or {}
+
+    async def consume() -> None:
+        nonlocal last
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            kind, count, end, parsed = item
+            errors, records = await parsed
+            if kind == "files":
+                stats.files_read += count
+            else:
+                stats.lines_read += count
+            stats.parse_errors += errors
+            for record_kind, data in records:
+                if record_kind == "message":
+                    await bulk.add_message(data)
+                else:
+                    await bulk.add_status(data)
+            last = end
+            if checkpoint.due():
+                await bulk.flush()
+                await save_progress(checkpoint, target, last, stats, time.perf_counter() - started)
+
+    started = time.perf_counter() - stats.elapsed_seconds
+    producer = asyncio.create_task(produce())
+    try:
+        await consume()
+        await producer
+        await bulk.flush()
+        await finish_target(target, stats)
+        stats.elapsed_seconds = time.perf_counter() - started
+        await checkpoint.save(last, stats, done=True)
+    finally:
+        if not producer.done():
+            producer.cancel()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        await close_target(target)
     return stats
 
 
-async def main() -> None:
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     # Default directory with spaces matches provided folder name
     default_dir = ROOT / "whatsapp sample payloads"
-    dir_str = os.environ.get("INGEST_DIR", str(default_dir))
-    dir_path = Path(dir_str)
-
-    if not dir_path.exists():
-        raise FileNotFoundError(f"Payload directory not found: {dir_path}")
-
-    stats = await ingest_directory(dir_path)
-    print(
-        json.dumps(
-            {
-                "files_read": stats.files_read,
-                "messages_upserted": stats.messages_upserted,
-                "statuses_applied": stats.statuses_applied,
-                "status_skipped_missing_message": stats.status_skipped_missing_message,
-            },
-            indent=2,
-        )
+    parser = argparse.ArgumentParser(description="Ingest WhatsApp webhook payloads into MongoDB.")
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default=os.environ.get("INGEST_DIR", str(default_dir)),
+        help="Directory of *.json payloads or an NDJSON file with one payload per line",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.environ.get("INGEST_BATCH_SIZE", "500")),
+        help="Documents per bulk_write flush; 0 writes one document at a time (directories only)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Parser processes (default: CPU count, 0 parses in-process)",
+    )
+    parser.add_argument("--chunk-size", type=int, default=256, help="Files or lines per parse task")
+    parser.add_argument(
+        "--bloom-capacity",
+        type=int,
+        default=None,
+        help="Also remember keys beyond the exact dedup window in a Bloom filter of this size "
+        "(default: DEDUP_BLOOM_CAPACITY, 0 disables)",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last checkpoint of this path and shard instead of starting over",
+    )
+    parser.add_argument("--shards", type=int, default=1, help="Number of processes splitting the input")
+    parser.add_argument("--shard-index", type=int, default=0, help="Which shard (0-based) this process ingests")
+    parser.add_argument(
+        "--checkpoint-seconds", type=float, default=5.0, help="Minimum time between progress checkpoints"
+    )
+    args = parser.parse_args(argv)
+    if args.shards < 1 or not 0 <= args.shard_index < args.shards:
+        parser.error("--shard-index must be in [0, --shards)")
+    return args
+
+
+async def main() -> None:
+    args = parse_args()
+    path = Path(args.path)
+
+    if not path.exists():
+        raise FileNotFoundError(f"Payload path not found: {path}")
+
+    run = dict(
+        bloom_capacity=args.bloom_capacity,
+        resume=args.resume,
+        shards=args.shards,
+        shard_index=args.shard_index,
+        checkpoint_seconds=args.checkpoint_seconds,
+    )
+    if args.batch_size == 0 and path.is_dir():
+        stats = await ingest_directory(path, batch_size=0, **run)
+    else:
+        stats = await ingest_stream(
+            path, batch_size=args.batch_size or 500, workers=args.workers, chunk_size=args.chunk_size, **run
+        )
+    print(json.dumps(stats.as_dict(), indent=2))
 
 
 if __name__ == "__main__":
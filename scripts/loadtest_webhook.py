@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Load test for POST /webhook against a running API.
+
+Sends synthetic message payloads, each followed by a "delivered" status for
+it, over keep-alive HTTP/1.1 connections and reports acknowledgement
+throughput and latency. ``--per-request N`` posts JSON arrays of N payloads,
+as batching providers do. The server's /webhook/stats (batch sizes, write
+throughput, queue rejections) is printed afterwards when ``--ops-token`` (or
+OPS_TOKEN) matches the server's. Bodies are signed with ``--app-secret`` (or
+WEBHOOK_APP_SECRET), which must match the server's.
+
+    python scripts/loadtest_webhook.py --url http://localhost:8000 --payloads 20000 --connections 64
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+BUSINESS_PHONE = "918329446654"
+
+
+def message_payload(message_id: str, wa_id: str, ts: int) -> dict:
+    return {
+        "payload_type": "whatsapp_webhook",
+        "metaData": {
+            "entry": [
+                {
+                    "changes": [
+                        {
+                            "field": "messages",
+                            "value": {
+                                "contacts": [{"profile": {"name": f"Load {wa_id}"}, "wa_id": wa_id}],
+                                "messages": [
+                                    {
+                                        "from": wa_id,
+                                        "id": message_id,
+                                        "timestamp": str(ts),
+                                        "text": {"body": "load test"},
+                                        "type": "text",
+                                    }
+                                ],
+                                "messaging_product": "whatsapp",
+                                "metadata": {
+                                    "display_phone_number": BUSINESS_PHONE,
+                                    "phone_number_id": "629305560276479",
+                                },
+                            },
+                        }
+                    ]
+                }
+            ]
+        },
+    }
+
+
+def status_payload(message_id: str, wa_id: str, ts: int) -> dict:
+    return {
+        "payload_type": "whatsapp_webhook",
+        "metaData": {
+            "entry": [
+                {
+                    "changes": [
+                        {
+                            "field": "messages",
+                            "value": {
+                                "messaging_product": "whatsapp",
+                                "metadata": {"display_phone_number": BUSINESS_PHONE},
+                                "statuses": [
+                                    {
+                                        "id": message_id,
+                                        "meta_msg_id": message_id,
+                                        "recipient_id": wa_id,
+                                        "status": "delivered",
+                                        "timestamp": str(ts),
+                                    }
+                                ],
+                            },
+                        }
+                    ]
+                }
+            ]
+        },
+    }
+
+
+def build_bodies(count: int, wa_ids: int, per_request: int = 1) -> List[bytes]:
+    run = uuid.uuid4().hex[:8]
+    now = int(time.time())
+    payloads: List[dict] = []
+    for i in range(count // 2 or 1):
+        message_id = f"load-{run}-{i}"
+        wa_id = f"91{i % wa_ids:010d}"
+        payloads.append(message_payload(message_id, wa_id, now + i))
+        payloads.append(status_payload(message_id, wa_id, now + i + 1))
+    payloads = payloads[:count]
+    if per_request <= 1:
+        return [json.dumps(p).encode("utf-8") for p in payloads]
+    return [
+        json.dumps(payloads[i : i + per_request]).encode("utf-8") for i in range(0, len(payloads), per_request)
+    ]
+
+
+async def _request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    host: str,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    token: str = "",
+    signature: str = "",
+) -> Tuple[int, bytes]:
+    auth = f"Authorization: Bearer {token}\r\n" if token else ""
+    if signature:
+        auth += f"X-Hub-Signature-256: {signature}\r\n"
+    head = (
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"{auth}Content-Length: {len(body)}\r\n\r\n"
+    )
+    writer.write(head.encode("ascii") + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    return status, await reader.readexactly(length) if length else b""
+
+
+async def _worker(host: str, port: int, bodies: List[Tuple[bytes, str]], next_index: List[int], results: dict) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while next_index[0] < len(bodies):
+            body, signature = bodies[next_index[0]]
+            next_index[0] += 1
+            started = time.perf_counter()
+            try:
+                status, _ = await _request(reader, writer, host, "POST", "/webhook", body, signature=signature)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                results["errors"] += 1
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            results["latencies"].append(time.perf_counter() - started)
+            results["status"][status] = results["status"].get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(
+    url: str,
+    payloads: int,
+    connections: int,
+    wa_ids: int,
+    per_request: int = 1,
+    ops_token: str = "",
+    app_secret: str = "",
+) -> dict:
+    parts = urlsplit(url)
+    host = parts.hostname or "localhost"
+    port = parts.port or 80
+    bodies = [
+        (body, "sha256=" + hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest())
+        for body in build_bodies(payloads, wa_ids, per_request)
+    ]
+    results: dict = {"latencies": [], "status": {}, "errors": 0}
+    next_index = [0]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker(host, port, bodies, next_index, results) for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    server_stats: Optional[dict] = None
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        # Give the last partial batch time to flush before reading the counters
+        await asyncio.sleep(0.5)
+        status, body = await _request(reader, writer, host, "GET", "/webhook/stats", token=ops_token)
+        if status == 200:
+            server_stats = json.loads(body)
+    finally:
+        writer.close()
+
+    latencies = results["latencies"]
+    return {
+        "payloads": payloads,
+        "requests": len(bodies),
+        "connections": connections,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "payloads_per_second": round(payloads / elapsed, 1) if elapsed > 0 else 0.0,
+        "status_codes": results["status"],
+        "errors": results["errors"],
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p95": round(_percentile(latencies, 95) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0.0) * 1000, 2),
+        },
+        "server": server_stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--payloads", type=int, default=20_000)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--wa-ids", type=int, default=500)
+    parser.add_argument("--per-request", type=int, default=1)
+    parser.add_argument("--ops-token", default=os.getenv("OPS_TOKEN", ""), help="for /webhook/stats")
+    parser.add_argument("--app-secret", default=os.getenv("WEBHOOK_APP_SECRET", ""), help="signs the payloads")
+    args = parser.parse_args()
+    result = asyncio.run(
+        run(args.url, args.payloads, args.connections, args.wa_ids, args.per_request, args.ops_token, args.app_secret)
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
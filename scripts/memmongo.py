@@ -0,0 +1,1100 @@
+"""In-memory stand-in for the Motor collections the API and ingestion use.
+
+Covers the part of MongoDB this codebase relies on: queries with equality,
+comparison, ``$in``, ``$or`` and ``$type`` (array fields match per element),
+inclusion/exclusion projections, multi-key sorts, update documents and
+pipeline updates, ``bulk_write`` with pymongo's request classes, and the
+aggregation stages of the conversation rebuild (``$match``, ``$project``,
+``$sort``, ``$group``, ``$out``). Values compare in BSON type order, so a
+missing field sorts below any number, as the summary pipelines expect.
+
+Every call yields to the event loop once, or sleeps ``latency_ms`` to
+stand in for a network round trip, and is counted in ``calls``.
+``create_index`` builds a real index: equality on its first field narrows
+a query to that value's documents, kept sorted by the remaining fields so
+that a matching sort (``GET /messages``) reads only the page it returns.
+Unique indexes raise DuplicateKeyError; ``drop_index`` raises
+OperationFailure (code 27) for an index that does not exist. ``load``
+bulk-inserts seed data without copying it.
+
+    db = MemoryClient(latency_ms=0.5)["whatsapp"]
+    await db["processed_messages"].create_index([("waId", 1), ("timestamps.whatsapp", -1), ("_id", -1)])
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import datetime
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+Document = Dict[str, Any]
+SortSpec = List[Tuple[str, int]]
+
+_MISSING = object()
+
+
+# ---------------------------------------------------------------------------
+# Values
+
+
+def _get(doc: Any, path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+
+def _value(doc: Any, path: str) -> Any:
+    value = _get(doc, path)
+    return None if value is _MISSING else value
+
+
+def _set(doc: Document, path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        child = doc.get(part)
+        if not isinstance(child, dict):
+            child = doc[part] = {}
+        doc = child
+    doc[last] = value
+
+
+def _unset(doc: Document, path: str) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+def _copy(value: Any) -> Any:
+    # Documents only nest dicts and lists; much cheaper than copy.deepcopy
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _rank(value: Any) -> int:
+    """BSON comparison order of ``value``'s type."""
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    return 10
+
+
+def order_key(value: Any) -> Tuple:
+    """Sort key ordering any two values the way MongoDB does."""
+    rank = _rank(value)
+    if rank == 1:
+        return (1,)
+    if rank == 4:
+        return (4, tuple((k, order_key(v)) for k, v in value.items()))
+    if rank == 5:
+        return (5, tuple(order_key(v) for v in value))
+    if rank == 10:
+        return (10, repr(value))
+    return (rank, value)
+
+
+def _compare(a: Any, b: Any) -> int:
+    ka, kb = order_key(a), order_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def _hashable(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool, ObjectId, datetime.datetime))
+
+
+# ---------------------------------------------------------------------------
+# Queries
+
+_TYPE_ALIASES = {
+    "null": (1,),
+    "number": (2,),
+    "int": (2,),
+    "long": (2,),
+    "double": (2,),
+    "string": (3,),
+    "object": (4,),
+    "array": (5,),
+    "objectId": (7,),
+    "bool": (8,),
+    "date": (9,),
+}
+
+
+def _candidates(value: Any) -> List[Any]:
+    # A query on an array field matches the array itself or any element
+    if isinstance(value, list):
+        return [value, *value]
+    return [value]
+
+
+def _equals(value: Any, target: Any) -> bool:
+    if value is _MISSING:
+        return target is None
+    return any(_rank(v) == _rank(target) and v == target for v in _candidates(value))
+
+
+def _range(value: Any, target: Any, test: Callable[[int], bool]) -> bool:
+    if value is _MISSING:
+        return False
+    # Query comparisons only match within the same type bracket
+    return any(_rank(v) == _rank(target) and test(_compare(v, target)) for v in _candidates(value))
+
+
+def _match_operator(value: Any, op: str, arg: Any) -> bool:
+    if op == "$eq":
+        return _equals(value, arg)
+    if op == "$ne":
+        return not _equals(value, arg)
+    if op == "$gt":
+        return _range(value, arg, lambda c: c > 0)
+    if op == "$gte":
+        return _range(value, arg, lambda c: c >= 0)
+    if op == "$lt":
+        return _range(value, arg, lambda c: c < 0)
+    if op == "$lte":
+        return _range(value, arg, lambda c: c <= 0)
+    if op == "$in":
+        return any(_equals(value, a) for a in arg)
+    if op == "$nin":
+        return not any(_equals(value, a) for a in arg)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if op == "$type":
+        if value is _MISSING:
+            return False
+        names = arg if isinstance(arg, list) else [arg]
+        ranks = {r for name in names for r in _TYPE_ALIASES.get(name, ())}
+        return any(_rank(v) in ranks for v in _candidates(value))
+    if op == "$not":
+        return not _match_value(value, arg)
+    raise OperationFailure(f"unknown query operator {op}")
+
+
+def _match_value(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return all(_match_operator(value, op, arg) for op, arg in condition.items())
+    return _equals(value, condition)
+
+
+def matches(doc: Document, query: Optional[Document]) -> bool:
+    """True if ``doc`` satisfies the query document ``query``."""
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, q) for q in condition):
+                return False
+        elif not _match_value(_get(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: Document, projection: Optional[Union[Document, Sequence[str]]]) -> Document:
+    """A copy of ``doc`` narrowed by an inclusion or exclusion projection."""
+    if not projection:
+        return _copy(doc)
+    if not isinstance(projection, dict):
+        projection = {field: 1 for field in projection}
+    include_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(not v for v in fields.values()):
+        out = _copy(doc)
+        for field in fields:
+            _unset(out, field)
+        if not include_id:
+            out.pop("_id", None)
+        return out
+    out: Document = {}
+    if include_id and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for field in fields:
+        value = _get(doc, field)
+        if value is not _MISSING:
+            _set(out, field, _copy(value))
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Aggregation expressions
+
+
+def evaluate(expr: Any, doc: Document) -> Any:
+    """Value of the aggregation expression ``expr`` for ``doc``."""
+    if isinstance(expr, str):
+        if expr.startswith("$$ROOT"):
+            return _value(doc, expr[7:]) if len(expr) > 6 else doc
+        if expr.startswith("$"):
+            return _value(doc, expr[1:])
+        return expr
+    if isinstance(expr, list):
+        return [evaluate(e, doc) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) == 1:
+        op, arg = next(iter(expr.items()))
+        if op.startswith("$"):
+            return _operator(op, arg, doc)
+    return {k: evaluate(v, doc) for k, v in expr.items()}
+
+
+def _args(arg: Any, doc: Document) -> List[Any]:
+    return [evaluate(a, doc) for a in (arg if isinstance(arg, list) else [arg])]
+
+
+def _operator(op: str, arg: Any, doc: Document) -> Any:
+    if op == "$literal":
+        return arg
+    if op == "$cond":
+        if isinstance(arg, dict):
+            arg = [arg["if"], arg["then"], arg["else"]]
+        return evaluate(arg[1] if _truthy(evaluate(arg[0], doc)) else arg[2], doc)
+    if op == "$switch":
+        for branch in arg["branches"]:
+            if _truthy(evaluate(branch["case"], doc)):
+                return evaluate(branch["then"], doc)
+        if "default" not in arg:
+            raise OperationFailure("$switch could not find a matching branch")
+        return evaluate(arg["default"], doc)
+    if op == "$ifNull":
+        values = _args(arg, doc)
+        return next((v for v in values[:-1] if v is not None), values[-1])
+    if op in ("$and", "$or", "$not"):
+        values = [_truthy(v) for v in _args(arg, doc)]
+        return all(values) if op == "$and" else any(values) if op == "$or" else not values[0]
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$cmp"):
+        a, b = _args(arg, doc)
+        c = _compare(a, b)
+        return {
+            "$eq": c == 0, "$ne": c != 0, "$gt": c > 0, "$gte": c >= 0, "$lt": c < 0, "$lte": c <= 0, "$cmp": c
+        }[op]
+    if op in ("$max", "$min"):
+        values = _args(arg, doc)
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        return _extreme(values, op == "$max")
+    if op in ("$add", "$sum"):
+        values = _args(arg, doc)
+        if op == "$sum" and len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        if op == "$add" and any(v is None for v in values):
+            return None
+        return sum(v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool))
+    if op == "$subtract":
+        a, b = _args(arg, doc)
+        return None if a is None or b is None else a - b
+    if op == "$multiply":
+        values = _args(arg, doc)
+        if any(v is None for v in values):
+            return None
+        product = 1
+        for v in values:
+            product *= v
+        return product
+    if op == "$concat":
+        values = _args(arg, doc)
+        return None if any(v is None for v in values) else "".join(values)
+    if op == "$in":
+        value, array = _args(arg, doc)
+        return any(_compare(value, v) == 0 for v in array)
+    if op == "$size":
+        return len(_args(arg, doc)[0])
+    if op == "$toString":
+        value = _args(arg, doc)[0]
+        return None if value is None else str(value)
+    if op == "$type":
+        value = _get(doc, arg[1:]) if isinstance(arg, str) and arg.startswith("$") else evaluate(arg, doc)
+        if value is _MISSING:
+            return "missing"
+        return {1: "null", 2: "double" if isinstance(value, float) else "int", 3: "string", 4: "object",
+                5: "array", 7: "objectId", 8: "bool", 9: "date"}.get(_rank(value), "unknown")
+    raise OperationFailure(f"unsupported expression operator {op}")
+
+
+def _truthy(value: Any) -> bool:
+    return value not in (None, False, 0) and value is not _MISSING
+
+
+def _extreme(values: Iterable[Any], largest: bool) -> Any:
+    # Like the accumulators, $max/$min ignore nulls and missing values
+    present = [v for v in values if v is not None and v is not _MISSING]
+    if not present:
+        return None
+    pick = max if largest else min
+    return pick(present, key=order_key)
+
+
+# ---------------------------------------------------------------------------
+# Updates
+
+
+def _apply_pipeline(doc: Document, pipeline: List[Document]) -> Document:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name in ("$set", "$addFields"):
+            # Every expression in a stage sees the document as it entered it
+            values = {field: evaluate(expr, doc) for field, expr in spec.items()}
+            for field, value in values.items():
+                _set(doc, field, _copy(value))
+        elif name in ("$unset", "$project") and (name == "$unset" or all(not v for v in spec.values())):
+            for field in [spec] if isinstance(spec, str) else list(spec):
+                _unset(doc, field)
+        elif name == "$replaceWith":
+            doc = _replacement(doc, evaluate(spec, doc))
+        else:
+            raise OperationFailure(f"unsupported update pipeline stage {name}")
+    return doc
+
+
+def _replacement(doc: Document, replacement: Document) -> Document:
+    out = {k: _copy(v) for k, v in replacement.items() if k != "_id"}
+    return {"_id": doc["_id"], **out} if "_id" in doc else out
+
+
+def apply_update(doc: Document, update: Union[Document, List[Document]], inserting: bool = False) -> Document:
+    """``doc`` after ``update`` (a pipeline, operator document or replacement)."""
+    if isinstance(update, list):
+        return _apply_pipeline(doc, update)
+    if not any(key.startswith("$") for key in update):
+        return _replacement(doc, update)
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for field, value in fields.items():
+                _set(doc, field, _copy(value))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for field in fields:
+                _unset(doc, field)
+        elif op == "$inc":
+            for field, amount in fields.items():
+                _set(doc, field, (_value(doc, field) or 0) + amount)
+        elif op in ("$max", "$min"):
+            for field, value in fields.items():
+                current = _get(doc, field)
+                if current is _MISSING or (_compare(value, current) > 0) == (op == "$max"):
+                    _set(doc, field, _copy(value))
+        elif op == "$push":
+            for field, value in fields.items():
+                items = _value(doc, field) or []
+                values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                _set(doc, field, [*items, *(_copy(v) for v in values)])
+        elif op == "$addToSet":
+            for field, value in fields.items():
+                items = list(_value(doc, field) or [])
+                for v in value["$each"] if isinstance(value, dict) and "$each" in value else [value]:
+                    if v not in items:
+                        items.append(_copy(v))
+                _set(doc, field, items)
+        else:
+            raise OperationFailure(f"unsupported update operator {op}")
+    return doc
+
+
+def _upsert_seed(query: Document) -> Document:
+    """The document an upsert starts from: the query's equality fields."""
+    doc: Document = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            if key == "$and":
+                for part in condition:
+                    doc.update(_upsert_seed(part))
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set(doc, key, _copy(condition["$eq"]))
+            continue
+        _set(doc, key, _copy(condition))
+    return doc
+
+
+# ---------------------------------------------------------------------------
+# Indexes
+
+
+def _normalize_keys(keys: Union[str, Sequence[Tuple[str, int]], Document]) -> SortSpec:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    if isinstance(keys, dict):
+        return list(keys.items())
+    return [(k, d) if not isinstance(d, str) else (k, 1) for k, d in keys]
+
+
+def _normalize_sort(key_or_list: Any, direction: Optional[int] = None) -> SortSpec:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [tuple(item) for item in key_or_list]
+
+
+class _Index:
+    """First-field value -> entries sorted by the remaining fields and _id.
+
+    Array values are indexed per element (multikey), like MongoDB does.
+    """
+
+    def __init__(self, name: str, keys: SortSpec, unique: bool, sparse: bool) -> None:
+        self.name = name
+        self.keys = keys
+        self.field = keys[0][0]
+        self.rest = [field for field, _ in keys[1:]]
+        self.unique = unique
+        self.sparse = sparse
+        self.buckets: Dict[Hashable, List[Tuple]] = {}
+
+    def values(self, doc: Document) -> List[Hashable]:
+        value = _get(doc, self.field)
+        if value is _MISSING:
+            return [] if self.sparse else [None]
+        values = value if isinstance(value, list) else [value]
+        return [v for v in values if _hashable(v)]
+
+    def entry(self, doc: Document) -> Tuple:
+        rest = tuple(order_key(_value(doc, field)) for field in self.rest)
+        return (rest, order_key(doc["_id"]), doc["_id"])
+
+    def add(self, doc: Document) -> None:
+        entry = self.entry(doc)
+        for value in self.values(doc):
+            bisect.insort(self.buckets.setdefault(value, []), entry)
+
+    def remove(self, doc: Document) -> None:
+        entry = self.entry(doc)
+        for value in self.values(doc):
+            bucket = self.buckets.get(value)
+            if not bucket:
+                continue
+            i = bisect.bisect_left(bucket, entry)
+            if i < len(bucket) and bucket[i] == entry:
+                del bucket[i]
+            if not bucket:
+                del self.buckets[value]
+
+    def unchanged(self, old: Document, new: Document) -> bool:
+        return self.values(old) == self.values(new) and self.entry(old) == self.entry(new)
+
+    def conflicts(self, doc: Document) -> bool:
+        if not self.unique:
+            return False
+        for value in self.values(doc):
+            if any(entry[2] != doc["_id"] for entry in self.buckets.get(value, ())):
+                return True
+        return False
+
+    def rebuild(self, docs: Iterable[Document]) -> None:
+        self.buckets = {}
+        for doc in docs:
+            entry = self.entry(doc)
+            for value in self.values(doc):
+                self.buckets.setdefault(value, []).append(entry)
+        for bucket in self.buckets.values():
+            bucket.sort()
+
+    def serves(self, sort: SortSpec) -> Optional[bool]:
+        """Scan direction (True = reverse) that yields ``sort`` order, or None."""
+        if not sort:
+            return False
+        fields = [field for field, _ in sort]
+        directions = {1 if d > 0 else -1 for _, d in sort}
+        if len(directions) != 1 or fields != (self.rest + ["_id"])[: len(fields)]:
+            return None
+        return directions == {-1}
+
+
+# ---------------------------------------------------------------------------
+# Cursors
+
+
+class MemoryCursor:
+    """What ``find`` returns: chainable, async-iterable, ``to_list``."""
+
+    def __init__(self, collection: "MemoryCollection", query: Optional[Document], projection: Any) -> None:
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort: SortSpec = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[Iterator[Document]] = None
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "MemoryCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, n: int) -> "MemoryCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = n
+        return self
+
+    def hint(self, index: Any) -> "MemoryCursor":
+        if isinstance(index, str) and index not in self._collection._indexes and index != "_id_":
+            raise OperationFailure("hint provided does not correspond to an existing index")
+        return self
+
+    def batch_size(self, n: int) -> "MemoryCursor":
+        return self
+
+    def _documents(self) -> List[Document]:
+        docs = self._collection._select(self._query, self._sort, self._skip + self._limit if self._limit else 0)
+        docs = docs[self._skip :]
+        if self._limit:
+            docs = docs[: self._limit]
+        return [project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Document]:
+        await self._collection._roundtrip("find")
+        docs = self._documents()
+        return docs[:length] if length else docs
+
+    def __aiter__(self) -> "MemoryCursor":
+        return self
+
+    async def __anext__(self) -> Document:
+        if self._results is None:
+            await self._collection._roundtrip("find")
+            self._results = iter(self._documents())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _ListCursor:
+    """Result of ``aggregate``."""
+
+    def __init__(self, load: Callable[[], "asyncio.Future[List[Document]]"]) -> None:
+        self._load = load
+        self._results: Optional[Iterator[Document]] = None
+
+    async def to_list(self, length: Optional[int] = None) -> List[Document]:
+        docs = await self._load()
+        return docs[:length] if length else docs
+
+    def __aiter__(self) -> "_ListCursor":
+        return self
+
+    async def __anext__(self) -> Document:
+        if self._results is None:
+            self._results = iter(await self._load())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+# ---------------------------------------------------------------------------
+# Collections
+
+
+class MemoryCollection:
+    """One collection; see the module docstring for what it supports."""
+
+    def __init__(self, name: str = "collection", database: Optional["MemoryDatabase"] = None, latency_ms: float = 0.0):
+        self.name = name
+        self.database = database
+        self.latency = latency_ms / 1000
+        self._docs: Dict[Any, Document] = {}
+        self._indexes: Dict[str, _Index] = {}
+        self.calls: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    async def _roundtrip(self, op: str) -> None:
+        self.calls[op] += 1
+        await asyncio.sleep(self.latency)
+
+    # -- storage --------------------------------------------------------
+
+    def _check_unique(self, doc: Document) -> None:
+        for index in self._indexes.values():
+            if index.conflicts(doc):
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {index.name}")
+
+    def _insert(self, doc: Document) -> None:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc
+        for index in self._indexes.values():
+            index.add(doc)
+
+    def _replace(self, old: Document, new: Document) -> None:
+        changed = [index for index in self._indexes.values() if not index.unchanged(old, new)]
+        for index in changed:
+            index.remove(old)
+        try:
+            self._check_unique(new)
+        except DuplicateKeyError:
+            for index in changed:
+                index.add(old)
+            raise
+        for index in changed:
+            index.add(new)
+        self._docs[new["_id"]] = new
+
+    def _delete(self, doc: Document) -> None:
+        for index in self._indexes.values():
+            index.remove(doc)
+        del self._docs[doc["_id"]]
+
+    def load(self, docs: Iterable[Document]) -> int:
+        """Bulk-insert seed documents as they are (not copied), then index them."""
+        n = 0
+        for doc in docs:
+            self._docs[doc["_id"]] = doc
+            n += 1
+        for index in self._indexes.values():
+            index.rebuild(self._docs.values())
+        return n
+
+    def _select(self, query: Document, sort: SortSpec, limit: int = 0) -> List[Document]:
+        """Stored documents matching ``query`` in ``sort`` order (not copied)."""
+        _id = query.get("_id", _MISSING)
+        if _id is not _MISSING and _hashable(_id):
+            doc = self._docs.get(_id)
+            return [doc] if doc is not None and matches(doc, query) else []
+        if isinstance(_id, dict) and set(_id) == {"$in"}:
+            found = (self._docs.get(i) for i in dict.fromkeys(i for i in _id["$in"] if _hashable(i)))
+            return self._sorted([d for d in found if d is not None and matches(d, query)], sort)
+
+        for index in self._indexes.values():
+            condition = query.get(index.field, _MISSING)
+            if isinstance(condition, dict) and set(condition) == {"$in"}:
+                values = [v for v in condition["$in"] if _hashable(v)]
+            elif condition is not _MISSING and _hashable(condition):
+                values = [condition]
+            else:
+                continue
+            reverse = index.serves(sort) if len(values) == 1 else None
+            if reverse is not None:
+                # Walk the index in sort order and stop once the page is full
+                bucket = index.buckets.get(values[0], [])
+                out: List[Document] = []
+                for entry in reversed(bucket) if reverse else bucket:
+                    doc = self._docs[entry[2]]
+                    if matches(doc, query):
+                        out.append(doc)
+                        if limit and len(out) >= limit:
+                            break
+                return out
+            ids = dict.fromkeys(entry[2] for v in values for entry in index.buckets.get(v, ()))
+            return self._sorted([self._docs[i] for i in ids if matches(self._docs[i], query)], sort)
+
+        return self._sorted([doc for doc in self._docs.values() if matches(doc, query)], sort)
+
+    @staticmethod
+    def _sorted(docs: List[Document], sort: SortSpec) -> List[Document]:
+        # Stable sorts from the last key to the first give a multi-key sort
+        for field, direction in reversed(sort):
+            docs.sort(key=lambda d: order_key(_value(d, field)), reverse=direction < 0)
+        return docs
+
+    def _first(self, query: Optional[Document], sort: Any = None) -> Optional[Document]:
+        docs = self._select(query or {}, _normalize_sort(sort), 1)
+        return docs[0] if docs else None
+
+    # -- reads ----------------------------------------------------------
+
+    def find(self, filter: Optional[Document] = None, projection: Any = None, sort: Any = None, limit: int = 0, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection)
+        if sort is not None:
+            cursor.sort(sort)
+        return cursor.limit(limit)
+
+    async def find_one(self, filter: Optional[Document] = None, projection: Any = None, sort: Any = None, **kwargs) -> Optional[Document]:
+        await self._roundtrip("find_one")
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        doc = self._first(filter, sort)
+        return project(doc, projection) if doc is not None else None
+
+    async def count_documents(self, filter: Optional[Document] = None, **kwargs) -> int:
+        await self._roundtrip("count_documents")
+        return len(self._select(filter, [])) if filter else len(self._docs)
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        await self._roundtrip("estimated_document_count")
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[Document] = None, **kwargs) -> List[Any]:
+        await self._roundtrip("distinct")
+        seen: Dict[Tuple, Any] = {}
+        for doc in self._select(filter or {}, []):
+            value = _get(doc, key)
+            if value is _MISSING:
+                continue
+            for v in value if isinstance(value, list) else [value]:
+                seen.setdefault(order_key(v), v)
+        return list(seen.values())
+
+    def aggregate(self, pipeline: List[Document], **kwargs) -> _ListCursor:
+        async def load() -> List[Document]:
+            await self._roundtrip("aggregate")
+            return self._aggregate(pipeline)
+
+        return _ListCursor(load)
+
+    # -- writes ---------------------------------------------------------
+
+    async def insert_one(self, document: Document, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("insert_one")
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        self._insert(_copy(document))
+        return SimpleNamespace(inserted_id=document["_id"], acknowledged=True)
+
+    async def insert_many(self, documents: Iterable[Document], ordered: bool = True, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("insert_many")
+        result = self._bulk([InsertOne(d) for d in documents], ordered)
+        return SimpleNamespace(inserted_ids=result.inserted_ids, acknowledged=True)
+
+    async def update_one(self, filter: Document, update: Any, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("update_one")
+        return self._update(filter, update, upsert, many=False)
+
+    async def update_many(self, filter: Document, update: Any, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("update_many")
+        return self._update(filter, update, upsert, many=True)
+
+    async def replace_one(self, filter: Document, replacement: Document, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("replace_one")
+        return self._update(filter, replacement, upsert, many=False)
+
+    async def delete_one(self, filter: Document, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("delete_one")
+        return SimpleNamespace(deleted_count=self._remove(filter, many=False), acknowledged=True)
+
+    async def delete_many(self, filter: Document, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("delete_many")
+        return SimpleNamespace(deleted_count=self._remove(filter, many=True), acknowledged=True)
+
+    async def find_one_and_update(
+        self,
+        filter: Document,
+        update: Any,
+        projection: Any = None,
+        sort: Any = None,
+        upsert: bool = False,
+        return_document: bool = False,
+        **kwargs,
+    ) -> Optional[Document]:
+        await self._roundtrip("find_one_and_update")
+        before = self._first(filter, sort)
+        if before is None:
+            if not upsert:
+                return None
+            after = self._upsert(filter, update)
+            return project(after, projection) if return_document else None
+        after = apply_update(_copy(before), update)
+        after["_id"] = before["_id"]
+        self._replace(before, after)
+        return project(after if return_document else before, projection)
+
+    async def find_one_and_delete(self, filter: Document, projection: Any = None, sort: Any = None, **kwargs) -> Optional[Document]:
+        await self._roundtrip("find_one_and_delete")
+        doc = self._first(filter, sort)
+        if doc is None:
+            return None
+        self._delete(doc)
+        return project(doc, projection)
+
+    async def bulk_write(self, requests: Sequence[Any], ordered: bool = True, **kwargs) -> SimpleNamespace:
+        await self._roundtrip("bulk_write")
+        return self._bulk(requests, ordered)
+
+    def _upsert(self, filter: Document, update: Any) -> Document:
+        doc = apply_update(_upsert_seed(filter), update, inserting=True)
+        if "_id" not in doc:
+            seed_id = _get(filter, "_id")
+            doc["_id"] = seed_id if seed_id is not _MISSING and _hashable(seed_id) else ObjectId()
+        self._insert(doc)
+        return doc
+
+    def _update(self, filter: Document, update: Any, upsert: bool, many: bool) -> SimpleNamespace:
+        targets = self._select(filter, []) if many else [d for d in [self._first(filter)] if d is not None]
+        modified = 0
+        for before in targets:
+            after = apply_update(_copy(before), update)
+            after["_id"] = before["_id"]
+            if after != before:
+                self._replace(before, after)
+                modified += 1
+        upserted_id = None
+        if not targets and upsert:
+            upserted_id = self._upsert(filter, update)["_id"]
+        return SimpleNamespace(
+            matched_count=len(targets), modified_count=modified, upserted_id=upserted_id, acknowledged=True
+        )
+
+    def _remove(self, filter: Document, many: bool) -> int:
+        targets = self._select(filter, []) if many else [d for d in [self._first(filter)] if d is not None]
+        for doc in targets:
+            self._delete(doc)
+        return len(targets)
+
+    def _bulk(self, requests: Sequence[Any], ordered: bool) -> SimpleNamespace:
+        result = SimpleNamespace(
+            inserted_count=0,
+            matched_count=0,
+            modified_count=0,
+            deleted_count=0,
+            upserted_count=0,
+            upserted_ids={},
+            inserted_ids=[],
+            acknowledged=True,
+        )
+        errors: List[Document] = []
+        for i, op in enumerate(requests):
+            try:
+                if isinstance(op, InsertOne):
+                    doc = op._doc
+                    if "_id" not in doc:
+                        doc["_id"] = ObjectId()
+                    self._insert(_copy(doc))
+                    result.inserted_count += 1
+                    result.inserted_ids.append(doc["_id"])
+                elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                    res = self._update(op._filter, op._doc, bool(op._upsert), many=isinstance(op, UpdateMany))
+                    result.matched_count += res.matched_count
+                    result.modified_count += res.modified_count
+                    if res.upserted_id is not None:
+                        result.upserted_count += 1
+                        result.upserted_ids[i] = res.upserted_id
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    result.deleted_count += self._remove(op._filter, many=isinstance(op, DeleteMany))
+                else:
+                    raise OperationFailure(f"unsupported bulk operation {type(op).__name__}")
+            except DuplicateKeyError as exc:
+                errors.append({"index": i, "code": 11000, "errmsg": str(exc), "op": getattr(op, "_doc", None)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError(
+                {
+                    "writeErrors": errors,
+                    "writeConcernErrors": [],
+                    "nInserted": result.inserted_count,
+                    "nUpserted": result.upserted_count,
+                    "nMatched": result.matched_count,
+                    "nModified": result.modified_count,
+                    "nRemoved": result.deleted_count,
+                    "upserted": [{"index": i, "_id": _id} for i, _id in result.upserted_ids.items()],
+                }
+            )
+        return result
+
+    # -- indexes --------------------------------------------------------
+
+    async def create_index(self, keys: Any, name: Optional[str] = None, unique: bool = False, sparse: bool = False, **kwargs) -> str:
+        await self._roundtrip("create_index")
+        spec = _normalize_keys(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in spec)
+        if name not in self._indexes and spec != [("_id", 1)]:
+            index = _Index(name, spec, unique, sparse)
+            index.rebuild(self._docs.values())
+            if unique and any(len({e[2] for e in bucket}) > 1 for bucket in index.buckets.values()):
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+            self._indexes[name] = index
+        return name
+
+    async def index_information(self, **kwargs) -> Dict[str, Document]:
+        await self._roundtrip("index_information")
+        info: Dict[str, Document] = {"_id_": {"key": [("_id", 1)]}}
+        for name, index in self._indexes.items():
+            info[name] = {"key": list(index.keys), **({"unique": True} if index.unique else {})}
+        return info
+
+    async def drop_index(self, index_or_name: Any, **kwargs) -> None:
+        await self._roundtrip("drop_index")
+        if isinstance(index_or_name, str):
+            name = index_or_name
+        else:
+            name = "_".join(f"{field}_{direction}" for field, direction in _normalize_keys(index_or_name))
+        if self._indexes.pop(name, None) is None:
+            raise OperationFailure(f"index not found with name [{name}]", code=27)
+
+    async def drop(self) -> None:
+        await self._roundtrip("drop")
+        self._docs = {}
+        self._indexes = {}
+
+    # -- aggregation ----------------------------------------------------
+
+    def _aggregate(self, pipeline: List[Document]) -> List[Document]:
+        docs: List[Document] = []
+        stages = list(pipeline)
+        if stages and "$match" in stages[0]:
+            # Like the server, an initial $match can use an index
+            docs = [_copy(d) for d in self._select(stages.pop(0)["$match"], [])]
+        else:
+            docs = [_copy(d) for d in self._docs.values()]
+        for stage in stages:
+            (name, spec), = stage.items()
+            if name == "$match":
+                docs = [d for d in docs if matches(d, spec)]
+            elif name == "$project":
+                docs = [_project_stage(d, spec) for d in docs]
+            elif name in ("$set", "$addFields", "$unset"):
+                docs = [_apply_pipeline(d, [stage]) for d in docs]
+            elif name == "$sort":
+                docs = self._sorted(docs, _normalize_sort(spec))
+            elif name == "$skip":
+                docs = docs[spec:]
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$group":
+                docs = _group(docs, spec)
+            elif name == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            elif name == "$out":
+                if self.database is None:
+                    raise OperationFailure("$out needs a collection that belongs to a MemoryDatabase")
+                target = self.database[spec]
+                target._docs = {}
+                target.load(docs)
+                return []
+            else:
+                raise OperationFailure(f"unsupported aggregation stage {name}")
+        return docs
+
+
+def _project_stage(doc: Document, spec: Document) -> Document:
+    if all(v in (0, False) for k, v in spec.items() if k != "_id") and any(k != "_id" for k in spec):
+        return project(doc, spec)
+    out: Document = {}
+    if spec.get("_id", 1) in (1, True) and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for field, expr in spec.items():
+        if field == "_id" and expr in (0, 1, True, False):
+            continue
+        if expr in (1, True):
+            value = _get(doc, field)
+            if value is not _MISSING:
+                _set(out, field, value)
+        elif expr not in (0, False):
+            _set(out, field, evaluate(expr, doc))
+    return out
+
+
+_ACCUMULATORS = ("$sum", "$first", "$last", "$max", "$min", "$push", "$addToSet", "$avg", "$count")
+
+
+def _group(docs: List[Document], spec: Document) -> List[Document]:
+    groups: Dict[Tuple, Document] = {}
+    values: Dict[Tuple, Dict[str, List[Any]]] = {}
+    for doc in docs:
+        key_value = evaluate(spec["_id"], doc)
+        key = order_key(key_value)
+        if key not in groups:
+            groups[key] = {"_id": key_value}
+            values[key] = {field: [] for field in spec if field != "_id"}
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            (op, expr), = acc.items()
+            values[key][field].append(1 if op == "$count" else evaluate(expr, doc))
+    out = []
+    for key, group in groups.items():
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            op = next(iter(acc))
+            items = values[key][field]
+            if op in ("$sum", "$count"):
+                group[field] = sum(v for v in items if isinstance(v, (int, float)) and not isinstance(v, bool))
+            elif op == "$avg":
+                numbers = [v for v in items if isinstance(v, (int, float)) and not isinstance(v, bool)]
+                group[field] = sum(numbers) / len(numbers) if numbers else None
+            elif op == "$first":
+                group[field] = items[0]
+            elif op == "$last":
+                group[field] = items[-1]
+            elif op in ("$max", "$min"):
+                group[field] = _extreme(items, op == "$max")
+            elif op == "$push":
+                group[field] = items
+            elif op == "$addToSet":
+                group[field] = list({order_key(v): v for v in items}.values())
+            else:
+                raise OperationFailure(f"unsupported accumulator {op}")
+        out.append(group)
+    return out
+
+
+class MemoryDatabase:
+    """Collections by name, created on first use like Motor's."""
+
+    def __init__(self, name: str = "test", latency_ms: float = 0.0) -> None:
+        self.name = name
+        self.latency_ms = latency_ms
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(name, self, self.latency_ms)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def calls(self) -> Dict[str, Dict[str, int]]:
+        """Operation counts per collection."""
+        return {name: dict(c.calls) for name, c in self._collections.items() if c.calls}
+
+
+class MemoryClient:
+    def __init__(self, latency_ms: float = 0.0) -> None:
+        self.latency_ms = latency_ms
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(name, self.latency_ms)
+        return database
+
+    def close(self) -> None:
+        pass
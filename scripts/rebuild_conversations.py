@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+from app.changes import ChangeLog
+from app.config import (
+    MONGODB_URI,
+    DATABASE_NAME,
+    COLLECTION_MESSAGES,
+    COLLECTION_CONVERSATIONS,
+    COLLECTION_CHANGES,
+    COLLECTION_COUNTERS,
+)
+from app.conversations import rebuild_conversations
+
+
+async def main() -> None:
+    if not MONGODB_URI:
+        raise RuntimeError("MONGODB_URI is not set. Define it in .env before running the rebuild.")
+
+    client = AsyncIOMotorClient(MONGODB_URI)
+    db = client[DATABASE_NAME]
+    # Summaries the running API updates meanwhile are recomputed from the change log
+    changelog = ChangeLog(db[COLLECTION_CHANGES], db[COLLECTION_COUNTERS])
+    count = await rebuild_conversations(db[COLLECTION_MESSAGES], db[COLLECTION_CONVERSATIONS], changelog)
+    client.close()
+    print(json.dumps({"conversations": count}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
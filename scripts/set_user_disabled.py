@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Disable (or re-enable) a user and drop it from the API workers' caches.
+
+With ``WS_BACKPLANE=unix`` running workers are told straight away; with the
+default local backplane they notice within AUTH_CACHE_TTL_SECONDS.
+
+    python scripts/set_user_disabled.py alice
+    python scripts/set_user_disabled.py alice --enable
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_PATH = ROOT / "backend"
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+from app.auth import user_changed
+from app.backplane import create_backplane
+from app.config import AUTH_CACHE_TTL_SECONDS, COLLECTION_USERS, DATABASE_NAME, MONGODB_URI, WS_BACKPLANE
+from app.ws import manager
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("username")
+    parser.add_argument("--enable", action="store_true", help="Re-enable instead of disabling")
+    args = parser.parse_args()
+
+    if not MONGODB_URI:
+        raise RuntimeError("MONGODB_URI is not set. Define it in .env before changing users.")
+
+    client = AsyncIOMotorClient(MONGODB_URI)
+    users = client[DATABASE_NAME][COLLECTION_USERS]
+    user = await users.find_one_and_update(
+        {"username": args.username}, {"$set": {"disabled": not args.enable}}, projection={"_id": 1}
+    )
+    client.close()
+    if user is None:
+        raise SystemExit(f"No such user: {args.username}")
+
+    await manager.start(create_backplane())
+    try:
+        await user_changed(user["_id"], args.username)
+    finally:
+        await manager.stop()
+    print(
+        json.dumps(
+            {
+                "username": args.username,
+                "disabled": not args.enable,
+                "workers_notified": WS_BACKPLANE != "local",
+                "cache_ttl_seconds": AUTH_CACHE_TTL_SECONDS,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())